@@ -88,6 +88,13 @@ class Blender2OgreAddonPreferences(bpy.types.AddonPreferences):
         default=config.CONFIG['SHADER_PROGRAMS'],
         update=apply_preferences_to_config
     )
+    STAGING_DIR : bpy.props.StringProperty(
+        name="STAGING_DIR",
+        description="Directory where the intermediate XML files are written and converted, only the results are moved to the export path (empty, missing or not writable: the export path itself)",
+        subtype='DIR_PATH',
+        default=config.CONFIG['STAGING_DIR'],
+        update=apply_preferences_to_config
+    )
 
     def draw(self, context):
         layout = self.layout
@@ -97,6 +104,7 @@ class Blender2OgreAddonPreferences(bpy.types.AddonPreferences):
         layout.prop(self, "IMAGE_MAGICK_CONVERT")
         layout.prop(self, "USER_MATERIALS")
         layout.prop(self, "SHADER_PROGRAMS")      
+        layout.prop(self, "STAGING_DIR")
 
 def register():
     logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='[%(levelname)5s] %(message)s', datefmt='%H:%M:%S')
@@ -15,6 +15,17 @@ MESH_TOOL_VERSIONS = [
     ('v2', 'v2', 'Export the mesh as a v2 object')
 ]
 
+SHARED_GEOMETRY_MODES = [
+    ('shared', 'shared', 'All submeshes use one shared vertex buffer'),
+    ('dedicated', 'dedicated', 'Every submesh gets a vertex buffer with only its own vertices'),
+    ('auto', 'auto', 'Use dedicated vertex buffers when the submeshes share few vertices')
+]
+
+MESH_SERIALIZERS = [
+    ('converter', 'converter', 'Write .mesh.xml files and convert them with OgreXMLConverter / OgreMeshTool'),
+    ('native', 'native', 'Write binary .mesh files directly (Ogre 1.10+ format), no Ogre command line tools needed')
+]
+
 TANGENT_MODES =  [
     ('0', 'none', 'Do not export tangents'),
     ('3', 'generate', 'Generate tangents'),
@@ -23,8 +34,9 @@ TANGENT_MODES =  [
 
 LOD_METHODS =  [
     ('0', 'meshtools', 'Generate LODs using OgreMesh Tools: does LOD by removing edges, which allows only changing the index buffer and re-use the vertex-buffer (storage efficient)'),
-    ('1', 'blender', 'Generate LODs using Blenders "Decimate" Modifier: does LOD by collapsing vertices, which can result in a visually better LOD, but needs different vertex-buffers per LOD'),
-    ('2', 'manual', 'Generate LODs by manually crafting the lower LODs: needs different vertex-buffers per LOD')
+    ('1', 'blender', 'Generate LODs using Blenders "Decimate" Modifier: does LOD by collapsing vertices, which can result in a visually better LOD, but needs extra vertices per LOD (appended to the vertex-buffer of the mesh when possible, else separate LOD meshes)'),
+    ('2', 'manual', 'Generate LODs by manually crafting the lower LODs: needs extra vertices per LOD (appended to the vertex-buffer of the mesh when possible, else separate LOD meshes)'),
+    ('3', 'exporter', 'Generate LODs with the exporters own quadric error simplifier: only changes the index buffer and re-uses the vertex-buffer (storage efficient), without Ogre tools or temporary Blender meshes')
 ]
 
 CONFIG_PATH = bpy.utils.user_resource('CONFIG', path='scripts', create=True)
@@ -37,7 +49,9 @@ _CONFIG_DEFAULTS_ALL = {
     # General
     'SWAP_AXIS' : 'xz-y',
     'MESH_TOOL_VERSION' : 'v2',
+    'MESH_SERIALIZER' : 'converter',
     'EXPORT_XML_DELETE' : True,
+    'XML_FLOAT_PRECISION' : 6,
 
     # Scene
     'SCENE' : True,
@@ -79,10 +93,16 @@ _CONFIG_DEFAULTS_ALL = {
     'EXTREMITY_POINTS' : 0,
     'GENERATE_EDGE_LISTS' : False,
     'GENERATE_TANGENTS' : '0',
+    'VERTEX_WELD_TOLERANCE' : 0.0,
+    'SHARED_GEOMETRY' : 'shared',
+    'SPLIT_16BIT_SUBMESHES' : False,
     'PACK_INT_10_10_10_2': False,
+    'VERTEX_PACKING' : '',
     'OPTIMISE_ANIMATIONS' : True,
     'INTERFACE_TOGGLE': False,
     'OPTIMISE_VERTEX_CACHE' : False,
+    'OPTIMISE_OVERDRAW' : False,
+    'OVERDRAW_THRESHOLD' : 1.05,
     'OPTIMISE_VERTEX_BUFFERS' : True,
     'OPTIMISE_VERTEX_BUFFERS_OPTIONS' : 'puqs',
 
@@ -95,6 +115,7 @@ _CONFIG_DEFAULTS_ALL = {
     # Pose Animation
     'SHAPE_ANIMATIONS' : True,
     'SHAPE_NORMALS' : True,
+    'SHAPE_OFFSET_EPSILON' : 0.0,
 
     # Logging
     'ENABLE_LOGGING' : False,
@@ -111,7 +132,7 @@ _CONFIG_DEFAULTS_ALL = {
     'IMPORT_SHAPEKEYS' : True,
 }
 
-_CONFIG_TAGS_ = 'OGRETOOLS_XML_CONVERTER OGRETOOLS_MESH_UPGRADER MESH_PREVIEWER IMAGE_MAGICK_CONVERT USER_MATERIALS SHADER_PROGRAMS'.split()
+_CONFIG_TAGS_ = 'OGRETOOLS_XML_CONVERTER OGRETOOLS_MESH_UPGRADER MESH_PREVIEWER IMAGE_MAGICK_CONVERT USER_MATERIALS SHADER_PROGRAMS STAGING_DIR'.split()
 
 ''' todo: Change pretty much all of these windows ones. Make a smarter way of detecting
     Ogre tools from various default folders. Also consider making a installer that
@@ -123,7 +144,8 @@ _CONFIG_DEFAULTS_WINDOWS = {
     'MESH_PREVIEWER' : 'ogre-meshviewer.bat',
     'IMAGE_MAGICK_CONVERT' : 'C:\\Program Files\\ImageMagick\\convert.exe',
     'USER_MATERIALS' : '',
-    'SHADER_PROGRAMS' : 'C:\\'
+    'SHADER_PROGRAMS' : 'C:\\',
+    'STAGING_DIR' : ''
 }
 
 _CONFIG_DEFAULTS_UNIX = {
@@ -135,6 +157,9 @@ _CONFIG_DEFAULTS_UNIX = {
     'MESH_PREVIEWER' : 'ogre-meshviewer',
     'USER_MATERIALS' : '',
     'SHADER_PROGRAMS' : '~/',
+    # write and convert the .mesh.xml / .skeleton.xml files in memory (tmpfs) instead of the output directory,
+    # where there is no /dev/shm (e.g. macOS) util.staging_dir() falls back to the output directory
+    'STAGING_DIR' : '/dev/shm',
     #'USER_MATERIALS' : '~/ogre_src_v1-7-3/Samples/Media/materials',
     #'SHADER_PROGRAMS' : '~/ogre_src_v1-7-3/Samples/Media/materials/programs',
 }
@@ -0,0 +1,53 @@
+# Number formatting of the XML writers (.mesh.xml, .skeleton.xml and .scene)
+# The floats are written with XML_FLOAT_PRECISION decimals ('%.6f' by default),
+# precision 0 writes the shortest text that reads back as the same 32 bit float (Ogre Real)
+
+import numpy as np
+from . import config
+
+SHORTEST = 0
+
+def get_precision(precision=None):
+    if precision is None:
+        precision = config.get('XML_FLOAT_PRECISION')
+    return precision
+
+def float_spec(precision=None):
+    """
+    Returns the %-format specifier of a float in the templates filled by record_values(), '%s' with the shortest round trip
+    """
+    precision = get_precision(precision)
+    if precision == SHORTEST:
+        return '%s'
+    return '%%.%df' % precision
+
+def format_floats(values, precision=None):
+    """
+    Returns the numbers of the array as an array of strings of the same shape
+    """
+    values = np.asarray(values)
+    precision = get_precision(precision)
+    if precision == SHORTEST:
+        # numpy converts floats to the shortest string that round trips in their own type
+        return values.astype(np.float32).astype(str)
+    return np.char.mod('%%.%df' % precision, values.astype(np.float64))
+
+def format_float(value, precision=None):
+    precision = get_precision(precision)
+    if precision == SHORTEST:
+        return str(np.float32(value))
+    return '%.*f' % (precision, value)
+
+def record_values(columns, precision=None):
+    """
+    Returns the values of a list of records as a flat list, to fill a template of the records (see SimpleSaxWriter.template())
+    columns: list of (N, k) arrays in the order of the template, integer arrays fill '%d' specifiers and float arrays float_spec()
+    """
+    columns = [np.asarray(column) for column in columns]
+    columns = [column.reshape(len(column), -1) for column in columns]
+    if get_precision(precision) != SHORTEST:
+        # Integers up to 2^53 are exact as float64, so '%d' gives the same text
+        return np.concatenate([column.astype(np.float64) for column in columns], axis=1).reshape(-1).tolist()
+    return np.concatenate([
+        column.astype(object) if column.dtype.kind in 'iub' else format_floats(column, precision).astype(object)
+        for column in columns], axis=1).reshape(-1).tolist()
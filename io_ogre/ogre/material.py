@@ -56,12 +56,13 @@ def dot_materials(materials, path=None, separate_files=True, prefix='mats', **kw
                 Report.materials.append( material_name(mat) )
                 generator = OgreMaterialGenerator(mat, path)
                 # Generate before copying textures to collect images first
-                material_text = generator.generate()
+                generator.generate()
                 if kwargs.get('copy_programs', config.get('COPY_SHADER_PROGRAMS')):
                     generator.copy_programs()
                 if kwargs.get('touch_textures', config.get('TOUCH_TEXTURES')):
                     generator.copy_textures()
-                fd.write(bytes(material_text + "\n", 'utf-8'))
+                generator.write_to(fd)
+                fd.write(b"\n")
 
             if include_missing:
                 fd.write(bytes(MISSING_MATERIAL + "\n", 'utf-8'))
@@ -80,7 +81,7 @@ def dot_material(mat, path, **kwargs):
     prefix = kwargs.get('prefix', '')
     generator = OgreMaterialGenerator(mat, path, prefix=prefix)
     # Generate before copying textures to collect images first
-    material_text = generator.generate()
+    generator.generate()
     if kwargs.get('copy_programs', config.get('COPY_SHADER_PROGRAMS')):
         generator.copy_programs()
     if kwargs.get('touch_textures', config.get('TOUCH_TEXTURES')):
@@ -89,7 +90,7 @@ def dot_material(mat, path, **kwargs):
         mat_file_name = join(path, clean_object_name(generator.material_name) + ".material")
         with open(mat_file_name, 'wb') as fd:
             _write_b2o_ver(fd)
-            fd.write(bytes(material_text, 'utf-8'))
+            generator.write_to(fd)
     except Exception as e:
         logger.error("Unable to create material file: %s" % mat_file_name)
         logger.error(e)
@@ -128,8 +129,14 @@ class OgreMaterialGenerator(object):
                     self.passes.append( node.material )
 
     def generate(self):
+        """
+        Generates the material script into self.w, see write_to()
+        """
+        # A fresh writer for every generated material
+        self.w = util.IndentedWriter()
         if self.material is None:
-            return MISSING_MATERIAL
+            self.w.write(MISSING_MATERIAL)
+            return
 
         self.generate_header()
         with self.w.iword('material').word(self.material_name).embed():
@@ -140,9 +147,11 @@ class OgreMaterialGenerator(object):
             with self.w.iword('technique').embed():
                 self.generate_passes()
 
-        text = self.w.text
-        self.w.text = ''
-        return text
+    def write_to(self, fd):
+        """
+        Writes the generated material script to the open file fd, without joining it into one string first
+        """
+        self.w.write_to(fd)
 
     def generate_header(self):
         for mat in self.passes:
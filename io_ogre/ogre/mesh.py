@@ -1,12 +1,15 @@
 import os, time, sys, logging
 import bmesh, mathutils, math
+import numpy as np
 
 from ..report import Report
 from ..util import *
 from ..xml import *
-from .. import util, config
+from .. import util, config, number_format
 from .material import *
 from .skeleton import Skeleton
+from .mesh_data import VertexData, SubMesh, Pose, PoseAnimation, MeshData
+from . import mesh_serializer, mesh_optimizer, mesh_simplifier
 
 logger = logging.getLogger('mesh')
 
@@ -46,19 +49,97 @@ class VertexColorLookup:
                 self.__colors = colors
 
             if self.__colors:
-                self.__colors = [x.color for x in self.__colors.data]
-                #self.__colors = [x.color_srgb for x in self.__colors.data]
+                # Read all colors at once (RGBA per item)
+                colors = np.empty(len(self.__colors.data) * 4, dtype=np.float32)
+                self.__colors.data.foreach_get('color', colors)
+                self.__colors = colors.reshape(-1, 4)
+                #self.__colors.data.foreach_get('color_srgb', colors)
 
     @property
     def has_color_data(self):
         return self.__colors is not None
 
-    def get(self, item):
-        if self.__colors:
-            color = self.__colors[item]
+    def get_array(self, loop_vertices):
+        """
+        Returns the colors of every loop (corner) of the mesh as an array of shape (L, 4)
+        loop_vertices: the vertex index of every loop, used when the colors are stored per vertex
+        """
+        if self.__colors is None:
+            return None
+        if len(self.__colors) != len(loop_vertices):
+            # Color attribute is in the 'POINT' domain
+            return self.__colors[loop_vertices]
+        return self.__colors
+
+class MeshArrays:
+    """
+    Reads all the data needed to export a mesh with foreach_get() into numpy arrays.
+    Vectors are already converted to Ogre coordinates (see util.swap_array())
+
+    positions: (V, 3) vertex positions
+    loop_vertices: (L,) vertex index of every loop (corner)
+    normals: (L, 3) split (corner) normals
+    tangents: (L, 4) tangents and bitangent sign, or None
+    colors: (L, 4) vertex colors, or None
+    uvs: list of (L, 2) arrays, one per UV layer
+    triangles: (T, 3) loop indices of every triangle
+    triangle_polygons: (T,) polygon index of every triangle
+    triangle_materials: (T,) material index of every triangle
+    """
+    def __init__(self, mesh, tangents=0, dotextures=True, vertex_color_lookup=None):
+        num_vertices = len(mesh.vertices)
+        num_loops = len(mesh.loops)
+
+        positions = np.empty(num_vertices * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', positions)
+        self.positions = util.swap_array(positions.reshape(-1, 3))
+
+        self.loop_vertices = np.empty(num_loops, dtype=np.int32)
+        mesh.loops.foreach_get('vertex_index', self.loop_vertices)
+
+        normals = np.empty(num_loops * 3, dtype=np.float32)
+        if bpy.app.version < (3, 6, 0):
+            mesh.loops.foreach_get('normal', normals)
         else:
-            color = [1.0] * 4
-        return color
+            mesh.corner_normals.foreach_get('vector', normals)
+        self.normals = util.swap_array(normals.reshape(-1, 3))
+
+        self.tangents = None
+        if tangents != 0:
+            loop_tangents = np.empty(num_loops * 3, dtype=np.float32)
+            mesh.loops.foreach_get('tangent', loop_tangents)
+            bitangent_signs = np.empty(num_loops, dtype=np.float32)
+            mesh.loops.foreach_get('bitangent_sign', bitangent_signs)
+            self.tangents = np.empty((num_loops, 4), dtype=np.float32)
+            self.tangents[:, :3] = util.swap_array(loop_tangents.reshape(-1, 3))
+            self.tangents[:, 3] = bitangent_signs
+
+        self.colors = None
+        if vertex_color_lookup is not None:
+            self.colors = vertex_color_lookup.get_array(self.loop_vertices)
+
+        self.uvs = []
+        if dotextures:
+            for layer in mesh.uv_layers:
+                uv = np.empty(num_loops * 2, dtype=np.float32)
+                layer.data.foreach_get('uv', uv)
+                self.uvs.append(uv.reshape(-1, 2))
+
+        # Triangles as calculated by mesh.calc_loop_triangles()
+        num_triangles = len(mesh.loop_triangles)
+        self.triangles = np.empty(num_triangles * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get('loops', self.triangles)
+        self.triangles = self.triangles.reshape(-1, 3)
+
+        self.triangle_polygons = np.empty(num_triangles, dtype=np.int32)
+        if hasattr(mesh, 'loop_triangle_polygons'):
+            mesh.loop_triangle_polygons.foreach_get('value', self.triangle_polygons)
+        else:
+            mesh.loop_triangles.foreach_get('polygon_index', self.triangle_polygons)
+
+        polygon_materials = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get('material_index', polygon_materials)
+        self.triangle_materials = polygon_materials[self.triangle_polygons]
 
 def dot_mesh(ob, path, force_name=None, ignore_shape_animation=False, normals=True, tangents=4, isLOD=False, **kwargs):
     """
@@ -70,13 +151,22 @@ def dot_mesh(ob, path, force_name=None, ignore_shape_animation=False, normals=Tr
     kwargs:
       * material_prefix - string. (optional)
       * overwrite - bool. (optional) default False
+      * defer_write - bool. (optional) default False, for LOD levels: nothing gets written,
+        returns (MeshData, write) where write() writes it as .mesh like dot_mesh() would have
     """
     obj_name = force_name or ob.data.name
     obj_name = clean_object_name(obj_name)
-    target_file = os.path.join(path, '%s.mesh.xml' % obj_name )
+
+    # Write the binary .mesh directly, or write .mesh.xml and convert it with OgreXMLConverter / OgreMeshTool
+    native = config.get('MESH_SERIALIZER') == 'native'
+    if native:
+        target_file = os.path.join(path, '%s.mesh' % obj_name )
+    else:
+        target_file = os.path.join(path, '%s.mesh.xml' % obj_name )
 
     material_prefix = kwargs.get('material_prefix', '')
     overwrite = kwargs.get('overwrite', False)
+    defer_write = kwargs.get('defer_write', False)
 
     # Don't export hidden or unselected objects unless told to
     if  not isLOD and (
@@ -87,7 +177,7 @@ def dot_mesh(ob, path, force_name=None, ignore_shape_animation=False, normals=Tr
         logger.debug("Skip exporting hidden/non-selected object: %s" % ob.data.name)
         return []
 
-    if os.path.isfile(target_file) and not overwrite:
+    if os.path.isfile(target_file) and not overwrite and not defer_write:
         return []
 
     if not os.path.isdir( path ):
@@ -132,799 +222,1051 @@ def dot_mesh(ob, path, force_name=None, ignore_shape_animation=False, normals=Tr
     Report.faces += len( mesh.loop_triangles )
     Report.orig_vertices += len( mesh.vertices )
 
-    logger.info('* Generating: %s.mesh.xml' % obj_name)
+    logger.info('* Generating: %s' % os.path.basename(target_file))
     logger.info("  - Vertices: %s" % len( mesh.vertices ))
     logger.info("  - Loop triangles: %s" % len( mesh.loop_triangles ))
 
+    # The file gets written in the staging directory (see write_mesh_data()), make sure it can be created there
+    probe_file = os.path.join(util.staging_dir(path), os.path.basename(target_file))
     try:
-        with open(target_file, 'w') as f:
-            f.flush()
+        if not defer_write:
+            with open(probe_file, 'w') as f:
+                f.flush()
     except Exception as e:
-        logger.error("Unable to create mesh file: %s" % target_file)
+        logger.error("Unable to create mesh file: %s" % probe_file)
         logger.error(e)
-        Report.errors.append("Unable to create mesh file: %s" % target_file)
+        Report.errors.append("Unable to create mesh file: %s" % probe_file)
         return []
 
-    with open(target_file, 'w') as f:
-        doc = SimpleSaxWriter(f, 'mesh', {})
+    mesh_data = MeshData(obj_name)
 
-        # Very ugly, have to replace number of vertices later
-        doc.start_tag('sharedgeometry', {'vertexcount' : '__TO_BE_REPLACED_VERTEX_COUNT__'})
+    logger.info('* Generating shared geometry')
 
-        logger.info('* Writing shared geometry')
+    # Print a warning if there are no UV Maps created for the object
+    # and the user requested to have tangents generated 
+    # (they won't be without a UV Map)
+    if int(config.get("GENERATE_TANGENTS")) != 0 and len(mesh.uv_layers) == 0:
+        logger.warning("No UV Maps were created for this object: <%s>, tangents won't be exported." % ob.name)
+        Report.warnings.append( 'Object "%s" has no UV Maps, tangents won\'t be exported.' % ob.name )
 
-        # Print a warning if there are no UV Maps created for the object
-        # and the user requested to have tangents generated 
-        # (they won't be without a UV Map)
-        if int(config.get("GENERATE_TANGENTS")) != 0 and len(mesh.uv_layers) == 0:
-            logger.warning("No UV Maps were created for this object: <%s>, tangents won't be exported." % ob.name)
-            Report.warnings.append( 'Object "%s" has no UV Maps, tangents won\'t be exported.' % ob.name )
-
-        # Textures
-        dotextures = False
-        if mesh.uv_layers:
-            dotextures = True
+    # Textures
+    dotextures = False
+    if mesh.uv_layers:
+        dotextures = True
+    else:
+        tangents = 0
+
+    # Materials
+    # saves tuples of material name and material obj (or None)
+    materials = []
+    # a material named 'vertex.color.<yourname>' will overwrite
+    # the diffuse color in the mesh file!
+
+    for mat in ob.data.materials:
+        mat_name = "_missing_material_"
+        if mat is not None:
+            mat_name = mat.name
+        mat_name = material_name(mat_name, prefix=material_prefix)
+        extern = False
+        if mat_name.startswith("extern."):
+            mat_name = mat_name[len("extern."):]
+            extern = True
+        if mat:
+            materials.append( (mat_name, extern, mat) )
         else:
-            tangents = 0
-
-        doc.start_tag('vertexbuffer', {
-                'positions':'true',
-                'normals':'true',
-                'tangents': str(bool(tangents)),
-                'tangent_dimensions': str(tangents),
-                'colours_diffuse' : str(bool( mesh.vertex_colors )),
-                'texture_coords' : '%s' % len(mesh.uv_layers) * dotextures
-        })
+            logger.warn('Bad material data in: %s' % ob.name)
+            materials.append( ('_missing_material_', True, None) ) # fixed dec22, keep proper index
+    if not materials:
+        materials.append( ('_missing_material_', True, None) )
+    vertex_groups = {}
+
+    if mesh.has_custom_normals:
+        logger.debug("* Mesh has custom normals")
+    else:
+        logger.debug("* Mesh has NO custom normals")
+
+    # Ogre only supports triangles, the triangles come from mesh.loop_triangles.
+    # Blender can only calculate tangents for triangles and quads though, so then polygons with more sides get triangulated first
+    _tess_polygon_face_map_ = None
+    if tangents != 0 and len(mesh.polygons) > 0:
+        loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get('loop_total', loop_totals)
+        if loop_totals.max() > 4:
+            logger.debug("* Triangulating polygons with more than 4 vertices for tangents")
+            _tess_polygon_face_map_ = triangulate_ngons(mesh)
+
+    # Vertex colors
+    vertex_color_lookup = VertexColorLookup(mesh)
+
+    if tangents != 0:
+        mesh.calc_tangents(uvmap=mesh.uv_layers.active.name)
+    else:
+        # calc_tangents() already calculates split normals for us
+        if bpy.app.version < (4, 1, 0):
+            mesh.calc_normals_split()
+
+    # Read all the mesh data at once, this is a lot faster than accessing each loop through the Python API
+    mesh_arrays = MeshArrays(mesh, tangents, dotextures, vertex_color_lookup)
+
+    # Find the unique Ogre vertices: corners that share the Blender vertex and all the exported attributes
+    ''' Flat shading in blender seems to work with face normals, so each flat face' vertices are
+        exported separately, the same happens for UV seams and vertex color borders
+    '''
+    weld_attributes = [mesh_arrays.normals] + mesh_arrays.uvs
+    if vertex_color_lookup.has_color_data:
+        weld_attributes.append(mesh_arrays.colors)
+    if tangents != 0:
+        weld_attributes.append(mesh_arrays.tangents)
+
+    triangle_materials = mesh_arrays.triangle_materials
+
+    vertex_corners, face_indices = weld_vertices(mesh_arrays.triangles, mesh_arrays.loop_vertices,
+        weld_attributes, config.get('VERTEX_WELD_TOLERANCE'))
+    del weld_attributes
+    numverts = len(vertex_corners)
+
+    vertex_loops = mesh_arrays.triangles.reshape(-1)[vertex_corners]
+    _remap_verts_ = mesh_arrays.loop_vertices[vertex_loops].tolist()
+    _face_indices_ = mesh_arrays.triangle_polygons[vertex_corners // 3].tolist()
+
+    shared_vertex_data = gather_vertex_data(mesh_arrays, vertex_loops, tangents)
+    mesh_data.shared_vertex_data = shared_vertex_data
+
+    # The per loop arrays are no longer needed, only the welded vertices are kept
+    del vertex_loops, vertex_corners, mesh_arrays
+
+    if len(triangle_materials) > 0 and triangle_materials.max() >= len(materials):
+        failure = 'FAILED to assign material to face - you might be using a Boolean Modifier between objects with different materials!'
+        failure += '[ mesh : %s ]' % mesh.name
+        Report.warnings.append( failure )
+        logger.error( failure )
+
+    # All the vertex group weights, for the vertex group submeshes and the bone assignments
+    group_weights = vertex_group_weights(mesh, ob)
+
+    # Triangles with all three vertices in an 'ogre.vertex.group.<name>' vertex group (and in no other vertex group) also go into a submesh of their own
+    group_names, group_membership = vertex_group_membership(group_weights, len(mesh.vertices), ob, 'ogre.vertex.group.')
+    if group_names:
+        in_group = group_membership[np.asarray(_remap_verts_)[face_indices]].all(axis=1)
+        # The submeshes are in order of the first triangle in each group
+        first_triangles = np.where(in_group.any(axis=0), in_group.argmax(axis=0), len(in_group))
+        for group in np.argsort(first_triangles, kind='stable').tolist():
+            vertex_groups[group_names[group]] = face_indices[in_group[:, group]]
+        del in_group, group_membership
+
+    # Split the index buffer by material once, so that only the submesh index buffers are kept
+    material_faces = { matidx : face_indices[triangle_materials == matidx] for matidx in range(len(materials)) }
+    del face_indices
+
+    Report.vertices += numverts
+
+    sys.stdout.write("\n")
+
+    logger.info('- Done at %s seconds' % util.timer_diff_str(start))
+    logger.info('* Generating submeshes')
+
+    # todo: why is the submesh name taken from the material
+    # when we have the blender object name available?
+    for matidx, (mat_name, extern, mat) in enumerate(materials):
+        faces = material_faces.get(matidx)
+        if faces is None or len(faces) == 0:
+            Report.warnings.append('BAD SUBMESH "%s": material %r, has not been applied to any faces - not exporting as submesh.' % (obj_name, mat_name) )
+            continue # fixes corrupt unused materials
+
+        material = None
+        if mat_name != "_missing_material_":
+            material = mat_name
+
+        mesh_data.submeshes.append( SubMesh(mat_name, material, faces) )
+        Report.triangles += len(faces)
+
+    for name, ogre_indices in vertex_groups.items():
+        if len(ogre_indices) <= 0:
+            continue
+        name = name[len('ogre.vertex.group.'):]
+        mesh_data.submeshes.append( SubMesh(name, "none", ogre_indices) )
+
+    logger.info('- Done at %s seconds' % util.timer_diff_str(start))
+
+    # (distance, (MeshData, write)) of the LOD levels of methods '1' and '2', see merge_lod_meshes()
+    lod_meshes = []
+
+    # Generate LOD levels for manual LOD meshes
+    if isLOD == False and ob.type == 'MESH' and config.get('LOD_LEVELS') > 0 and config.get('LOD_GENERATION') == '2':
+        lod_levels = config.get('LOD_LEVELS')
+        lod_distance = config.get('LOD_DISTANCE')
+
+        lod_generated = []
+        lod_current_distance = lod_distance
+
+        for level in range(lod_levels + 1)[1:]:
+            lod_ob_name = obj_name + '_LOD_' + str(level)
+            lod_manual_ob = bpy.context.scene.objects.get(lod_ob_name)
+
+            if lod_manual_ob:
+                logger.info("- Found LOD Manual object: %s" % lod_ob_name)
+                lod_generated.append({ 'level': level, 'distance': lod_current_distance, 'lod_manual_ob': lod_manual_ob })
+                lod_current_distance += lod_distance
 
-        # Materials
-        # saves tuples of material name and material obj (or None)
-        materials = []
-        # a material named 'vertex.color.<yourname>' will overwrite
-        # the diffuse color in the mesh file!
-
-        for mat in ob.data.materials:
-            mat_name = "_missing_material_"
-            if mat is not None:
-                mat_name = mat.name
-            mat_name = material_name(mat_name, prefix=material_prefix)
-            extern = False
-            if mat_name.startswith("extern."):
-                mat_name = mat_name[len("extern."):]
-                extern = True
-            if mat:
-                materials.append( (mat_name, extern, mat) )
             else:
-                logger.warn('Bad material data in: %s' % ob.name)
-                materials.append( ('_missing_material_', True, None) ) # fixed dec22, keep proper index
-        if not materials:
-            materials.append( ('_missing_material_', True, None) )
-        vertex_groups = {}
-        material_faces = []
-        for matidx, mat in enumerate(materials):
-            material_faces.append([])
-
-        shared_vertices = {}
-        _remap_verts_ = []
-        _face_indices_ = []
-
-        numverts = 0
-
-        # Create bmesh to help obtain custom vertex normals
-        bm = bmesh.new()
-        bm.from_mesh(mesh)
-        bm.verts.ensure_lookup_table()
-
-        if mesh.has_custom_normals:
-            logger.debug("* Mesh has custom normals")
-        else:
-            logger.debug("* Mesh has NO custom normals")
+                failure = 'FAILED to manually create LOD levels, manual LOD with name %s NOT FOUND!' % lod_ob_name
+                Report.warnings.append( failure )
+                logger.error( failure )
+                break
 
-        # Ogre only supports triangles
-        bmesh_return = bmesh.ops.triangulate(bm, faces=bm.faces, quad_method='FIXED')
-        bm.to_mesh(mesh)
-        
-        # Map the original face indices to the tesselated ones
-        face_map = bmesh_return['face_map']
+        # Export the LOD meshes, they go into the original .mesh or into .mesh files of their own (see merge_lod_meshes())
+        if len(lod_generated) > 0:
+            logger.info('- Generating: %s LOD meshes. Original: vertices %s, faces: %s' % (len(lod_generated), len(mesh.vertices), len(mesh.loop_triangles)))
+            for lod in lod_generated:
+                lod_manual_ob = lod['lod_manual_ob']
 
-        _tess_polygon_face_map_ = {}
+                logger.info("- Exporting LOD %s for distance %s, with %s vertices and %s faces" % 
+                    (lod['level'], lod['distance'], len(lod_manual_ob.data.vertices), len(lod_manual_ob.data.loop_triangles)))
 
-        for tess_face in face_map:
-            #print("tess_face.index[%s] <---> polygon_face.index[%s]" % (tess_face.index, face_map[tess_face].index))
-            _tess_polygon_face_map_[tess_face.index] = face_map[tess_face].index
+                # The distance is the value this LOD kicks in for the 'Distance' strategy.
+                lod_meshes.append( (lod['distance'],
+                    dot_mesh(lod_manual_ob, path, lod_manual_ob.data.name, ignore_shape_animation, normals, tangents, isLOD=True, defer_write=True)) )
 
-        # Vertex colors
-        vertex_color_lookup = VertexColorLookup(mesh)
+    # Generate LOD levels automatically using Blenders "Decimate" Modifier
+    if isLOD == False and ob.type == 'MESH' and config.get('LOD_LEVELS') > 0 and config.get('LOD_GENERATION') == '1':
+        lod_levels = config.get('LOD_LEVELS')
+        lod_distance = config.get('LOD_DISTANCE')
+        lod_ratio = config.get('LOD_PERCENT') / 100.0
+        lod_pre_mesh_count = len(bpy.data.meshes)
 
-        if tangents != 0:
-            mesh.calc_tangents(uvmap=mesh.uv_layers.active.name)
-        else:
-            # calc_tangents() already calculates split normals for us
-            if bpy.app.version < (4, 1, 0):
-                mesh.calc_normals_split()
+        # Cap lod levels to something sensible (what is it?)
+        if lod_levels > 10:
+            lod_levels = 10
 
-        progressbar = util.ProgressBar("Faces", len(mesh.polygons))
+        def duplicate_object(scene, name, copyobj):
+            # Create new mesh
+            mesh = bpy.data.meshes.new(name)
 
-        # Process mesh after triangulation
-        for F in mesh.polygons:
-            progressbar.update(F.index)
+            # Create new object associated with the mesh
+            ob_new = bpy.data.objects.new(name, mesh)
 
-            tri = (F.vertices[0], F.vertices[1], F.vertices[2])
-            face = []
-            for loop_idx, idx in zip(F.loop_indices, tri):
-                v = mesh.vertices[ idx ]
+            # Copy data block from the old object into the new object
+            ob_new.data = copyobj.data.copy()
+            ob_new.location = copyobj.location
+            ob_new.rotation_euler = copyobj.rotation_euler
+            ob_new.scale = copyobj.scale
 
-                if bpy.app.version < (3, 6, 0):
-                    nx,ny,nz = swap( mesh.loops[ loop_idx ].normal )
-                else:
-                    nx,ny,nz = swap( mesh.corner_normals[ loop_idx ].vector )
-
-                if tangents != 0:
-                    tx,ty,tz = swap( mesh.loops[ loop_idx ].tangent )
-                    tw = mesh.loops[ loop_idx ].bitangent_sign
-
-                r,g,b,ra = vertex_color_lookup.get(loop_idx)
-
-                # Texture maps
-                vert_uvs = []
-                if dotextures:
-                    for layer in mesh.uv_layers:
-                        vert_uvs.append( layer.data[ loop_idx ].uv )
-
-                ''' Check if we already exported that vertex with same normal, do not export in that case,
-                    (flat shading in blender seems to work with face normals, so we copy each flat face'
-                    vertices, if this vertex with same normals was already exported,
-                    todo: maybe not best solution, check other ways (let blender do all the work, or only
-                    support smooth shading, what about seems, smoothing groups, materials, ...)
-                '''
-                vert = VertexNoPos(numverts, nx, ny, nz, r, g, b, ra, vert_uvs)
-                alreadyExported = False
-                if idx in shared_vertices:
-                    for vert2 in shared_vertices[idx]:
-                        #does not compare ogre_vidx (and position at the moment)
-                        if vert == vert2:
-                            face.append(vert2.ogre_vidx)
-                            alreadyExported = True
-                            #print(idx, numverts, nx,ny,nz, r,g,b,ra, vert_uvs, "already exported")
-                            break
-                    if not alreadyExported:
-                        face.append(vert.ogre_vidx)
-                        shared_vertices[idx].append(vert)
-                        #print(numverts, nx,ny,nz, r,g,b,ra, vert_uvs, "appended")
-                else:
-                    face.append(vert.ogre_vidx)
-                    shared_vertices[idx] = [vert]
-                    #print(idx, numverts, nx,ny,nz, r,g,b,ra, vert_uvs, "created")
+            # Link new object to the given scene and select it
+            scene.collection.objects.link(ob_new)
+            ob_new.select_set(True)
 
-                if alreadyExported:
-                    continue
+            return ob_new, mesh
 
-                numverts += 1
-                _remap_verts_.append( v )
-                
-                # Use mapping from tesselated face to polygon face if the mapping exists
-                #if F.index in _tess_polygon_face_map_:
-                #    _face_indices_.append( _tess_polygon_face_map_[F.index] )
-                #else:
-                #    _face_indices_.append( F.index )
-                _face_indices_.append( F.index )
-
-                x,y,z = swap(v.co)        # xz-y is correct!
-
-                doc.start_tag('vertex', {})
-                doc.leaf_tag('position', {
-                        'x' : '%6f' % x,
-                        'y' : '%6f' % y,
-                        'z' : '%6f' % z
-                })
+        # Create a temporary duplicate
+        ob_copy, ob_copy_mesh = duplicate_object(bpy.context.scene, obj_name + "_LOD_TEMP_COPY", ob)
+        ob_copy_meshes = [ ob_copy.data, ob_copy_mesh ]
 
-                doc.leaf_tag('normal', {
-                        'x' : '%6f' % nx,
-                        'y' : '%6f' % ny,
-                        'z' : '%6f' % nz
-                })
+        # Activate clone for modifier manipulation
+        decimate = ob_copy.modifiers.new(name="Ogre-LOD_Decimate", type='DECIMATE')
+        if decimate is not None:
+            decimate.decimate_type = 'COLLAPSE'
+            decimate.show_viewport = True
+            decimate.show_render = True
 
-                if tangents != 0:
-                    doc.leaf_tag('tangent', {
-                            'x' : '%6f' % tx,
-                            'y' : '%6f' % ty,
-                            'z' : '%6f' % tz,
-                            'w' : '%6f' % tw
-                    })
+            lod_generated = []
+            lod_ratio_multiplier = 1.0 - lod_ratio
+            lod_current_ratio = 1.0 * lod_ratio_multiplier
+            lod_current_distance = lod_distance
+            lod_current_vertice_count = len(mesh.vertices)
+            lod_min_vertice_count = 12
 
-                if vertex_color_lookup.has_color_data:
-                    doc.leaf_tag('colour_diffuse', {'value' : '%6f %6f %6f %6f' % (r,g,b,ra)})
+            for level in range(lod_levels + 1)[1:]:
+                decimate.ratio = lod_current_ratio
+                
+                # https://docs.blender.org/api/current/bpy.types.Depsgraph.html
+                depsgraph = bpy.context.evaluated_depsgraph_get()
+                object_eval = ob_copy.evaluated_get(depsgraph)
+                lod_mesh = bpy.data.meshes.new_from_object(object_eval)
+                
+                ob_copy_meshes.append(lod_mesh)
 
-                # Texture maps
-                if dotextures:
-                    for uv in vert_uvs:
-                        doc.leaf_tag('texcoord', {
-                                'u' : '%6f' % uv[0],
-                                'v' : '%6f' % (1.0-uv[1])
-                        })
+                # Check min vertice count and that the vertice count got reduced from last iteration
+                lod_mesh_vertices = len(lod_mesh.vertices)
+                
+                if lod_mesh_vertices < lod_min_vertice_count:
+                    logger.info('- LOD level: %s, vertice count: %s too small. Ignoring LOD.' % (level, lod_mesh_vertices))
+                    break
+                if lod_mesh_vertices >= lod_current_vertice_count:
+                    logger.info('- LOD level: %s, vertice count: %s cannot be decimated any longer. Ignoring LOD.' % (level - 1, lod_mesh_vertices))
+                    break
+                # todo: should we check if the ratio gets too small? although its up to the user to configure from the export panel
 
-                doc.end_tag('vertex')
+                lod_generated.append({ 'level': level, 'distance': lod_current_distance, 'ratio': lod_current_ratio, 'mesh': lod_mesh })
+                lod_current_distance += lod_distance
+                lod_current_vertice_count = lod_mesh_vertices
+                lod_current_ratio *= lod_ratio_multiplier
 
-            append_triangle_in_vertex_group(mesh, ob, vertex_groups, face, tri)
+            # Export the LOD meshes, they go into the original .mesh or into .mesh files of their own (see merge_lod_meshes()).
+            # The decimate modifier generates fresh geometry, so the LOD levels need vertices of their own either way
+            if len(lod_generated) > 0:
+                logger.info('- Generating: %s LOD meshes. Original: vertices %s, faces: %s' % (len(lod_generated), len(mesh.vertices), len(mesh.loop_triangles)))
+                for lod in lod_generated:
+                    ratio_percent = round(lod['ratio'] * 100.0, 0)
+                    logger.info("- Exporting LOD %s for distance %s and ratio %s/100, with %s vertices, %s faces" % 
+                        (lod['level'], lod['distance'], str(ratio_percent), len(lod['mesh'].vertices), len(lod['mesh'].loop_triangles)))
+                    lod_ob_temp = bpy.data.objects.new(obj_name, lod['mesh'])
+                    lod_ob_temp.data.name = obj_name + '_LOD_' + str(lod['level'])
+
+                    # The distance is the value this LOD kicks in for the 'Distance' strategy.
+                    lod_meshes.append( (lod['distance'],
+                        dot_mesh(lod_ob_temp, path, lod_ob_temp.data.name, ignore_shape_animation, normals, tangents, isLOD=True, defer_write=True)) )
+
+                    # Delete temporary LOD object.
+                    # The clone meshes will be deleted later.
+                    lod_ob_temp.user_clear()
+                    logger.debug("Removing temporary LOD object: %s" % lod_ob_temp.name)
+                    bpy.data.objects.remove(lod_ob_temp, do_unlink=True)
+                    del lod_ob_temp
+
+        # Delete temporary LOD object
+        logger.debug("Removing temporary LOD object: %s" % ob_copy.name)
+        bpy.data.objects.remove(ob_copy, do_unlink=True)
+        del ob_copy
+
+        # Delete temporary data/mesh objects
+        bpy.context.evaluated_depsgraph_get().update()
+        for mesh_iter in ob_copy_meshes:
+            mesh_iter.user_clear()
+            logger.debug("Removing temporary LOD mesh: %s" % mesh_iter.name)
+            bpy.data.meshes.remove(mesh_iter)
+            del mesh_iter
+        ob_copy_meshes = []
+
+        if lod_pre_mesh_count != len(bpy.data.meshes):
+            logger.warn('- After LOD generation, cleanup failed to erase all temporary data!')
+
+    arm = ob.find_armature()
+    if arm:
+        skeleton_name = obj_name
+        if config.get('SHARED_ARMATURE') is True:
+            skeleton_name = arm.data.name
+        skeleton_name = util.clean_object_name(skeleton_name)
+
+        mesh_data.skeleton_name = '%s.skeleton' % skeleton_name
+
+        boneOutputEnableFromName = {}
+        boneIndexFromName = {}
+        for bone in arm.pose.bones:
+            boneOutputEnableFromName[ bone.name ] = True
+            if config.get('ONLY_DEFORMABLE_BONES') is True:
+                # if we found a deformable bone,
+                if bone.bone.use_deform:
+                    # visit all ancestor bones and mark them "output enabled"
+                    parBone = bone.parent
+                    while parBone:
+                        boneOutputEnableFromName[ parBone.name ] = True
+                        parBone = parBone.parent
+                else:
+                    # non-deformable bone, no output
+                    boneOutputEnableFromName[ bone.name ] = False
+        boneIndex = 0
+        for bone in arm.pose.bones:
+            boneIndexFromName[ bone.name ] = boneIndex
+            if boneOutputEnableFromName[ bone.name ]:
+                boneIndex += 1
+        # Bone index of every vertex group, -1 for vertex groups that are not bones (other vertex groups are allowed)
+        group_bones = np.array([boneIndexFromName.get(vg.name, -1) for vg in copy.vertex_groups] + [-1], dtype=np.int64)
+
+        vertices, groups, weights = group_weights
+
+        out_of_sync = groups >= len(copy.vertex_groups)
+        if out_of_sync.any():
+            logger.warn('Mesh: %s vertex groups not in sync with armature %s (groupIndex = %s)' % (mesh.name, arm.name, groups[out_of_sync].max()))
+            groups[out_of_sync] = -1
+
+        bones = group_bones[groups]
+        keep = (bones >= 0) & (weights > config.get('TRIM_BONE_WEIGHTS'))
+
+        shared_vertex_data.bone_assignments, badverts = bone_assignments(
+            vertices[keep], bones[keep], weights[keep], _remap_verts_, len(mesh.vertices))
+        if badverts:
+            Report.warnings.append( 'Mesh "%s" has %s vertices weighted to more than 4 bones (Ogre limits a vertex to 4 bones), only the 4 largest weights were exported. Try increasing the Trim-Weights threshold option' % (mesh.name, badverts) )
+
+    # Updated June3 2011 - shape animation works
+    if (config.get('SHAPE_ANIMATIONS') is True) and mesh.shape_keys and len(mesh.shape_keys.key_blocks) > 0:
+        logger.info('* Generating shape keys')
+
+        if ob.active_shape_key_index != 0 and ob.show_only_shape_key == True:
+            warning = "Object \"%s\" mesh will look like selected shape key: '%s', not 'Basis'" % (ob.name, ob.active_shape_key.name)
+            logger.warn(warning)
+            Report.warnings.append(warning)
+
+        key_blocks = []
+        for sidx, skey in enumerate(mesh.shape_keys.key_blocks):
+            # Skip the basis Shape Key
+            if sidx == 0:
+                continue
 
-            try:
-                material_faces[F.material_index].append(face)
-            except:
-                failure = 'FAILED to assign material to face - you might be using a Boolean Modifier between objects with different materials!'
+            if len(skey.data) != len( ob.data.vertices ):
+                failure = 'FAILED to save shape animation - you can not use a modifier that changes the vertex count! '
                 failure += '[ mesh : %s ]' % mesh.name
                 Report.warnings.append( failure )
                 logger.error( failure )
                 break
 
-        Report.vertices += numverts
+            key_blocks.append(skey)
+
+        remap = np.asarray(_remap_verts_, dtype=np.int64)
+
+        # Read the positions of all the shape keys into a (keys, vertices, 3) array
+        key_positions = np.empty((len(key_blocks), len(ob.data.vertices) * 3), dtype=np.float32)
+        for kidx, skey in enumerate(key_blocks):
+            skey.data.foreach_get('co', key_positions[kidx])
+        key_positions = key_positions.reshape(len(key_blocks), -1, 3)[:, remap]
+
+        # Offsets from the exported vertex positions (the axis swap is linear, so swap first then subtract)
+        pose_offsets = util.swap_array(key_positions.reshape(-1, 3)).reshape(len(key_blocks), numverts, 3)
+        pose_offsets = pose_offsets - mesh_arrays.positions[remap]
+        del key_positions
+
+        pose_normals = None
+        if config.get('SHAPE_NORMALS') is True:
+            # The split normals of a shape key are per loop of the original mesh (before triangulation),
+            # find the loop of every Ogre vertex once for all the shape keys
+            polygons = np.asarray(_face_indices_)
+            if _tess_polygon_face_map_ is not None:
+                polygons = _tess_polygon_face_map_[polygons]
+            normal_loops = polygon_vertex_loops(ob.data, polygons, remap)
+            missing = normal_loops < 0
+            if missing.any():
+                logger.warn('Mesh "%s": %s vertices not found in the original polygons, their shape key normals are the basis normals' % (mesh.name, np.count_nonzero(missing)))
+
+            pose_normals = np.empty((len(key_blocks), numverts, 3), dtype=np.float32)
+            for kidx, skey in enumerate(key_blocks):
+                snormals = np.array(skey.normals_split_get(), dtype=np.float32).reshape(-1, 3)
+                pose_normals[kidx] = util.swap_array(snormals[normal_loops])
+                pose_normals[kidx][missing] = shared_vertex_data.normals[missing]
+
+        # Ogre poses are sparse, leave out the vertices the shape key (almost) doesn't change
+        epsilon = config.get('SHAPE_OFFSET_EPSILON')
+        changed = np.abs(pose_offsets).max(axis=2, initial=0.0) > epsilon
+        if pose_normals is not None:
+            changed |= np.abs(pose_normals - shared_vertex_data.normals).max(axis=2, initial=0.0) > epsilon
+
+        for kidx, skey in enumerate(key_blocks):
+            pose_indices = np.flatnonzero(changed[kidx])
+            logger.info('  - Pose "%s": %s of %s vertices' % (skey.name, len(pose_indices), numverts))
+
+            # Target is the shared geometry (the whole mesh)
+            mesh_data.poses.append( Pose(skey.name, None, pose_indices, pose_offsets[kidx][pose_indices],
+                pose_normals[kidx][pose_indices] if pose_normals is not None else None) )
 
-        doc.end_tag('vertexbuffer')
-        doc.end_tag('sharedgeometry')
+        logger.info('- Done at %s seconds' % util.timer_diff_str(start))
+
+        if mesh.shape_keys.animation_data and len(mesh.shape_keys.animation_data.nla_tracks) > 0:
+            logger.info('* Generating shape animations')
+            _fps = float( bpy.context.scene.render.fps )
+
+            # Drivers can make the shape key values depend on anything in the scene,
+            # then the whole scene has to be evaluated frame by frame
+            use_frame_set = len(mesh.shape_keys.animation_data.drivers) > 0
+            if use_frame_set:
+                logger.info('- Shape keys have drivers, evaluating the scene for every frame')
+
+            for nla in mesh.shape_keys.animation_data.nla_tracks:
+                for idx, strip in enumerate(nla.strips):
+                    animation = PoseAnimation(strip.name, (strip.frame_end-strip.frame_start)/_fps)
+                    frames = range( int(strip.frame_start), int(strip.frame_end)+1, bpy.context.scene.frame_step)#thanks to Vesa
+                    if use_frame_set or strip.action is None:
+                        for frame in frames:
+                            bpy.context.scene.frame_set(frame)
+                            pose_refs = []
+                            for sidx, skey in enumerate( mesh.shape_keys.key_blocks ):
+                                if sidx == 0: continue
+                                pose_refs.append( (sidx-1, skey.value) )
+                            animation.keyframes.append( ((frame-strip.frame_start)/_fps, pose_refs) )
+                    else:
+                        values = shape_key_values(mesh.shape_keys, strip, frames)
+                        for frame, frame_values in zip(frames, values.tolist()):
+                            animation.keyframes.append( ((frame-strip.frame_start)/_fps, list(enumerate(frame_values))) )
+                    mesh_data.animations.append(animation)
+            logger.info('- Done at %s seconds' % util.timer_diff_str(start))
+
+    ## If we made a copy of the object, clean it up
+    if ob != copy:
+        #bpy.context.collection.objects.unlink(copy)    # Blender 2.7x
+        #bpy.context.scene.collection.objects.unlink(copy)  # Blender 2.8+
+        copy.user_clear()
+        logger.debug("Removing temporary object: %s" % copy.name)
+        bpy.data.objects.remove(copy)
+        del copy
+
+    # Reenable disabled modifiers
+    if ob.modifiers != None:
+        for mod in ob.modifiers:
+            if mod.type in disable_mods and mod.show_viewport == False:
+                logger.debug("Enabling Modifier: %s" % mod.name)
+                mod.show_viewport = True
 
-        sys.stdout.write("\n")
+    del _remap_verts_
+    del _face_indices_
 
+    # Blended submeshes are drawn after the opaque ones with depth writes usually off, the order of their triangles does not help the depth test
+    blended_materials = set(mat_name for mat_name, extern, mat in materials if mat is not None and mat.blend_method == 'BLEND')
+
+    if defer_write:
+        return mesh_data, lambda: write_mesh_data(mesh_data, path, start, dotextures, blended_materials)
+
+    if lod_meshes:
+        merge_lod_meshes(mesh_data, lod_meshes)
+
+    # Generate LOD levels with the exporter's own simplifier: index buffers over the same vertex buffers
+    generate_lods = isLOD == False and ob.type == 'MESH' and config.get('LOD_LEVELS') > 0 and config.get('LOD_GENERATION') == '3'
+    write_mesh_data(mesh_data, path, start, dotextures, blended_materials, generate_lods)
+
+    # Note that exporting the skeleton does not happen here anymore
+    # It was moved to the function dot_skeleton in its own module (skeleton.py)
+
+    mats = []
+    for mat_name, extern, mat in materials:
+        # _missing_material_ is marked as extern
+        if not extern:
+            mats.append(mat_name)
+        else:
+            logger.info("Extern material: %s" % mat_name)
+
+    return mats
+
+def merge_lod_meshes(mesh_data, lod_meshes):
+    """
+    Puts the LOD levels into the .mesh of mesh_data as generated LOD levels if they can share its vertex buffer
+    (see MeshData.merge_lods()), that saves a .mesh file, a conversion and a resource lookup per level.
+    Otherwise the LOD levels are written as .mesh files of their own and referenced as manual LOD levels
+
+    lod_meshes: list of (distance, (MeshData, write)) as returned by dot_mesh(defer_write=True)
+    """
+    vertex_count = mesh_data.shared_vertex_data.vertex_count
+    # Splitting the submeshes up for 16 bit indices would drop the LOD levels
+    split_submeshes = config.get('SPLIT_16BIT_SUBMESHES') is True and vertex_count > 65535
+    if not split_submeshes and mesh_data.merge_lods([(distance, lod_mesh_data) for distance, (lod_mesh_data, write) in lod_meshes]):
+        logger.info('- Merged %s LOD levels into the mesh, vertices: %s -> %s' % (len(lod_meshes), vertex_count, mesh_data.shared_vertex_data.vertex_count))
+        return
+
+    logger.info('- The LOD levels can not share the vertex buffer of the mesh, writing them as manual LOD meshes')
+    for distance, (lod_mesh_data, write) in lod_meshes:
+        write()
+        mesh_data.manual_lods.append( (distance, lod_mesh_data.name + ".mesh") )
+
+def write_mesh_data(mesh_data, path, start, has_uvs=True, blended_materials=(), generate_lods=False):
+    """
+    Optimizes the MeshData as configured and writes it to path as .mesh (directly or through .mesh.xml)
+
+    start: time the export of the mesh started, for the log
+    has_uvs: if the mesh has texture coordinates (see util.xml_convert())
+    blended_materials: materials of submeshes that are left out of the overdraw optimization
+    generate_lods: generate LOD levels with the exporter's own simplifier (LOD_GENERATION = '3')
+    """
+    obj_name = mesh_data.name
+    numverts = mesh_data.shared_vertex_data.vertex_count
+
+    # One vertex buffer shared by all the submeshes, or a vertex buffer per submesh
+    geometry = config.get('SHARED_GEOMETRY')
+    if geometry == 'auto' and mesh_data.prefers_dedicated_geometry():
+        geometry = 'dedicated'
+    # Submeshes can only be split up to use 16 bit indices with their own vertex buffers
+    split_submeshes = config.get('SPLIT_16BIT_SUBMESHES') is True and numverts > 65535
+    if split_submeshes:
+        geometry = 'dedicated'
+    if geometry == 'dedicated':
+        logger.info('- Using dedicated geometry per submesh')
+        mesh_data.make_geometry_dedicated()
+    # Overdraw optimization works on the vertex cache optimized triangle order
+    optimise_overdraw = config.get('OPTIMISE_OVERDRAW') is True
+    optimise_vertex_cache = config.get('OPTIMISE_VERTEX_CACHE') is True or optimise_overdraw
+    if optimise_vertex_cache:
+        # The ACMR and the overdraw estimate are more passes over all the triangles, only measure them for the log
+        analyze = config.get('ENABLE_LOGGING') is True
+        if analyze:
+            acmr_before = mesh_optimizer.analyze_vertex_cache(mesh_data)
+            if optimise_overdraw:
+                overdraw_before = mesh_optimizer.analyze_overdraw(mesh_data, blended_materials)
+
+        # Before splitting, so the split submeshes are runs of triangles close to each other
+        if optimise_overdraw:
+            mesh_optimizer.optimize_triangle_order(mesh_data, config.get('OVERDRAW_THRESHOLD'), blended_materials)
+        else:
+            mesh_optimizer.optimize_triangle_order(mesh_data)
+
+        if analyze:
+            acmr_after = mesh_optimizer.analyze_vertex_cache(mesh_data)
+            logger.info('- Optimized vertex cache, ACMR: %.3f -> %.3f' % (acmr_before, acmr_after))
+            if optimise_overdraw:
+                overdraw_after = mesh_optimizer.analyze_overdraw(mesh_data, blended_materials)
+                logger.info('- Optimized overdraw, estimated overdraw: %.3f -> %.3f' % (overdraw_before, overdraw_after))
+                Report.messages.append('Mesh "%s": ACMR %.3f -> %.3f, estimated overdraw %.3f -> %.3f' % (obj_name, acmr_before, acmr_after, overdraw_before, overdraw_after))
+            else:
+                Report.messages.append('Mesh "%s": ACMR %.3f -> %.3f' % (obj_name, acmr_before, acmr_after))
+    if split_submeshes:
+        submesh_count = len(mesh_data.submeshes)
+        mesh_data.split_submeshes(65535)
+        logger.info('- Split %s submeshes into %s submeshes with at most 65535 vertices' % (submesh_count, len(mesh_data.submeshes)))
+
+    if generate_lods:
+        logger.info('* Generating LOD levels')
+        # Cap lod levels like the Decimate method does
+        mesh_simplifier.generate_lod_levels(mesh_data, min(config.get('LOD_LEVELS'), 10), config.get('LOD_DISTANCE'), config.get('LOD_PERCENT') / 100.0)
         logger.info('- Done at %s seconds' % util.timer_diff_str(start))
-        logger.info('* Writing submeshes')
-
-        doc.start_tag('submeshes', {})
-        for matidx, (mat_name, extern, mat) in enumerate(materials):
-            if len(material_faces[matidx]) == 0:
-                Report.warnings.append('BAD SUBMESH "%s": material %r, has not been applied to any faces - not exporting as submesh.' % (obj_name, mat_name) )
-                continue # fixes corrupt unused materials
-
-            submesh_attributes = {
-                'usesharedvertices' : 'true',
-                # Maybe better look at index of all faces, if one over 65535 set to true;
-                # Problem: we know it too late, postprocessing of file needed
-                "use32bitindexes" : str(bool(numverts > 65535)),
-                "operationtype" : "triangle_list"
-            }
-            if mat_name != "_missing_material_":
-                submesh_attributes['material'] = mat_name
 
-            doc.start_tag('submesh', submesh_attributes)
-            doc.start_tag('faces', {
-                'count' : str(len(material_faces[matidx]))
+    if optimise_vertex_cache:
+        mesh_optimizer.optimize_lod_order(mesh_data)
+        mesh_optimizer.optimize_vertex_fetch(mesh_data)
+
+    # The .mesh is written (and converted, upgraded) in the staging directory and then moved into path
+    staging = util.staging_dir(path)
+
+    # Write the binary .mesh directly, or write .mesh.xml and convert it with OgreXMLConverter / OgreMeshTool
+    if config.get('MESH_SERIALIZER') == 'native':
+        target_file = os.path.join(staging, '%s.mesh' % obj_name )
+        mesh_serializer.write_mesh(mesh_data, target_file)
+        logger.info('- Created %s.mesh in total time %s seconds' % (obj_name, util.timer_diff_str(start)))
+    else:
+        target_file = os.path.join(staging, '%s.mesh.xml' % obj_name )
+        with open(target_file, 'w') as f:
+            write_mesh_xml(mesh_data, f)
+
+        logger.info('- Created %s.mesh.xml at %s seconds' % (obj_name, util.timer_diff_str(start)))
+
+        # Start .mesh.xml to .mesh convertion tool
+        util.xml_convert(target_file, has_uvs=has_uvs)
+
+        logger.info('- Created %s.mesh in total time %s seconds' % (obj_name, util.timer_diff_str(start)))
+
+    # If requested by the user, generate LOD levels / Edge Lists / Vertex buffer optimization through OgreMeshUpgrader
+    if ((config.get('LOD_LEVELS') > 0 and config.get('LOD_GENERATION') == '0') or
+        (config.get('GENERATE_EDGE_LISTS') is True and config.get('MESH_SERIALIZER') != 'native') or
+        config.get('PACK_INT_10_10_10_2') is True):
+        target_mesh_file = os.path.join(staging, '%s.mesh' % obj_name )
+        util.mesh_upgrade_tool(target_mesh_file)
+
+    util.unstage(path, '%s.mesh' % obj_name, '%s.mesh.xml' % obj_name, 'OgreXMLConverter.log', 'OgreMeshTool.log', 'OgreMeshUpgrader.log')
+
+def write_mesh_xml(mesh_data, f):
+    """
+    Write the MeshData as .mesh.xml into the file object f
+    """
+    doc = SimpleSaxWriter(f, 'mesh', {})
+
+    vertex_data = mesh_data.shared_vertex_data
+    if vertex_data is not None:
+        # The vertex buffer is complete before anything is written, so the count goes straight into the tag
+        doc.start_tag('sharedgeometry', {'vertexcount' : '%s' % vertex_data.vertex_count})
+
+        logger.info('* Writing shared geometry')
+        write_vertex_buffer_xml(doc, vertex_data)
+
+        doc.end_tag('sharedgeometry')
+
+    logger.info('* Writing submeshes')
+
+    doc.start_tag('submeshes', {})
+    for submesh in mesh_data.submeshes:
+        submesh_vertex_data = submesh.vertex_data or vertex_data
+        submesh_attributes = {
+            'usesharedvertices' : str(submesh.use_shared_vertices).lower(),
+            "use32bitindexes" : str(bool(submesh_vertex_data.vertex_count > 65535)),
+            "operationtype" : submesh.operation_type
+        }
+        if submesh.material is not None:
+            submesh_attributes['material'] = submesh.material
+
+        doc.start_tag('submesh', submesh_attributes)
+        doc.start_tag('faces', {
+            'count' : str(len(submesh.indices))
+        })
+        doc.write_faces(submesh.indices)
+        doc.end_tag('faces')
+
+        if not submesh.use_shared_vertices:
+            doc.start_tag('geometry', {'vertexcount' : '%s' % submesh.vertex_data.vertex_count})
+            write_vertex_buffer_xml(doc, submesh.vertex_data)
+            doc.end_tag('geometry')
+            write_bone_assignments_xml(doc, submesh.vertex_data)
+
+        doc.end_tag('submesh')
+    doc.end_tag('submeshes')
+
+    # Submesh names
+    doc.start_tag('submeshnames', {})
+    for idx, submesh in enumerate(mesh_data.submeshes):
+        doc.leaf_tag('submesh', {
+                'name' : submesh.name,
+                'index' : str(idx)
+        })
+    doc.end_tag('submeshnames')
+
+    if mesh_data.generated_lods:
+        # Generated LOD levels only have their own faces, the vertices are the ones of the full detail mesh
+        doc.start_tag('levelofdetail', {
+            'strategy'  : 'default',
+            'numlevels' : str(len(mesh_data.generated_lods) + 1),
+            'manual'    : "false"
+        })
+        for level, distance in enumerate(mesh_data.generated_lods):
+            doc.start_tag('lodgenerated', {
+                'value' : str(distance)
             })
-            for fidx, (v1, v2, v3) in enumerate(material_faces[matidx]):
-                doc.leaf_tag('face', {
-                    'v1' : str(v1),
-                    'v2' : str(v2),
-                    'v3' : str(v3)
+            for idx, submesh in enumerate(mesh_data.submeshes):
+                lod_indices = submesh.lod_indices[level]
+                doc.start_tag('lodfacelist', {
+                    'submeshindex' : str(idx),
+                    'numfaces'     : str(len(lod_indices))
                 })
-            doc.end_tag('faces')
-            doc.end_tag('submesh')
-            Report.triangles += len(material_faces[matidx])
+                doc.write_faces(lod_indices)
+                doc.end_tag('lodfacelist')
+            doc.end_tag('lodgenerated')
+        doc.end_tag('levelofdetail')
+
+    if mesh_data.manual_lods:
+        # 'manual' means if the geometry gets loaded from a different file than this LOD list references
+        doc.start_tag('levelofdetail', {
+            'strategy'  : 'default',
+            'numlevels' : str(len(mesh_data.manual_lods) + 1), # The main mesh is + 1 (kind of weird Ogre logic)
+            'manual'    : "true"
+        })
+        for distance, mesh_name in mesh_data.manual_lods:
+            # 'value' is the distance this LOD kicks in for the 'Distance' strategy.
+            doc.leaf_tag('lodmanual', {
+                'value'    : str(distance),
+                'meshname' : mesh_name
+            })
+        doc.end_tag('levelofdetail')
 
-        for name, ogre_indices in vertex_groups.items():
-            if len(ogre_indices) <= 0:
-                continue
-            submesh_attributes = {
-                'usesharedvertices' : 'true',
-                "use32bitindexes" : str(bool(numverts > 65535)),
-                "operationtype" : "triangle_list",
-                "material": "none",
+    if mesh_data.skeleton_name is not None:
+        doc.leaf_tag('skeletonlink', {
+                'name' : mesh_data.skeleton_name
+        })
+
+    if vertex_data is not None:
+        write_bone_assignments_xml(doc, vertex_data)
+
+    if mesh_data.poses:
+        doc.start_tag('poses', {})
+        for pose in mesh_data.poses:
+            pose_attributes = {
+                    'name' : pose.name,
+                    'target' : 'mesh'
             }
-            doc.start_tag('submesh', submesh_attributes)
-            doc.start_tag('faces', {
-                'count' : len(ogre_indices)
-            })
-            for (v1, v2, v3) in ogre_indices:
-                doc.leaf_tag('face', {
-                    'v1' : str(v1),
-                    'v2' : str(v2),
-                    'v3' : str(v3)
-                })
-            doc.end_tag('faces')
-            doc.end_tag('submesh')
-
-        del material_faces
-        del shared_vertices
-        doc.end_tag('submeshes')
-
-        # Submesh names
-        # todo: why is the submesh name taken from the material
-        # when we have the blender object name available?
-        doc.start_tag('submeshnames', {})
-        for matidx, (mat_name, extern, mat) in enumerate(materials):
-            doc.leaf_tag('submesh', {
-                    'name' : mat_name,
-                    'index' : str(matidx)
+            # If target is 'mesh', no index needed, if target is submesh then submesh identified by 'index'
+            if pose.target is not None:
+                pose_attributes['target'] = 'submesh'
+                pose_attributes['index'] = str(pose.target)
+            doc.start_tag('pose', pose_attributes)
+
+            f = number_format.float_spec()
+            offset = {'index' : '%d', 'x' : f, 'y' : f, 'z' : f}
+            if pose.normals is not None:
+                template = doc.template([('poseoffset', dict(offset, nx=f, ny=f, nz=f), 0)])
+                # The attributes are sorted: index, nx, ny, nz, x, y, z
+                columns = [pose.indices, pose.normals, pose.offsets]
+            else:
+                template = doc.template([('poseoffset', offset, 0)])
+                columns = [pose.indices, pose.offsets]
+            doc.write_records(template, columns)
+            doc.end_tag('pose')
+        doc.end_tag('poses')
+
+    if mesh_data.animations:
+        doc.start_tag('animations', {})
+        for animation in mesh_data.animations:
+            doc.start_tag('animation', {
+                    'name' : animation.name,
+                    'length' : str(animation.length)
             })
-        idx = len(materials)
-        for name in vertex_groups.keys():
-            name = name[len('ogre.vertex.group.'):]
-            doc.leaf_tag('submesh', {'name': name, 'index': idx})
-            idx += 1
-        doc.end_tag('submeshnames')
+            doc.start_tag('tracks', {})
+            # One track per pose target (the shared geometry or a submesh)
+            for target, keyframes in animation.tracks(mesh_data.poses):
+                track_attributes = {
+                        'type' : 'pose',
+                        'target' : 'mesh'
+                }
+                if target is not None:
+                    track_attributes['target'] = 'submesh'
+                    track_attributes['index'] = str(target)
+                doc.start_tag('track', track_attributes)
+                doc.start_tag('keyframes', {})
+                for time, pose_refs in keyframes:
+                    doc.start_tag('keyframe', {
+                            'time' : str(time)
+                    })
+                    for pose_index, influence in pose_refs:
+                        doc.leaf_tag('poseref', {
+                                'poseindex' : str(pose_index),
+                                'influence' : str(influence)
+                        })
+                    doc.end_tag('keyframe')
+                doc.end_tag('keyframes')
+                doc.end_tag('track')
+            doc.end_tag('tracks')
+            doc.end_tag('animation')
+        doc.end_tag('animations')
 
-        logger.info('- Done at %s seconds' % util.timer_diff_str(start))
+    doc.close() # reported by Reyn
 
-        # Generate LOD levels for manual LOD meshes
-        if isLOD == False and ob.type == 'MESH' and config.get('LOD_LEVELS') > 0 and config.get('LOD_GENERATION') == '2':
-            lod_levels = config.get('LOD_LEVELS')
-            lod_distance = config.get('LOD_DISTANCE')
+def write_vertex_buffer_xml(doc, vertex_data, chunk_size=65536):
+    """
+    Writes the <vertexbuffer> of a VertexData.
+    The arrays are converted to Python lists chunk_size vertices at a time, so large buffers are not copied at once
+    """
+    doc.start_tag('vertexbuffer', {
+            'positions':'true',
+            'normals':'true',
+            'tangents': str(bool(vertex_data.tangent_dimensions)),
+            'tangent_dimensions': str(vertex_data.tangent_dimensions),
+            'colours_diffuse' : str(vertex_data.colors is not None),
+            'texture_coords' : '%s' % len(vertex_data.uvs) * bool(vertex_data.uvs)
+    })
 
-            lod_generated = []
-            lod_current_distance = lod_distance
+    doc.write_vertices(vertex_data.positions, vertex_data.normals, vertex_data.tangents, vertex_data.colors, vertex_data.uvs, chunk_size)
 
-            for level in range(lod_levels + 1)[1:]:
-                lod_ob_name = obj_name + '_LOD_' + str(level)
-                lod_manual_ob = bpy.context.scene.objects.get(lod_ob_name)
+    doc.end_tag('vertexbuffer')
 
-                if lod_manual_ob:
-                    logger.info("- Found LOD Manual object: %s" % lod_ob_name)
-                    lod_generated.append({ 'level': level, 'distance': lod_current_distance, 'lod_manual_ob': lod_manual_ob })
-                    lod_current_distance += lod_distance
+def write_bone_assignments_xml(doc, vertex_data):
+    """
+    Writes the <boneassignments> of a VertexData, if it has any
+    """
+    if vertex_data.bone_assignments is None:
+        return
 
-                else:
-                    failure = 'FAILED to manually create LOD levels, manual LOD with name %s NOT FOUND!' % lod_ob_name
-                    Report.warnings.append( failure )
-                    logger.error( failure )
-                    break
+    doc.start_tag('boneassignments', {})
+    doc.write_bone_assignments(*vertex_data.bone_assignments)
+    doc.end_tag('boneassignments')
 
-            # Create lod .mesh files and generate LOD XML to the original .mesh.xml
-            if len(lod_generated) > 0:
-                # 'manual' means if the geometry gets loaded from a different file than this LOD list references
-                doc.start_tag('levelofdetail', {
-                    'strategy'  : 'default',
-                    'numlevels' : str(len(lod_generated) + 1), # The main mesh is + 1 (kind of weird Ogre logic)
-                    'manual'    : "true"
-                })
+def vertex_group_weights(mesh, obj):
+    """
+    Returns (vertices, groups, weights): arrays with the Blender vertex, vertex group index and weight of every vertex group weight of the mesh.
+    Blender has no foreach_get() access to the deform weights, so this is the one pass over them in Python,
+    the bone assignments and the vertex group submeshes are computed from these arrays
+    """
+    if len(obj.vertex_groups) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
 
-                logger.info('- Generating: %s LOD meshes. Original: vertices %s, faces: %s' % (len(lod_generated), len(mesh.vertices), len(mesh.loop_triangles)))
-                for lod in lod_generated:
-                    lod_manual_ob = lod['lod_manual_ob']
+    group_weights = [(v.index, g.group, g.weight) for v in mesh.vertices for g in v.groups]
+    group_weights = np.array(group_weights, dtype=np.float64).reshape(-1, 3)
+    return group_weights[:, 0].astype(np.int64), group_weights[:, 1].astype(np.int64), group_weights[:, 2].astype(np.float32)
 
-                    logger.info("- Writing LOD %s for distance %s, with %s vertices and %s faces" % 
-                        (lod['level'], lod['distance'], len(lod_manual_ob.data.vertices), len(lod_manual_ob.data.loop_triangles)))
+def vertex_group_membership(group_weights, vertex_count, obj, prefix):
+    """
+    Finds the vertex groups whose name starts with prefix and the vertices in them (group_weights: see vertex_group_weights()).
+    Returns (names, membership): membership is a (V, G) bool array, True where Blender vertex V is in the G-th of these groups.
+    Like the exporter always did, a vertex that is also in any other (or an invalid) vertex group is in none of them
+    """
+    # Column of every vertex group in the membership array, -1 for the other groups
+    group_columns = np.full(len(obj.vertex_groups) + 1, -1, dtype=np.int64)
+    names = []
+    for vg in obj.vertex_groups:
+        if vg.name.startswith(prefix):
+            group_columns[vg.index] = len(names)
+            names.append(vg.name)
+
+    membership = np.zeros((vertex_count, len(names)), dtype=bool)
+    if not names:
+        return names, membership
+
+    vertices, groups, weights = group_weights
+    groups = np.where(groups < len(obj.vertex_groups), groups, -1)
+    columns = group_columns[groups]
+    keep = columns >= 0
+    membership[vertices[keep], columns[keep]] = True
+    membership[vertices[~keep]] = False
+
+    return names, membership
+
+def triangulate_ngons(mesh):
+    """
+    Triangulates the polygons of mesh that have more than 4 vertices, in place.
+    Returns (P,) the index of the original polygon of every polygon of the triangulated mesh
+    """
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
 
-                    dot_mesh(lod_manual_ob, path, lod_manual_ob.data.name, ignore_shape_animation, normals, tangents, isLOD=True)
+    # Remember the original polygon of every face, triangulate() replaces the faces it splits
+    original_index = bm.faces.layers.int.new('ogre_original_index')
+    for face in bm.faces:
+        face[original_index] = face.index
 
-                    # 'value' is the distance this LOD kicks in for the 'Distance' strategy.
-                    doc.leaf_tag('lodmanual', {
-                        'value'    : str(lod['distance']),
-                        'meshname' : lod_manual_ob.data.name + ".mesh"
-                    })
+    bmesh.ops.triangulate(bm, faces=[face for face in bm.faces if len(face.verts) > 4], quad_method='FIXED')
+    polygon_map = np.array([face[original_index] for face in bm.faces], dtype=np.int64)
+    bm.faces.layers.int.remove(original_index)
 
-                doc.end_tag('levelofdetail')
-
-        # Generate LOD levels automatically using Blenders "Decimate" Modifier
-        if isLOD == False and ob.type == 'MESH' and config.get('LOD_LEVELS') > 0 and config.get('LOD_GENERATION') == '1':
-            lod_levels = config.get('LOD_LEVELS')
-            lod_distance = config.get('LOD_DISTANCE')
-            lod_ratio = config.get('LOD_PERCENT') / 100.0
-            lod_pre_mesh_count = len(bpy.data.meshes)
-
-            # Cap lod levels to something sensible (what is it?)
-            if lod_levels > 10:
-                lod_levels = 10
-
-            def duplicate_object(scene, name, copyobj):
-                # Create new mesh
-                mesh = bpy.data.meshes.new(name)
-
-                # Create new object associated with the mesh
-                ob_new = bpy.data.objects.new(name, mesh)
-
-                # Copy data block from the old object into the new object
-                ob_new.data = copyobj.data.copy()
-                ob_new.location = copyobj.location
-                ob_new.rotation_euler = copyobj.rotation_euler
-                ob_new.scale = copyobj.scale
-
-                # Link new object to the given scene and select it
-                scene.collection.objects.link(ob_new)
-                ob_new.select_set(True)
-
-                return ob_new, mesh
-
-            # Create a temporary duplicate
-            ob_copy, ob_copy_mesh = duplicate_object(bpy.context.scene, obj_name + "_LOD_TEMP_COPY", ob)
-            ob_copy_meshes = [ ob_copy.data, ob_copy_mesh ]
-
-            # Activate clone for modifier manipulation
-            decimate = ob_copy.modifiers.new(name="Ogre-LOD_Decimate", type='DECIMATE')
-            if decimate is not None:
-                decimate.decimate_type = 'COLLAPSE'
-                decimate.show_viewport = True
-                decimate.show_render = True
-
-                lod_generated = []
-                lod_ratio_multiplier = 1.0 - lod_ratio
-                lod_current_ratio = 1.0 * lod_ratio_multiplier
-                lod_current_distance = lod_distance
-                lod_current_vertice_count = len(mesh.vertices)
-                lod_min_vertice_count = 12
-
-                for level in range(lod_levels + 1)[1:]:
-                    decimate.ratio = lod_current_ratio
-                    
-                    # https://docs.blender.org/api/current/bpy.types.Depsgraph.html
-                    depsgraph = bpy.context.evaluated_depsgraph_get()
-                    object_eval = ob_copy.evaluated_get(depsgraph)
-                    lod_mesh = bpy.data.meshes.new_from_object(object_eval)
-                    
-                    ob_copy_meshes.append(lod_mesh)
-
-                    # Check min vertice count and that the vertice count got reduced from last iteration
-                    lod_mesh_vertices = len(lod_mesh.vertices)
-                    
-                    if lod_mesh_vertices < lod_min_vertice_count:
-                        logger.info('- LOD level: %s, vertice count: %s too small. Ignoring LOD.' % (level, lod_mesh_vertices))
-                        break
-                    if lod_mesh_vertices >= lod_current_vertice_count:
-                        logger.info('- LOD level: %s, vertice count: %s cannot be decimated any longer. Ignoring LOD.' % (level - 1, lod_mesh_vertices))
-                        break
-                    # todo: should we check if the ratio gets too small? although its up to the user to configure from the export panel
-
-                    lod_generated.append({ 'level': level, 'distance': lod_current_distance, 'ratio': lod_current_ratio, 'mesh': lod_mesh })
-                    lod_current_distance += lod_distance
-                    lod_current_vertice_count = lod_mesh_vertices
-                    lod_current_ratio *= lod_ratio_multiplier
-
-                # Create lod .mesh files and generate LOD XML to the original .mesh.xml
-                if len(lod_generated) > 0:
-                    # 'manual' means if the geometry gets loaded from a
-                    # different file that this LOD list references
-                    # NOTE: This is the approach at the moment. Another option would be to
-                    # references to the same vertex indexes in the shared geometry. But the
-                    # decimate approach wont work with this as it generates a fresh geometry.
-                    doc.start_tag('levelofdetail', {
-                        'strategy'  : 'default',
-                        'numlevels' : str(len(lod_generated) + 1), # The main mesh is + 1 (kind of weird Ogre logic)
-                        'manual'    : "true"
-                    })
+    bm.to_mesh(mesh)
+    bm.free()
+    mesh.calc_loop_triangles()
 
-                    logger.info('- Generating: %s LOD meshes. Original: vertices %s, faces: %s' % (len(lod_generated), len(mesh.vertices), len(mesh.loop_triangles)))
-                    for lod in lod_generated:
-                        ratio_percent = round(lod['ratio'] * 100.0, 0)
-                        logger.info("- Writing LOD %s for distance %s and ratio %s/100, with %s vertices, %s faces" % 
-                            (lod['level'], lod['distance'], str(ratio_percent), len(lod['mesh'].vertices), len(lod['mesh'].loop_triangles)))
-                        lod_ob_temp = bpy.data.objects.new(obj_name, lod['mesh'])
-                        lod_ob_temp.data.name = obj_name + '_LOD_' + str(lod['level'])
-                        dot_mesh(lod_ob_temp, path, lod_ob_temp.data.name, ignore_shape_animation, normals, tangents, isLOD=True)
-
-                        # 'value' is the distance this LOD kicks in for the 'Distance' strategy.
-                        doc.leaf_tag('lodmanual', {
-                            'value'    : str(lod['distance']),
-                            'meshname' : lod_ob_temp.data.name + ".mesh"
-                        })
+    return polygon_map
 
-                        # Delete temporary LOD object.
-                        # The clone meshes will be deleted later.
-                        lod_ob_temp.user_clear()
-                        logger.debug("Removing temporary LOD object: %s" % lod_ob_temp.name)
-                        bpy.data.objects.remove(lod_ob_temp, do_unlink=True)
-                        del lod_ob_temp
-
-                    doc.end_tag('levelofdetail')
-
-            # Delete temporary LOD object
-            logger.debug("Removing temporary LOD object: %s" % ob_copy.name)
-            bpy.data.objects.remove(ob_copy, do_unlink=True)
-            del ob_copy
-
-            # Delete temporary data/mesh objects
-            bpy.context.evaluated_depsgraph_get().update()
-            for mesh_iter in ob_copy_meshes:
-                mesh_iter.user_clear()
-                logger.debug("Removing temporary LOD mesh: %s" % mesh_iter.name)
-                bpy.data.meshes.remove(mesh_iter)
-                del mesh_iter
-            ob_copy_meshes = []
-
-            if lod_pre_mesh_count != len(bpy.data.meshes):
-                logger.warn('- After LOD generation, cleanup failed to erase all temporary data!')
-
-        arm = ob.find_armature()
-        if arm:
-            skeleton_name = obj_name
-            if config.get('SHARED_ARMATURE') is True:
-                skeleton_name = arm.data.name
-            skeleton_name = util.clean_object_name(skeleton_name)
-
-            doc.leaf_tag('skeletonlink', {
-                    'name' : '%s.skeleton' % skeleton_name
-            })
-            doc.start_tag('boneassignments', {})
-            boneOutputEnableFromName = {}
-            boneIndexFromName = {}
-            for bone in arm.pose.bones:
-                boneOutputEnableFromName[ bone.name ] = True
-                if config.get('ONLY_DEFORMABLE_BONES') is True:
-                    # if we found a deformable bone,
-                    if bone.bone.use_deform:
-                        # visit all ancestor bones and mark them "output enabled"
-                        parBone = bone.parent
-                        while parBone:
-                            boneOutputEnableFromName[ parBone.name ] = True
-                            parBone = parBone.parent
-                    else:
-                        # non-deformable bone, no output
-                        boneOutputEnableFromName[ bone.name ] = False
-            boneIndex = 0
-            for bone in arm.pose.bones:
-                boneIndexFromName[ bone.name ] = boneIndex
-                if boneOutputEnableFromName[ bone.name ]:
-                    boneIndex += 1
-            badverts = 0
-            for vidx, v in enumerate(_remap_verts_):
-                check = 0
-                for vgroup in v.groups:
-                    if vgroup.weight > config.get('TRIM_BONE_WEIGHTS'):
-                        groupIndex = vgroup.group
-                        if groupIndex < len(copy.vertex_groups):
-                            vg = copy.vertex_groups[ groupIndex ]
-                            if vg.name in boneIndexFromName: # allows other vertex groups, not just armature vertex groups
-                                bnidx = boneIndexFromName[ vg.name ] # find_bone_index(copy,arm,vgroup.group)
-                                doc.leaf_tag('vertexboneassignment', {
-                                        'vertexindex' : str(vidx),
-                                        'boneindex' : str(bnidx),
-                                        'weight' : '%6f' % vgroup.weight
-                                })
-                                check += 1
-                        else:
-                            logger.warn('Mesh: %s vertex groups not in sync with armature %s (groupIndex = %s)' % (mesh.name, arm.name, groupIndex))
-                if check > 4:
-                    badverts += 1
-                    logger.warn('<%s> vertex %s is in more than 4 vertex groups (bone weights). This maybe Ogre incompatible' % (mesh.name, vidx))
-            if badverts:
-                Report.warnings.append( 'Mesh "%s" has %s vertices weighted to too many bones (Ogre limits a vertex to 4 bones). Try increasing the Trim-Weights threshold option' % (mesh.name, badverts) )
-            doc.end_tag('boneassignments')
-
-        # Updated June3 2011 - shape animation works
-        if (config.get('SHAPE_ANIMATIONS') is True) and mesh.shape_keys and len(mesh.shape_keys.key_blocks) > 0:
-            logger.info('* Writing shape keys')
-
-            if ob.active_shape_key_index != 0 and ob.show_only_shape_key == True:
-                warning = "Object \"%s\" mesh will look like selected shape key: '%s', not 'Basis'" % (ob.name, ob.active_shape_key.name)
-                logger.warn(warning)
-                Report.warnings.append(warning)
-
-            doc.start_tag('poses', {})
-            for sidx, skey in enumerate(mesh.shape_keys.key_blocks):
-                # Skip the basis Shape Key
-                if sidx == 0:
-                    continue
-
-                if len(skey.data) != len( ob.data.vertices ):
-                    failure = 'FAILED to save shape animation - you can not use a modifier that changes the vertex count! '
-                    failure += '[ mesh : %s ]' % mesh.name
-                    Report.warnings.append( failure )
-                    logger.error( failure )
-                    break
+def strip_action_frames(strip, frames):
+    """
+    Converts scene frames to frames of the action of an NLA strip (strip scale, repeat and reverse)
+    """
+    offsets = (np.asarray(frames, dtype=np.float64) - strip.frame_start) / (strip.scale if strip.scale != 0 else 1.0)
+    length = strip.action_frame_end - strip.action_frame_start
+    if length > 0:
+        # Repeated strips start over after each cycle
+        offsets = np.where(offsets > length, offsets - length * np.ceil(offsets / length - 1.0), offsets)
+    if strip.use_reverse:
+        return strip.action_frame_end - offsets
+    return strip.action_frame_start + offsets
+
+def shape_key_values(shape_keys, strip, frames):
+    """
+    Evaluates the F-curves of the action of an NLA strip at the given scene frames, without changing the current frame of the scene.
+    Returns a (frames, shape keys) array of the shape key values, the basis shape key is left out.
+    Shape keys that are not animated by the action keep their current value
+    """
+    key_blocks = shape_keys.key_blocks[1:]
+    fcurves = { fcurve.data_path : fcurve for fcurve in strip.action.fcurves }
+    action_frames = strip_action_frames(strip, frames).tolist()
+
+    values = np.empty((len(action_frames), len(key_blocks)), dtype=np.float32)
+    for kidx, skey in enumerate(key_blocks):
+        fcurve = fcurves.get(skey.path_from_id('value'))
+        if fcurve is None or fcurve.mute:
+            values[:, kidx] = skey.value
+        else:
+            values[:, kidx] = np.clip([fcurve.evaluate(frame) for frame in action_frames], skey.slider_min, skey.slider_max)
+    return values
 
-                doc.start_tag('pose', {
-                        'name' : skey.name,
-                        # If target is 'mesh', no index needed, if target is submesh then submesh identified by 'index'
-                        #'index' : str(sidx-1),
-                        #'index' : '0',
-                        'target' : 'mesh'
-                })
+def polygon_vertex_loops(mesh, polygons, vertices):
+    """
+    Finds the loop (corner) of each of the given polygons that uses the given vertex.
+    polygons, vertices: (N,) polygon and vertex indices of mesh
+    Returns (N,) loop indices, -1 where the polygon does not use the vertex
+    """
+    num_polygons = len(mesh.polygons)
+    loop_starts = np.empty(num_polygons, dtype=np.int32)
+    mesh.polygons.foreach_get('loop_start', loop_starts)
+    loop_totals = np.empty(num_polygons, dtype=np.int32)
+    mesh.polygons.foreach_get('loop_total', loop_totals)
+    loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loop_vertices)
+
+    # Polygon and loop index of every loop, in polygon order
+    loop_polygons = np.repeat(np.arange(num_polygons, dtype=np.int64), loop_totals)
+    loops = np.arange(len(loop_polygons), dtype=np.int64) + np.repeat(loop_starts - (np.cumsum(loop_totals) - loop_totals), loop_totals)
+
+    # Look up (polygon, vertex) pairs as a single sorted key
+    num_vertices = len(mesh.vertices)
+    keys = loop_polygons * num_vertices + loop_vertices[loops]
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+
+    wanted = np.asarray(polygons, dtype=np.int64) * num_vertices + np.asarray(vertices, dtype=np.int64)
+    found = np.minimum(np.searchsorted(keys, wanted), max(len(keys) - 1, 0))
+    if len(keys) == 0:
+        return np.full(len(wanted), -1, dtype=np.int64)
+    return np.where(keys[found] == wanted, loops[order][found], -1)
+
+def weld_vertices(triangles, loop_vertices, attributes, tolerance=0.0):
+    """
+    Find the unique Ogre vertices of a triangulated mesh.
+    Two triangle corners become the same Ogre vertex when they use the same Blender vertex
+    and all of their attributes are equal. Attributes are quantized to the given tolerance,
+    a tolerance of 0 compares the exact float values.
 
-                normals_data = skey.normals_split_get()
-                # Separate normals_split_get() data into 3-tuples
-                snormals = tuple(normals_data[i:i + 3] for i in range(0, len(normals_data), 3))
-                shape_data = skey.data
-
-                # Create mapping between objects original mesh (polygons,vertices) and normals from "normals_split_get()"
-                normal_idx = 0
-                _remap_normals_ = {}
-                for poly in ob.data.polygons:
-                    for loop_idx in poly.loop_indices:
-                        vertex_idx = ob.data.loops[loop_idx].vertex_index
-                        _remap_normals_[(poly.index,vertex_idx)] = normal_idx
-                        normal_idx = normal_idx + 1
-
-                # Go through _remap_verts_ (array of vertices that are going into OGRE mesh)
-                for vidx, v in enumerate(_remap_verts_):
-                    pv = skey.data[ v.index ]
-                    x,y,z = swap( pv.co - v.co )
-
-                    if config.get('SHAPE_NORMALS') is True:
-                        vertex_idx = v.index
-
-                        # Try to get original polygon loop index (before tesselation)
-                        if _face_indices_[vidx] in _tess_polygon_face_map_:
-                            loop_idx = _tess_polygon_face_map_[_face_indices_[vidx]]
-                        # If not in _tess_polygon_face_map_, then we can get the original
-                        else:
-                            loop_idx = _face_indices_[vidx]
-
-                        # Index of normal into snormals array
-                        normal_idx = _remap_normals_[(loop_idx, vertex_idx)]
-
-                        pn = mathutils.Vector( snormals[normal_idx] )
-                        nx,ny,nz = swap( pn )
-
-                    if config.get('SHAPE_NORMALS') is True:
-                        doc.leaf_tag('poseoffset', {
-                                'x' : '%6f' % x,
-                                'y' : '%6f' % y,
-                                'z' : '%6f' % z,
-                                'nx' : '%6f' % nx,
-                                'ny' : '%6f' % ny,
-                                'nz' : '%6f' % nz,
-                                'index' : str(vidx)
-                        })
-                    else:
-                        doc.leaf_tag('poseoffset', {
-                                'x' : '%6f' % x,
-                                'y' : '%6f' % y,
-                                'z' : '%6f' % z,
-                                'index' : str(vidx)
-                        })
+    triangles: (T, 3) loop indices of every triangle
+    loop_vertices: (L,) Blender vertex index of every loop
+    attributes: list of (L, N) per loop attribute arrays (normals, uvs, colors, tangents)
 
-                del _remap_normals_
+    Returns (vertex_corners, indices)
+    vertex_corners: (V,) first corner (index into triangles.reshape(-1)) of each Ogre vertex
+    indices: (T, 3) Ogre vertex indices of every triangle
 
-                doc.end_tag('pose')
-            doc.end_tag('poses')
+    Ogre vertices are numbered in order of first use, like the vertices are written
+    """
+    corners = triangles.reshape(-1)
+    if len(corners) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 3), dtype=np.int64)
 
-            logger.info('- Done at %s seconds' % util.timer_diff_str(start))
+    first, ids = unique_corners(corners, loop_vertices, attributes, tolerance)
+    return first, ids.reshape(-1, 3)
 
-            if mesh.shape_keys.animation_data and len(mesh.shape_keys.animation_data.nla_tracks) > 0:
-                logger.info('* Writing shape animations')
-                doc.start_tag('animations', {})
-                _fps = float( bpy.context.scene.render.fps )
-                for nla in mesh.shape_keys.animation_data.nla_tracks:
-                    for idx, strip in enumerate(nla.strips):
-                        doc.start_tag('animation', {
-                                'name' : strip.name,
-                                'length' : str((strip.frame_end-strip.frame_start)/_fps)
-                        })
-                        doc.start_tag('tracks', {})
-                        doc.start_tag('track', {
-                                'type' : 'pose',
-                                'target' : 'mesh'
-                                # If target is 'mesh', no index needed, if target is submesh then submesh identified by 'index'
-                                #'index' : str(idx)
-                                #'index' : '0'
-                        })
-                        doc.start_tag('keyframes', {})
-                        for frame in range( int(strip.frame_start), int(strip.frame_end)+1, bpy.context.scene.frame_step):#thanks to Vesa
-                            bpy.context.scene.frame_set(frame)
-                            doc.start_tag('keyframe', {
-                                    'time' : str((frame-strip.frame_start)/_fps)
-                            })
-                            for sidx, skey in enumerate( mesh.shape_keys.key_blocks ):
-                                if sidx == 0: continue
-                                doc.leaf_tag('poseref', {
-                                        'poseindex' : str(sidx-1),
-                                        'influence' : str(skey.value)
-                                })
-                            doc.end_tag('keyframe')
-                        doc.end_tag('keyframes')
-                        doc.end_tag('track')
-                        doc.end_tag('tracks')
-                        doc.end_tag('animation')
-                doc.end_tag('animations')
-                logger.info('- Done at %s seconds' % util.timer_diff_str(start))
-
-        ## If we made a copy of the object, clean it up
-        if ob != copy:
-            #bpy.context.collection.objects.unlink(copy)    # Blender 2.7x
-            #bpy.context.scene.collection.objects.unlink(copy)  # Blender 2.8+
-            copy.user_clear()
-            logger.debug("Removing temporary object: %s" % copy.name)
-            bpy.data.objects.remove(copy)
-            del copy
-
-        # Reenable disabled modifiers
-        if ob.modifiers != None:
-            for mod in ob.modifiers:
-                if mod.type in disable_mods and mod.show_viewport == False:
-                    logger.debug("Enabling Modifier: %s" % mod.name)
-                    mod.show_viewport = True
-
-        # Release BMesh resources
-        bm.free()
-        del bm
-
-        del _remap_verts_
-        del _face_indices_
-        doc.close() # reported by Reyn
-        f.close()
+def unique_corners(corners, loop_vertices, attributes, tolerance=0.0):
+    """
+    Welds the given loops (see weld_vertices()).
+    Returns (first, ids): the position in corners of the first loop of each unique vertex,
+    and the unique vertex of every loop. Unique vertices are numbered in order of first use
+    """
+    columns = [loop_vertices[corners].astype(np.int64).reshape(-1, 1)]
+    for attribute in attributes:
+        values = attribute[corners].reshape(len(corners), -1)
+        if tolerance > 0:
+            columns.append(np.rint(values / tolerance).astype(np.int64))
+        else:
+            # Compare the bit patterns, adding 0.0 turns -0.0 into 0.0
+            values = values.astype(np.float32) + np.float32(0.0)
+            columns.append(values.view(np.int32).astype(np.int64))
+    keys = np.ascontiguousarray(np.hstack(columns))
 
-        logger.info('- Created %s.mesh.xml at %s seconds' % (obj_name, util.timer_diff_str(start)))
+    # View each row as a single opaque value so np.unique() compares whole rows
+    keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).reshape(-1)
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
 
-    # todo: Very ugly, find better way
-    def replaceInplace(f,searchExp,replaceExp):
-        import fileinput
-        
-        with fileinput.FileInput(f, inplace=True, encoding="utf-8") as file:
-            for line in file:
-                if searchExp in line:
-                    line = line.replace(searchExp,replaceExp)
-                sys.stdout.write(line)
+    # np.unique() numbers the keys in sorted order, renumber them in order of first use
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
 
-    replaceInplace(target_file, '__TO_BE_REPLACED_VERTEX_COUNT__' + '"', str(numverts) + '"' )#+ ' ' * (ls - lr))
+    return first[order], rank[inverse.reshape(-1)]
 
-    # Start .mesh.xml to .mesh convertion tool
-    util.xml_convert(target_file, has_uvs=dotextures)
+def gather_vertex_data(mesh_arrays, vertex_loops, tangents):
+    """
+    Builds the VertexData of the Ogre vertices from the loop (corner) attributes of the mesh.
 
-    logger.info('- Created %s.mesh in total time %s seconds' % (obj_name, util.timer_diff_str(start)))
+    vertex_loops: (V,) loop index of every Ogre vertex
+    """
+    loop_arrays = [mesh_arrays.normals]
+    if tangents != 0:
+        loop_arrays.append(mesh_arrays.tangents)
+    if mesh_arrays.colors is not None:
+        loop_arrays.append(mesh_arrays.colors)
+    loop_arrays.extend(mesh_arrays.uvs)
 
-    # If requested by the user, generate LOD levels / Edge Lists / Vertex buffer optimization through OgreMeshUpgrader
-    if ((config.get('LOD_LEVELS') > 0 and config.get('LOD_GENERATION') == '0') or
-        (config.get('GENERATE_EDGE_LISTS') is True) or
-        (config.get('PACK_INT_10_10_10_2') is True) or
-        (config.get('OPTIMISE_VERTEX_CACHE') is True)):
-        target_mesh_file = os.path.join(path, '%s.mesh' % obj_name )
-        util.mesh_upgrade_tool(target_mesh_file)
+    positions = mesh_arrays.positions[mesh_arrays.loop_vertices[vertex_loops]]
+    columns = [array[vertex_loops] for array in loop_arrays]
 
-    # Note that exporting the skeleton does not happen here anymore
-    # It was moved to the function dot_skeleton in its own module (skeleton.py)
+    normals = columns.pop(0)
+    tangent_array = columns.pop(0) if tangents != 0 else None
+    colors = columns.pop(0) if mesh_arrays.colors is not None else None
 
-    mats = []
-    for mat_name, extern, mat in materials:
-        # _missing_material_ is marked as extern
-        if not extern:
-            mats.append(mat_name)
-        else:
-            logger.info("Extern material: %s" % mat_name)
+    return VertexData(positions, normals, tangents=tangent_array, tangent_dimensions=tangents, colors=colors, uvs=columns)
 
-    return mats
+def bone_assignments(vertices, bones, weights, remap, vertex_count, max_bones=4):
+    """
+    Builds the bone assignments of the Ogre vertices from the bone weights of the Blender vertices.
+    Only the max_bones largest weights of every Blender vertex are kept (Ogre limits a vertex to 4 bones)
+    and the kept weights are renormalized to sum to one.
 
-def triangle_list_in_group(mesh, shared_vertices, group_index):
-    faces = []
-    for face in mesh.data.loop_triangles:
-        vertices = [mesh.data.vertices[v] for v in face.vertices]
-        match_group = lambda g, v: g in [x.group for x in v.groups]
-        all_in_group = all([match_group(group_index, v) for v in vertices])
-        if not all_in_group:
-            continue
-        assert len(face.vertices) == 3
-        entry = [shared_vertices[v][0].ogre_vidx for v in face.vertices]
-        faces.append(tuple(entry))
-    return faces
-
-def append_triangle_in_vertex_group(mesh, obj, vertex_groups, ogre_indices, blender_indices):
-    vertices = [mesh.vertices[i] for i in blender_indices]
-    names = set()
-    for v in vertices:
-        for g in v.groups:
-            if g.group >= len(obj.vertex_groups):
-                return
-            group = obj.vertex_groups[g.group]
-            if not group.name.startswith("ogre.vertex.group."):
-                return
-            names.add(group.name)
-    match_group = lambda name, v: name in [obj.vertex_groups[x.group].name for x in v.groups]
-    for name in names:
-        all_in_group = all([match_group(name, v) for v in vertices])
-        if not all_in_group:
-            continue
-        if name not in vertex_groups:
-            vertex_groups[name] = []
-        vertex_groups[name].append(ogre_indices)
-
-class VertexNoPos(object):
-    def __init__(self, ogre_vidx, nx,ny,nz, r,g,b,ra, vert_uvs):
-        self.ogre_vidx = ogre_vidx
-        self.nx = nx
-        self.ny = ny
-        self.nz = nz
-        self.r = r
-        self.g = g
-        self.b = b
-        self.ra = ra
-        self.vert_uvs = vert_uvs
-
-    '''does not compare ogre_vidx (and position at the moment) [ no need to compare position ]'''
-    def __eq__(self, o):
-        if not math.isclose(self.nx, o.nx): return False
-        if not math.isclose(self.ny, o.ny): return False
-        if not math.isclose(self.nz, o.nz): return False
-        if not math.isclose(self.r, o.r): return False
-        if not math.isclose(self.g, o.g): return False
-        if not math.isclose(self.b, o.b): return False
-        if not math.isclose(self.ra, o.ra): return False
-        if len(self.vert_uvs) != len(o.vert_uvs): return False
-        if self.vert_uvs:
-            for i, uv1 in enumerate( self.vert_uvs ):
-                uv2 = o.vert_uvs[ i ]
-                if uv1 != uv2: return False
-        return True
-
-    def __repr__(self):
-        return 'vertex(%d)' % self.ogre_vidx
+    vertices, bones, weights: (N,) Blender vertex, bone index and weight of every bone weight
+    remap: (V,) Blender vertex of every Ogre vertex
+    Returns ((ogre_vertices, bones, weights), badverts), badverts is the number of Blender vertices that had more than max_bones weights
+    """
+    vertices = np.asarray(vertices, dtype=np.int64)
+    bones = np.asarray(bones, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float32)
+    remap = np.asarray(remap, dtype=np.int64)
+
+    # Sort by vertex and then by decreasing weight, keep the largest weights of every vertex
+    order = np.lexsort((-weights, vertices))
+    vertices, bones, weights = vertices[order], bones[order], weights[order]
+    slots = np.arange(len(vertices)) - np.searchsorted(vertices, vertices, side='left')
+    badverts = np.count_nonzero(slots == max_bones)
+    keep = slots < max_bones
+    vertices, bones, weights = vertices[keep], bones[keep], weights[keep]
+
+    # Renormalize the remaining weights of every vertex
+    totals = np.bincount(vertices, weights=weights, minlength=vertex_count)
+    weights = (weights / totals[vertices]).astype(np.float32)
+
+    # Copy the assignments of each Blender vertex to all the Ogre vertices made from it
+    counts = np.bincount(vertices, minlength=vertex_count)
+    starts = np.cumsum(counts) - counts
+    ogre_counts = counts[remap]
+    ogre_starts = np.cumsum(ogre_counts) - ogre_counts
+    source = np.repeat(starts[remap] - ogre_starts, ogre_counts) + np.arange(ogre_counts.sum())
+
+    return (np.repeat(np.arange(len(remap), dtype=np.int64), ogre_counts), bones[source], weights[source]), badverts
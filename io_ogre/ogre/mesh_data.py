@@ -0,0 +1,496 @@
+import numpy as np
+
+# In memory representation of an Ogre mesh
+# Built by dot_mesh() in ogre/mesh.py and written either as .mesh.xml or as binary .mesh (ogre/mesh_serializer.py)
+
+class VertexData:
+    """
+    A vertex buffer, used as shared geometry of the mesh or as dedicated geometry of a submesh.
+    Vectors are in Ogre coordinates (see util.swap_array()), one row per Ogre vertex
+
+    positions: (V, 3) float32 positions
+    normals: (V, 3) float32 normals
+    tangents: (V, 4) float32 tangents with the bitangent sign in w, or None
+    tangent_dimensions: number of tangent components to export (3 or 4)
+    colors: (V, 4) float32 RGBA diffuse colors, or None
+    uvs: list of (V, 2) float32 texture coordinates (Blender convention, V gets flipped when written)
+    bone_assignments: tuple of (vertex indices, bone indices, weights) arrays, or None
+    """
+    def __init__(self, positions, normals, tangents=None, tangent_dimensions=0, colors=None, uvs=None):
+        self.positions = positions
+        self.normals = normals
+        self.tangents = tangents
+        self.tangent_dimensions = tangent_dimensions if tangents is not None else 0
+        self.colors = colors
+        self.uvs = uvs or []
+        self.bone_assignments = None
+
+    @property
+    def vertex_count(self):
+        return len(self.positions)
+
+    def subset(self, vertex_indices):
+        """
+        Returns a new VertexData with only the given vertices (in that order).
+        Bone assignments of the other vertices are dropped, the rest are renumbered
+        """
+        subset = VertexData(
+            self.positions[vertex_indices],
+            self.normals[vertex_indices],
+            tangents=self.tangents[vertex_indices] if self.tangents is not None else None,
+            tangent_dimensions=self.tangent_dimensions,
+            colors=self.colors[vertex_indices] if self.colors is not None else None,
+            uvs=[uv[vertex_indices] for uv in self.uvs])
+
+        if self.bone_assignments is not None:
+            remap = np.full(self.vertex_count, -1, dtype=np.int64)
+            remap[vertex_indices] = np.arange(len(vertex_indices))
+            vertices, bones, weights = self.bone_assignments
+            keep = remap[vertices] >= 0
+            subset.bone_assignments = (remap[vertices[keep]], bones[keep], weights[keep])
+
+        return subset
+
+    def same_layout(self, other):
+        """
+        Returns True if other has the same vertex elements, so the two can go into one vertex buffer
+        """
+        return ((self.tangents is None) == (other.tangents is None) and
+            self.tangent_dimensions == other.tangent_dimensions and
+            (self.colors is None) == (other.colors is None) and
+            len(self.uvs) == len(other.uvs) and
+            (self.bone_assignments is None) == (other.bone_assignments is None))
+
+    def append(self, other):
+        """
+        Returns a new VertexData with the vertices of other after the vertices of this one (see same_layout())
+        """
+        merged = VertexData(
+            np.concatenate((self.positions, other.positions)),
+            np.concatenate((self.normals, other.normals)),
+            tangents=np.concatenate((self.tangents, other.tangents)) if self.tangents is not None else None,
+            tangent_dimensions=self.tangent_dimensions,
+            colors=np.concatenate((self.colors, other.colors)) if self.colors is not None else None,
+            uvs=[np.concatenate((uv, other_uv)) for uv, other_uv in zip(self.uvs, other.uvs)])
+
+        if self.bone_assignments is not None:
+            merged.bone_assignments = tuple(np.concatenate((array, other_array + offset))
+                for array, other_array, offset in zip(self.bone_assignments, other.bone_assignments, (self.vertex_count, 0, 0)))
+
+        return merged
+
+def compact_indices(indices):
+    """
+    Returns (vertex_indices, local_indices): the vertices used by the index buffer
+    and the index buffer renumbered to point into that list of vertices
+    """
+    vertex_indices, local_indices = np.unique(indices, return_inverse=True)
+    return vertex_indices, local_indices.reshape(indices.shape)
+
+def spatial_order(positions, indices):
+    """
+    Returns the order of the triangles along a Z-order (Morton) curve through their centroids,
+    so that consecutive triangles lie close together and share many vertices
+    """
+    centroids = positions[indices].mean(axis=1, dtype=np.float64)
+    low = centroids.min(axis=0)
+    extent = np.maximum(centroids.max(axis=0) - low, 1e-20)
+    # 10 bits per axis, interleaved into a 30 bit code
+    cells = ((centroids - low) / extent * 1023.0).astype(np.uint32)
+    codes = np.zeros(len(indices), dtype=np.uint32)
+    for bit in range(10):
+        for axis in range(3):
+            codes |= ((cells[:, axis] >> bit) & 1) << (3 * bit + axis)
+    return np.argsort(codes, kind='stable')
+
+def split_triangles(indices, max_vertices):
+    """
+    Cuts a triangle list into runs of consecutive triangles that use at most max_vertices vertices each.
+    Returns a list of (F, 3) index arrays
+    """
+    runs = []
+    # Only look at the next few triangles, a run of max_vertices vertices rarely has more than twice as many triangles
+    window = 4 * max_vertices
+    while len(indices) > 0:
+        candidates = indices[:window]
+
+        # A corner adds a vertex to the run if it is the first use of the vertex, count the vertices used up to each triangle
+        _, first = np.unique(candidates.reshape(-1), return_index=True)
+        new_vertices = np.zeros(candidates.size, dtype=np.int64)
+        new_vertices[first] = 1
+        used = np.cumsum(new_vertices.reshape(-1, 3).sum(axis=1))
+
+        if used[-1] <= max_vertices and len(candidates) < len(indices):
+            # Everything in the window fits, look further
+            window *= 2
+            continue
+
+        count = max(int(np.searchsorted(used, max_vertices, side='right')), 1)
+        runs.append(indices[:count])
+        indices = indices[count:]
+    return runs
+
+class SubMesh:
+    """
+    name: name of the submesh (written to the submesh name table)
+    material: material name, or None if there is no material
+    indices: (F, 3) triangle list indices into the vertex buffer
+    vertex_data: dedicated geometry of this submesh, or None to use the shared geometry
+    lod_indices: (F, 3) triangle lists of the generated LOD levels (see MeshData.generated_lods), into the same vertex buffer
+    """
+    def __init__(self, name, material, indices, vertex_data=None):
+        self.name = name
+        self.material = material
+        self.indices = indices
+        self.vertex_data = vertex_data
+        self.operation_type = 'triangle_list'
+        self.lod_indices = []
+
+    @property
+    def use_shared_vertices(self):
+        return self.vertex_data is None
+
+    def used_vertices(self):
+        """
+        Returns the sorted indices of the vertices used by the submesh and its LOD levels
+        """
+        return np.unique(np.concatenate([self.indices.reshape(-1)] + [lod.reshape(-1) for lod in self.lod_indices]))
+
+class Pose:
+    """
+    A shape key, as sparse list of vertex offsets
+
+    target: None for the shared geometry, otherwise the index of the submesh
+    indices: (N,) indices of the offset vertices
+    offsets: (N, 3) float32 position offsets
+    normals: (N, 3) float32 normals, or None
+    """
+    def __init__(self, name, target, indices, offsets, normals=None):
+        self.name = name
+        self.target = target
+        self.indices = indices
+        self.offsets = offsets
+        self.normals = normals
+
+class PoseAnimation:
+    """
+    A shape animation
+
+    length: length of the animation in seconds
+    keyframes: list of (time, [(pose index, influence), ...])
+    """
+    def __init__(self, name, length):
+        self.name = name
+        self.length = length
+        self.keyframes = []
+
+    def tracks(self, poses):
+        """
+        Ogre needs a pose track per pose target, splits the keyframes up by the target of their poses.
+        Returns a list of (target, keyframes), target is None for the shared geometry
+        """
+        targets = sorted(set(pose.target for pose in poses), key=lambda target: -1 if target is None else target)
+        tracks = []
+        for target in targets:
+            keyframes = []
+            for time, pose_refs in self.keyframes:
+                keyframes.append( (time, [(pose_index, influence) for pose_index, influence in pose_refs
+                    if pose_index < len(poses) and poses[pose_index].target == target]) )
+            tracks.append( (target, keyframes) )
+        return tracks
+
+class MeshData:
+    """
+    shared_vertex_data: VertexData shared by the submeshes, or None
+    submeshes: list of SubMesh
+    skeleton_name: name of the linked .skeleton file, or None
+    poses: list of Pose
+    animations: list of PoseAnimation
+    manual_lods: list of (distance, mesh name) of the manual LOD levels
+    generated_lods: list of distances of the generated LOD levels, their triangles are in SubMesh.lod_indices
+    """
+    def __init__(self, name):
+        self.name = name
+        self.shared_vertex_data = None
+        self.submeshes = []
+        self.skeleton_name = None
+        self.poses = []
+        self.animations = []
+        self.manual_lods = []
+        self.generated_lods = []
+
+    def submesh_vertex_counts(self):
+        """
+        Returns the number of vertices each submesh that uses the shared geometry would have with dedicated geometry
+        """
+        return [len(submesh.used_vertices()) for submesh in self.submeshes if submesh.use_shared_vertices]
+
+    def merge_lods(self, lod_meshes):
+        """
+        Puts LOD meshes into this mesh as generated LOD levels: their vertices are appended to the shared geometry
+        and their triangles become the SubMesh.lod_indices of the submeshes with the same name.
+        lod_meshes: list of (distance, MeshData) with shared geometry
+        Returns False without changing anything if they can't share the vertex buffer: different vertex layout or skeleton,
+        poses, submeshes this mesh doesn't have, or the full detail level would need 32 bit indices because of the extra vertices
+        """
+        vertex_data = self.shared_vertex_data
+        if vertex_data is None or self.poses or self.generated_lods or self.manual_lods:
+            return False
+        if any(not submesh.use_shared_vertices for submesh in self.submeshes):
+            return False
+
+        names = [submesh.name for submesh in self.submeshes]
+        vertex_count = vertex_data.vertex_count
+        for distance, lod_mesh in lod_meshes:
+            lod_vertex_data = lod_mesh.shared_vertex_data
+            if lod_vertex_data is None or not vertex_data.same_layout(lod_vertex_data):
+                return False
+            if lod_mesh.poses or lod_mesh.skeleton_name != self.skeleton_name:
+                return False
+            if any(not submesh.use_shared_vertices or submesh.name not in names for submesh in lod_mesh.submeshes):
+                return False
+            vertex_count += lod_vertex_data.vertex_count
+        if vertex_data.vertex_count <= 65535 < vertex_count:
+            return False
+
+        for distance, lod_mesh in lod_meshes:
+            offset = self.shared_vertex_data.vertex_count
+            self.shared_vertex_data = self.shared_vertex_data.append(lod_mesh.shared_vertex_data)
+            lod_submeshes = { submesh.name : submesh for submesh in lod_mesh.submeshes }
+            for submesh in self.submeshes:
+                lod_submesh = lod_submeshes.get(submesh.name)
+                if lod_submesh is None:
+                    submesh.lod_indices.append(np.empty((0, 3), dtype=submesh.indices.dtype))
+                else:
+                    submesh.lod_indices.append(np.asarray(lod_submesh.indices) + offset)
+            self.generated_lods.append(distance)
+
+        return True
+
+    def prefers_dedicated_geometry(self):
+        """
+        Whether dedicated vertex buffers are the better choice for the 'auto' SHARED_GEOMETRY mode.
+        They pay off when the submeshes have few vertices in common: smaller vertex ranges per draw,
+        and 16 bit indices for submeshes with up to 65535 vertices even when the whole mesh has more
+        """
+        if self.shared_vertex_data is None or len(self.submeshes) < 2:
+            return False
+        numverts = self.shared_vertex_data.vertex_count
+        submesh_counts = self.submesh_vertex_counts()
+        if not submesh_counts:
+            return False
+        if sum(submesh_counts) <= numverts * 1.1:
+            return True
+        return numverts > 65535 and max(submesh_counts) <= 65535 and sum(submesh_counts) <= numverts * 1.5
+
+    def make_geometry_dedicated(self):
+        """
+        Gives every submesh that uses the shared geometry its own vertex buffer with only the vertices it uses.
+        Poses of the shared geometry are split into one pose per submesh and the pose animations are updated to match
+        """
+        shared_vertex_data = self.shared_vertex_data
+        if shared_vertex_data is None:
+            return
+
+        pieces = []
+        for index, submesh in enumerate(self.submeshes):
+            if submesh.use_shared_vertices:
+                # The LOD levels keep using the vertices of the submesh
+                vertex_indices = submesh.used_vertices()
+                submesh.vertex_data = shared_vertex_data.subset(vertex_indices)
+                submesh.indices = np.searchsorted(vertex_indices, submesh.indices)
+                submesh.lod_indices = [np.searchsorted(vertex_indices, lod) for lod in submesh.lod_indices]
+                pieces.append( (None, index, vertex_indices) )
+            else:
+                pieces.append( (index, index, None) )
+
+        self.shared_vertex_data = None
+        self.remap_poses(pieces)
+
+    def split_submeshes(self, max_vertices=65535):
+        """
+        Splits submeshes with dedicated geometry of more than max_vertices vertices into several submeshes
+        with the same material, so they can use 16 bit indices. The pieces are runs of triangles along spatial_order(),
+        so each piece is a compact region that shares its vertices with few other pieces, whatever the triangle order was.
+        Within a piece the triangles keep their order (e.g. of the vertex cache optimization).
+        The first piece keeps the submesh name, the others get a .1, .2, ... suffix.
+        Submeshes with LOD levels can't be split, a LOD triangle can use vertices of several pieces:
+        split before generating LOD levels (see mesh.write_mesh_data() and mesh.merge_lod_meshes())
+        """
+        submeshes = []
+        pieces = []
+        for index, submesh in enumerate(self.submeshes):
+            if submesh.use_shared_vertices or submesh.vertex_data.vertex_count <= max_vertices:
+                pieces.append( (index, len(submeshes), None) )
+                submeshes.append(submesh)
+                continue
+
+            assert not submesh.lod_indices, 'submesh "%s" with LOD levels can not be split' % submesh.name
+            order = spatial_order(submesh.vertex_data.positions, submesh.indices)
+            start = 0
+            for part, run in enumerate(split_triangles(submesh.indices[order], max_vertices)):
+                triangles = submesh.indices[np.sort(order[start:start + len(run)])]
+                start += len(run)
+                vertex_indices, local_indices = compact_indices(triangles)
+                name = submesh.name if part == 0 else '%s.%d' % (submesh.name, part)
+                piece = SubMesh(name, submesh.material, local_indices, submesh.vertex_data.subset(vertex_indices))
+                piece.operation_type = submesh.operation_type
+                pieces.append( (index, len(submeshes), vertex_indices) )
+                submeshes.append(piece)
+
+        self.submeshes = submeshes
+        self.remap_poses(pieces)
+
+    def remap_poses(self, pieces):
+        """
+        Moves the poses over to new pose targets after the geometry has been split up, and updates the pose animations to match.
+        pieces: list of (old target, new target, vertex indices), the new target has the given vertices of the old target
+            (vertex indices is None if it has all of them, in the same order). Targets are None for the shared geometry
+        """
+        # New pose indices of every pose
+        pose_map = [[] for pose in self.poses]
+        poses = []
+        for old_target, new_target, vertex_indices in pieces:
+            for index, pose in enumerate(self.poses):
+                if pose.target != old_target:
+                    continue
+
+                if vertex_indices is None:
+                    pose_map[index].append(len(poses))
+                    poses.append( Pose(pose.name, new_target, pose.indices, pose.offsets, pose.normals) )
+                    continue
+
+                if len(vertex_indices) == 0:
+                    continue
+                # vertex_indices is sorted (see compact_indices())
+                local_pose_indices = np.minimum(np.searchsorted(vertex_indices, pose.indices), len(vertex_indices) - 1)
+                keep = vertex_indices[local_pose_indices] == pose.indices
+                if not keep.any():
+                    continue
+                pose_map[index].append(len(poses))
+                poses.append( Pose(pose.name, new_target, local_pose_indices[keep], pose.offsets[keep],
+                    pose.normals[keep] if pose.normals is not None else None) )
+
+        self.poses = poses
+
+        for animation in self.animations:
+            animation.keyframes = [
+                (time, [(new_index, influence) for pose_index, influence in pose_refs if pose_index < len(pose_map)
+                    for new_index in pose_map[pose_index]])
+                for time, pose_refs in animation.keyframes ]
+
+    def vertex_data(self):
+        """
+        Returns all the vertex buffers of the mesh
+        """
+        buffers = []
+        if self.shared_vertex_data is not None:
+            buffers.append(self.shared_vertex_data)
+        for submesh in self.submeshes:
+            if submesh.vertex_data is not None:
+                buffers.append(submesh.vertex_data)
+        return buffers
+
+    def bounds(self):
+        """
+        Returns the axis aligned bounding box (minimum, maximum) and the bounding sphere radius of the mesh
+        """
+        positions = [data.positions for data in self.vertex_data() if data.vertex_count > 0]
+        if not positions:
+            return np.zeros(3, dtype=np.float32), np.zeros(3, dtype=np.float32), 0.0
+
+        positions = np.concatenate(positions)
+        radius = float(np.sqrt((positions.astype(np.float64) ** 2).sum(axis=1).max()))
+        return positions.min(axis=0), positions.max(axis=0), radius
+
+class EdgeData:
+    """
+    Edge list of a mesh for stencil shadows, as Ogre's EdgeListBuilder builds it.
+    Vertex sets are the shared geometry (if any) followed by the dedicated geometry of the submeshes,
+    index sets are the submeshes.
+
+    triangles: (T,) EDGE_TRIANGLE array, without the degenerate triangles
+    groups: list of (vertex set, first triangle, number of triangles, (E,) EDGE array) per vertex set
+    closed: True if every edge is shared by two triangles
+    lod: 0 for the full detail triangles, otherwise the generated LOD level (see MeshData.generated_lods)
+    """
+    EDGE_TRIANGLE = np.dtype([('index_set', '<u4'), ('vertex_set', '<u4'), ('vertices', '<u4', 3), ('shared_vertices', '<u4', 3), ('normal', '<f4', 4)])
+    EDGE = np.dtype([('triangles', '<u4', 2), ('vertices', '<u4', 2), ('shared_vertices', '<u4', 2), ('degenerate', '?')])
+    # Second triangle of an edge with only one triangle
+    NO_TRIANGLE = 0xFFFFFFFF
+
+    def __init__(self, mesh_data, lod=0):
+        vertex_sets = []
+        geometries = []
+        if mesh_data.shared_vertex_data is not None:
+            vertex_sets.append(mesh_data.shared_vertex_data)
+        index_set = 0
+        for submesh in mesh_data.submeshes:
+            if submesh.operation_type != 'triangle_list':
+                continue
+            indices = submesh.indices if lod == 0 else submesh.lod_indices[lod - 1]
+            if submesh.use_shared_vertices:
+                geometries.append( (0, index_set, mesh_data.shared_vertex_data, indices) )
+            else:
+                geometries.append( (len(vertex_sets), index_set, submesh.vertex_data, indices) )
+                vertex_sets.append(submesh.vertex_data)
+            index_set += 1
+        # EdgeListBuilder sorts the index sets by vertex set
+        geometries.sort(key=lambda geometry: geometry[0])
+
+        vertices = np.concatenate([np.asarray(indices, dtype=np.int64).reshape(-1, 3) for _, _, _, indices in geometries] + [np.zeros((0, 3), dtype=np.int64)])
+        corners = np.concatenate([data.positions[indices].reshape(-1, 3, 3) for _, _, data, indices in geometries] + [np.zeros((0, 3, 3))]).astype(np.float32)
+        vertex_set = np.concatenate([np.full(len(indices), vset, dtype=np.int64) for vset, _, _, indices in geometries] + [np.zeros(0, dtype=np.int64)])
+        index_sets = np.concatenate([np.full(len(indices), iset, dtype=np.int64) for _, iset, _, indices in geometries] + [np.zeros(0, dtype=np.int64)])
+
+        # Corners at the same position are the same shared vertex (in any vertex set), numbered in order of first use
+        flat = np.ascontiguousarray(corners.reshape(-1, 3))
+        keys = flat.view(np.dtype((np.void, flat.dtype.itemsize * 3))).reshape(-1)
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[np.argsort(first, kind='stable')] = np.arange(len(first))
+        shared = rank[inverse.reshape(-1)].reshape(-1, 3)
+
+        # Triangles with two corners at the same position have no edges
+        keep = (shared[:,0] != shared[:,1]) & (shared[:,1] != shared[:,2]) & (shared[:,2] != shared[:,0])
+        vertices, corners, vertex_set, index_sets, shared = vertices[keep], corners[keep], vertex_set[keep], index_sets[keep], shared[keep]
+
+        # Face normal (not normalized) with the plane distance in w
+        normals = np.cross(corners[:,1] - corners[:,0], corners[:,2] - corners[:,0])
+        self.triangles = np.empty(len(vertices), dtype=self.EDGE_TRIANGLE)
+        self.triangles['index_set'] = index_sets
+        self.triangles['vertex_set'] = vertex_set
+        self.triangles['vertices'] = vertices
+        self.triangles['shared_vertices'] = shared
+        self.triangles['normal'][:, :3] = normals
+        self.triangles['normal'][:, 3] = -(normals * corners[:,0]).sum(axis=1)
+
+        # Every edge is connected to the first edge going the other way that is not connected yet
+        open_edges = {}
+        group_edges = [[] for vertex_data in vertex_sets]
+        for triangle, (vset, (a, b, c), (sa, sb, sc)) in enumerate(zip(vertex_set.tolist(), vertices.tolist(), shared.tolist())):
+            for v0, v1, s0, s1 in ((a, b, sa, sb), (b, c, sb, sc), (c, a, sc, sa)):
+                other = open_edges.pop((s1, s0), None)
+                if other is not None:
+                    edge = group_edges[other[0]][other[1]]
+                    edge[1] = triangle
+                    edge[6] = False
+                else:
+                    edges = group_edges[vset]
+                    open_edges.setdefault((s0, s1), (vset, len(edges)))
+                    edges.append([triangle, self.NO_TRIANGLE, v0, v1, s0, s1, True])
+        self.closed = not open_edges
+
+        self.groups = []
+        for vset, edges in enumerate(group_edges):
+            triangles = np.flatnonzero(vertex_set == vset)
+            start = int(triangles[0]) if len(triangles) > 0 else 0
+            records = np.empty(len(edges), dtype=self.EDGE)
+            if edges:
+                edges = np.array(edges, dtype=np.int64)
+                records['triangles'] = edges[:, 0:2]
+                records['vertices'] = edges[:, 2:4]
+                records['shared_vertices'] = edges[:, 4:6]
+                records['degenerate'] = edges[:, 6].astype(bool)
+            self.groups.append( (vset, start, len(triangles), records) )
+
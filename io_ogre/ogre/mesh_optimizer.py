@@ -0,0 +1,319 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger('mesh_optimizer')
+
+# Index and vertex buffer optimizations done by the exporter itself, independent of the OGRE command line tools.
+# They work on a MeshData (see ogre/mesh_data.py) before it is written
+
+# Vertex cache optimization of Sander, Nehab and Barczak, "Fast Triangle Reordering for Vertex Locality and Reduced Overdraw" (Tipsify).
+# It is linear in the number of triangles and only looks at the triangles around one vertex at a time,
+# about 4-5 microseconds per triangle in Python (200000 triangles in about 1 second), where Forsyth's
+# "Linear-Speed Vertex Cache Optimisation" rescored every triangle around the cache and took about 28 microseconds per triangle.
+# It also targets the FIFO cache that cache_misses() simulates, and gets the lower ACMR on it
+CACHE_SIZE = 32
+
+def optimize_vertex_cache(indices, cache_size=CACHE_SIZE):
+    """
+    Reorders the triangles of a triangle list for the post-transform vertex cache (Tipsify).
+    Emits all the triangles around a fanning vertex, then continues with the vertex of those triangles that is still
+    in the cache and will stay there while its own remaining triangles are emitted (the oldest such one), or else
+    with the most recently used vertex that still has triangles left.
+    indices: (F, 3) triangle list
+    Returns the (F, 3) triangle list with the same triangles in the new order
+    """
+    num_triangles = len(indices)
+    if num_triangles == 0:
+        return indices
+
+    # Work on a compact numbering of the vertices used
+    local_indices = np.unique(indices, return_inverse=True)[1].reshape(-1)
+    num_vertices = int(local_indices.max()) + 1
+
+    # Triangles of every vertex, vertex_triangles[starts[vertex]:ends[vertex]]
+    valence = np.bincount(local_indices, minlength=num_vertices)
+    ends = np.cumsum(valence)
+    starts = (ends - valence).tolist()
+    ends = ends.tolist()
+    vertex_triangles = (np.argsort(local_indices, kind='stable') // 3).tolist()
+    remaining = valence.tolist()
+
+    triangles = local_indices.reshape(-1, 3).tolist()
+    emitted = [False] * num_triangles
+    # Time stamp of every vertex when it was put into the FIFO cache, time counts the cache misses
+    cache_time = [-cache_size - 1] * num_vertices
+    time = cache_size + 1
+    # Vertices of the emitted triangles, the most recent last
+    dead_end = []
+
+    order = []
+    fanning = 0
+    next_vertex = 1
+    while fanning >= 0:
+        candidates = []
+        for triangle in vertex_triangles[starts[fanning]:ends[fanning]]:
+            if emitted[triangle]:
+                continue
+            emitted[triangle] = True
+            order.append(triangle)
+            for vertex in triangles[triangle]:
+                dead_end.append(vertex)
+                candidates.append(vertex)
+                remaining[vertex] -= 1
+                if time - cache_time[vertex] > cache_size:
+                    cache_time[vertex] = time
+                    time += 1
+
+        # The next fanning vertex is the oldest candidate that stays in the cache while its triangles are emitted
+        fanning = -1
+        best_priority = -1
+        for vertex in candidates:
+            if remaining[vertex] > 0:
+                priority = 0
+                if time - cache_time[vertex] + 2 * remaining[vertex] <= cache_size:
+                    priority = time - cache_time[vertex]
+                if priority > best_priority:
+                    best_priority = priority
+                    fanning = vertex
+
+        if fanning < 0:
+            # Nothing left around the fanning vertex, go back to the most recent vertex with triangles left
+            while dead_end:
+                vertex = dead_end.pop()
+                if remaining[vertex] > 0:
+                    fanning = vertex
+                    break
+            else:
+                # or else continue with the next vertex with triangles left
+                while next_vertex < num_vertices and remaining[next_vertex] == 0:
+                    next_vertex += 1
+                if next_vertex < num_vertices:
+                    fanning = next_vertex
+
+    return indices[np.array(order, dtype=np.int64)]
+
+def cache_misses(indices, cache_size=CACHE_SIZE):
+    """
+    Returns the (F,) number of vertex cache misses of every triangle of a triangle list for a FIFO cache
+    """
+    # With a FIFO cache a vertex stays in the cache until cache_size more misses happened
+    misses = 0
+    inserted = {}
+    triangle_misses = []
+    for a, b, c in indices.tolist():
+        before = misses
+        for vertex in (a, b, c):
+            time = inserted.get(vertex)
+            if time is None or misses - time >= cache_size:
+                inserted[vertex] = misses
+                misses += 1
+        triangle_misses.append(misses - before)
+    return np.array(triangle_misses, dtype=np.int64)
+
+def average_cache_miss_ratio(indices, cache_size=CACHE_SIZE):
+    """
+    Returns the average number of vertex cache misses per triangle (ACMR) of a triangle list for a FIFO cache.
+    Ranges from 3.0 (every vertex transformed again) down to about 0.5 for a regular grid
+    """
+    if len(indices) == 0:
+        return 0.0
+    return cache_misses(indices, cache_size).sum() / len(indices)
+
+# Overdraw ordering of Sander, Nehab and Barczak, "Fast Triangle Reordering for Vertex Locality and Reduced Overdraw"
+OVERDRAW_THRESHOLD = 1.05
+
+def optimize_overdraw(positions, indices, threshold=OVERDRAW_THRESHOLD, cache_size=CACHE_SIZE):
+    """
+    Reorders the triangles of a vertex cache optimized triangle list to reduce overdraw.
+    The list is cut into clusters of consecutive triangles, which are sorted so that the clusters
+    facing away from the center of the mesh (the ones most likely to hide others) are drawn first.
+    positions: (V, 3) vertex positions
+    indices: (F, 3) triangle list, in vertex cache order (see optimize_vertex_cache())
+    threshold: how much worse the ACMR may get, 1.05 allows 5% more vertex cache misses
+    Returns the (F, 3) triangle list with the same triangles in the new order
+    """
+    num_triangles = len(indices)
+    if num_triangles == 0:
+        return indices
+
+    # A triangle that misses all its vertices starts a new patch of the mesh anyway, cut there first.
+    # Then cut the patches further as soon as the ACMR of the cluster so far is within the threshold of the ACMR of the patch.
+    # Every cluster starts with an empty cache, as after sorting it can follow any other cluster
+    misses = cache_misses(indices, cache_size)
+    patches = np.flatnonzero(misses == 3).tolist()
+    if not patches or patches[0] != 0:
+        patches.insert(0, 0)
+    patches.append(num_triangles)
+
+    triangles = indices.tolist()
+    starts = []
+    time = 0
+    inserted = {}
+    for start, end in zip(patches[:-1], patches[1:]):
+        patch_threshold = threshold * average_cache_miss_ratio(indices[start:end], cache_size)
+        cluster_start = start
+        cluster_misses = 0
+        time += cache_size
+        for triangle in range(start, end):
+            for vertex in triangles[triangle]:
+                inserted_time = inserted.get(vertex)
+                if inserted_time is None or time - inserted_time >= cache_size:
+                    inserted[vertex] = time
+                    time += 1
+                    cluster_misses += 1
+            if cluster_misses <= patch_threshold * (triangle - cluster_start + 1):
+                starts.append(cluster_start)
+                cluster_start = triangle + 1
+                cluster_misses = 0
+                time += cache_size
+        if cluster_start < end:
+            starts.append(cluster_start)
+
+    # Area weighted centroid and normal of every cluster
+    corners = positions[indices].astype(np.float64)
+    centroids = corners.mean(axis=1)
+    normals = np.cross(corners[:,1] - corners[:,0], corners[:,2] - corners[:,0])
+    areas = np.linalg.norm(normals, axis=1)
+    total_area = areas.sum()
+    if total_area > 0:
+        mesh_centroid = (centroids * areas[:,None]).sum(axis=0) / total_area
+    else:
+        mesh_centroid = centroids.mean(axis=0)
+
+    cluster_areas = np.add.reduceat(areas, starts)
+    cluster_centroids = np.add.reduceat(centroids * areas[:,None], starts) / np.maximum(cluster_areas, 1e-30)[:,None]
+    cluster_normals = np.add.reduceat(normals, starts)
+    cluster_normals /= np.maximum(np.linalg.norm(cluster_normals, axis=1), 1e-30)[:,None]
+
+    # Clusters on the outside of the mesh facing outwards first
+    keys = ((cluster_centroids - mesh_centroid) * cluster_normals).sum(axis=1)
+    ends = starts[1:] + [num_triangles]
+    order = np.concatenate([np.arange(starts[cluster], ends[cluster]) for cluster in np.argsort(-keys, kind='stable')])
+    return indices[order]
+
+# Resolution of the views and barycentric coordinates of the fragments sampled per triangle by estimate_overdraw()
+OVERDRAW_RESOLUTION = 256
+OVERDRAW_SAMPLES = np.array([[1/3, 1/3, 1/3], [2/3, 1/6, 1/6], [1/6, 2/3, 1/6], [1/6, 1/6, 2/3]])
+
+def estimate_overdraw(positions, indices, resolution=OVERDRAW_RESOLUTION):
+    """
+    Estimates the overdraw of a triangle list: the number of fragments shaded per visible fragment (1.0 is no overdraw),
+    averaged over orthographic views along the six axis directions with backface culling and early depth testing.
+    The triangles are point sampled on a coarse grid, which is good enough to compare triangle orders of the same mesh
+    """
+    if len(indices) == 0:
+        return 1.0
+
+    corners = positions[indices].astype(np.float64)
+    samples = np.einsum('sk,fkd->fsd', OVERDRAW_SAMPLES, corners)
+    normals = np.cross(corners[:,1] - corners[:,0], corners[:,2] - corners[:,0])
+
+    minimum = corners.min(axis=(0, 1))
+    extent = corners.max(axis=(0, 1)) - minimum
+    extent[extent == 0] = 1.0
+    samples = (samples - minimum) / extent
+    grid = np.minimum((samples * resolution).astype(np.int64), resolution - 1)
+
+    shaded = 0
+    visible = 0
+    for axis in range(3):
+        u, v = [other for other in range(3) if other != axis]
+        cells = grid[:,:,u] * resolution + grid[:,:,v]
+        for sign in (1.0, -1.0):
+            # Looking along sign * axis, front faces point against the view direction
+            front = normals[:,axis] * sign < 0
+            if not front.any():
+                continue
+            cell = cells[front].reshape(-1)
+            depth = samples[front][:,:,axis].reshape(-1)
+            if sign < 0:
+                depth = 1.0 - depth
+
+            # Fragments of every cell in draw order, a fragment is shaded if it is nearer than all the ones drawn before it.
+            # Subtracting 2 per cell keeps the running minimum of one cell from carrying over into the next
+            order = np.argsort(cell, kind='stable')
+            cell = cell[order]
+            key = depth[order] - 2.0 * cell
+            shaded += np.count_nonzero(key <= np.minimum.accumulate(key))
+            visible += len(np.unique(cell))
+
+    return shaded / visible if visible > 0 else 1.0
+
+def submesh_positions(mesh_data, submesh):
+    if submesh.use_shared_vertices:
+        return mesh_data.shared_vertex_data.positions
+    return submesh.vertex_data.positions
+
+def analyze_vertex_cache(mesh_data, cache_size=CACHE_SIZE):
+    """
+    Returns the ACMR of the whole MeshData
+    """
+    misses = sum(average_cache_miss_ratio(submesh.indices, cache_size) * len(submesh.indices) for submesh in mesh_data.submeshes)
+    num_triangles = sum(len(submesh.indices) for submesh in mesh_data.submeshes)
+    return misses / num_triangles if num_triangles > 0 else 0.0
+
+def analyze_overdraw(mesh_data, skip_materials=()):
+    """
+    Returns the overdraw estimate of the whole MeshData (average of the submeshes weighted by their number of triangles)
+    """
+    overdraw = 0.0
+    num_triangles = 0
+    for submesh in mesh_data.submeshes:
+        if submesh.material in skip_materials:
+            continue
+        overdraw += estimate_overdraw(submesh_positions(mesh_data, submesh), submesh.indices) * len(submesh.indices)
+        num_triangles += len(submesh.indices)
+    return overdraw / num_triangles if num_triangles > 0 else 1.0
+
+def optimize_triangle_order(mesh_data, overdraw_threshold=None, skip_materials=(), cache_size=CACHE_SIZE):
+    """
+    Reorders the triangles of every submesh of the MeshData for the vertex cache,
+    and then for less overdraw if an overdraw_threshold is given (except submeshes with a material in skip_materials)
+    """
+    for submesh in mesh_data.submeshes:
+        submesh.indices = optimize_vertex_cache(submesh.indices, cache_size)
+        if overdraw_threshold is not None and submesh.material not in skip_materials:
+            submesh.indices = optimize_overdraw(submesh_positions(mesh_data, submesh), submesh.indices, overdraw_threshold, cache_size)
+
+def optimize_lod_order(mesh_data, cache_size=CACHE_SIZE):
+    """
+    Reorders the triangles of the generated LOD levels of every submesh for the vertex cache
+    """
+    for submesh in mesh_data.submeshes:
+        submesh.lod_indices = [optimize_vertex_cache(indices, cache_size) for indices in submesh.lod_indices]
+
+def optimize_vertex_fetch(mesh_data):
+    """
+    Renumbers the vertices of every vertex buffer of the MeshData in order of first use by the index buffers,
+    so the vertices are fetched from memory in order. Bone assignments and poses are renumbered with them
+    """
+    buffers = []
+    if mesh_data.shared_vertex_data is not None:
+        buffers.append( (None, mesh_data.shared_vertex_data, [submesh for submesh in mesh_data.submeshes if submesh.use_shared_vertices]) )
+    for index, submesh in enumerate(mesh_data.submeshes):
+        if not submesh.use_shared_vertices:
+            buffers.append( (index, submesh.vertex_data, [submesh]) )
+
+    for target, vertex_data, submeshes in buffers:
+        used = np.concatenate([submesh.indices.reshape(-1) for submesh in submeshes] + [np.zeros(0, dtype=np.int64)])
+
+        # Vertices in order of first use, vertices no triangle uses go last
+        first_use = np.full(vertex_data.vertex_count, len(used), dtype=np.int64)
+        np.minimum.at(first_use, used, np.arange(len(used)))
+        new_order = np.argsort(first_use, kind='stable')
+        remap = np.empty(vertex_data.vertex_count, dtype=np.int64)
+        remap[new_order] = np.arange(vertex_data.vertex_count)
+
+        new_vertex_data = vertex_data.subset(new_order)
+        if target is None:
+            mesh_data.shared_vertex_data = new_vertex_data
+        else:
+            mesh_data.submeshes[target].vertex_data = new_vertex_data
+
+        for submesh in submeshes:
+            submesh.indices = remap[submesh.indices]
+            submesh.lod_indices = [remap[indices] for indices in submesh.lod_indices]
+
+        for pose in mesh_data.poses:
+            if pose.target == target:
+                pose.indices = remap[pose.indices]
@@ -0,0 +1,454 @@
+import logging, struct
+import numpy as np
+from .. import config
+from .mesh_data import EdgeData
+
+logger = logging.getLogger('mesh_serializer')
+
+# Writes binary Ogre .mesh files directly from a MeshData (see ogre/mesh_data.py),
+# without going through .mesh.xml and OgreXMLConverter.
+# The chunk layout follows OgreMeshFileFormat.h / OgreMeshSerializerImpl.cpp of Ogre 1.10+
+
+# Chunk identifiers
+M_HEADER                            = 0x1000
+M_MESH                              = 0x3000
+M_SUBMESH                           = 0x4000
+M_SUBMESH_OPERATION                 = 0x4010
+M_SUBMESH_BONE_ASSIGNMENT           = 0x4100
+M_GEOMETRY                          = 0x5000
+M_GEOMETRY_VERTEX_DECLARATION       = 0x5100
+M_GEOMETRY_VERTEX_ELEMENT           = 0x5110
+M_GEOMETRY_VERTEX_BUFFER            = 0x5200
+M_GEOMETRY_VERTEX_BUFFER_DATA       = 0x5210
+M_MESH_SKELETON_LINK                = 0x6000
+M_MESH_BONE_ASSIGNMENT              = 0x7000
+M_MESH_LOD_LEVEL                    = 0x8000
+M_MESH_LOD_MANUAL                   = 0x8110
+M_MESH_LOD_GENERATED                = 0x8120
+M_MESH_BOUNDS                       = 0x9000
+M_SUBMESH_NAME_TABLE                = 0xA000
+M_SUBMESH_NAME_TABLE_ELEMENT        = 0xA100
+M_EDGE_LISTS                        = 0xB000
+M_EDGE_LIST_LOD                     = 0xB100
+M_EDGE_GROUP                        = 0xB110
+M_POSES                             = 0xC000
+M_POSE                              = 0xC100
+M_POSE_VERTEX                       = 0xC111
+M_ANIMATIONS                        = 0xD000
+M_ANIMATION                         = 0xD100
+M_ANIMATION_TRACK                   = 0xD110
+M_ANIMATION_POSE_KEYFRAME           = 0xD112
+M_ANIMATION_POSE_REF                = 0xD113
+
+# Size of the chunk header: unsigned short id + unsigned int length
+CHUNK_OVERHEAD_SIZE = 6
+
+# VertexElementType
+VET_FLOAT2 = 1
+VET_FLOAT3 = 2
+VET_FLOAT4 = 3
+VET_COLOUR_ABGR = 11
+# Packed types (see VERTEX_PACKING), loading them needs Ogre 13.4 or newer
+VET_UBYTE4_NORM = 30
+VET_INT_10_10_10_2_NORM = 39
+VET_HALF2 = 41
+VET_HALF4 = 43
+
+# VertexElementSemantic
+VES_POSITION = 1
+VES_NORMAL = 4
+VES_DIFFUSE = 5
+VES_TEXTURE_COORDINATES = 7
+VES_TANGENT = 9
+
+# RenderOperation::OperationType
+OPERATION_TYPES = {
+    'point_list' : 1,
+    'line_list' : 2,
+    'line_strip' : 3,
+    'triangle_list' : 4,
+    'triangle_strip' : 5,
+    'triangle_fan' : 6,
+}
+
+# VertexAnimationType
+VAT_POSE = 2
+
+# Largest error allowed when packing into half floats: half a texel of a 1024 texture for UVs,
+# and about 0.1% of the size of the mesh for positions
+HALF_UV_TOLERANCE = 1.0 / 2048.0
+HALF_POSITION_TOLERANCE = 1.0 / 1024.0
+
+def fits_half(values, tolerance):
+    """
+    Returns whether the values survive the conversion to half floats within the given tolerance
+    """
+    if len(values) == 0:
+        return True
+    with np.errstate(over='ignore', invalid='ignore'):
+        error = np.abs(values.astype(np.float16).astype(np.float64) - values)
+    return bool(np.all(error <= tolerance))
+
+def half_positions_fit(positions):
+    extent = float((positions.max(axis=0) - positions.min(axis=0)).max()) if len(positions) > 0 else 0.0
+    return fits_half(positions.astype(np.float64), extent * HALF_POSITION_TOLERANCE)
+
+def texture_coordinates(uv):
+    """
+    Returns the (V, 2) float64 texture coordinates in Ogre convention (V flipped)
+    """
+    texcoords = np.empty((len(uv), 2), dtype=np.float64)
+    texcoords[:, 0] = uv[:, 0]
+    texcoords[:, 1] = 1.0 - uv[:, 1].astype(np.float64)
+    return texcoords
+
+def pack_int_10_10_10_2(vectors):
+    """
+    Packs (V, 3) or (V, 4) vectors in [-1, 1] into INT_10_10_10_2_NORM: 10 bit signed x, y, z and a 2 bit signed w
+    (the bitangent sign of tangents). Returns a (V, 1) uint32 array
+    """
+    xyz = np.round(np.clip(vectors[:, :3], -1.0, 1.0) * 511.0).astype(np.int64) & 0x3FF
+    packed = xyz[:, 0] | (xyz[:, 1] << 10) | (xyz[:, 2] << 20)
+    if vectors.shape[1] > 3:
+        packed |= (np.round(np.clip(vectors[:, 3], -1.0, 1.0)).astype(np.int64) & 0x3) << 30
+    return packed.astype('<u4').reshape(-1, 1)
+
+def vertex_elements(vertex_data, packing=''):
+    """
+    Describes the vertex layout of a VertexData as a list of
+    (source, type, semantic, index, data) where data is a (V, N) numpy array holding the element values.
+    Positions and normals go into buffer 0 (the one changed by skeletal and pose animation),
+    everything else into buffer 1.
+    packing: letters of the attributes to pack, see VERTEX_PACKING
+    """
+    if 'p' in packing and half_positions_fit(vertex_data.positions):
+        positions = np.ones((vertex_data.vertex_count, 4), dtype='<f2')
+        positions[:, :3] = vertex_data.positions
+        elements = [ (0, VET_HALF4, VES_POSITION, 0, positions) ]
+    else:
+        elements = [ (0, VET_FLOAT3, VES_POSITION, 0, vertex_data.positions.astype('<f4')) ]
+
+    if 'n' in packing:
+        elements.append( (0, VET_INT_10_10_10_2_NORM, VES_NORMAL, 0, pack_int_10_10_10_2(vertex_data.normals)) )
+    else:
+        elements.append( (0, VET_FLOAT3, VES_NORMAL, 0, vertex_data.normals.astype('<f4')) )
+
+    if vertex_data.tangents is not None:
+        tangents = vertex_data.tangents if vertex_data.tangent_dimensions == 4 else vertex_data.tangents[:, :3]
+        if 'n' in packing:
+            elements.append( (1, VET_INT_10_10_10_2_NORM, VES_TANGENT, 0, pack_int_10_10_10_2(tangents)) )
+        elif vertex_data.tangent_dimensions == 4:
+            elements.append( (1, VET_FLOAT4, VES_TANGENT, 0, tangents.astype('<f4')) )
+        else:
+            elements.append( (1, VET_FLOAT3, VES_TANGENT, 0, tangents.astype('<f4')) )
+
+    if vertex_data.colors is not None:
+        # ColourValue::getAsABGR() truncates, 0xAABBGGRR stored little endian gives bytes R, G, B, A.
+        # UBYTE4_NORM has the same bytes, but is not swizzled by the render system
+        colors = (np.clip(vertex_data.colors, 0.0, 1.0) * 255).astype(np.uint8)
+        elements.append( (1, VET_UBYTE4_NORM if 'c' in packing else VET_COLOUR_ABGR, VES_DIFFUSE, 0, colors) )
+
+    for index, uv in enumerate(vertex_data.uvs):
+        texcoords = texture_coordinates(uv)
+        if 'u' in packing and fits_half(texcoords, HALF_UV_TOLERANCE):
+            elements.append( (1, VET_HALF2, VES_TEXTURE_COORDINATES, index, texcoords.astype('<f2')) )
+        else:
+            elements.append( (1, VET_FLOAT2, VES_TEXTURE_COORDINATES, index, texcoords.astype('<f4')) )
+
+    return elements
+
+def interleave(arrays, vertex_count):
+    """
+    Interleaves the given (V, N) arrays into a single vertex buffer, returns (buffer, vertex size)
+    """
+    columns = [np.ascontiguousarray(array).view(np.uint8).reshape(vertex_count, -1) for array in arrays]
+    vertex_size = sum(column.shape[1] for column in columns)
+    buffer = np.empty((vertex_count, vertex_size), dtype=np.uint8)
+    offset = 0
+    for column in columns:
+        buffer[:, offset:offset + column.shape[1]] = column
+        offset += column.shape[1]
+    return buffer, vertex_size
+
+class MeshSerializer:
+    """
+    Writes a MeshData as binary Ogre mesh in the MeshSerializer_v1.100 format (Ogre 1.10 and newer).
+    Chunk lengths are patched in after each chunk has been written, so the file object must be seekable.
+    """
+    version = "[MeshSerializer_v1.100]"
+
+    def __init__(self, f):
+        self.f = f
+        self.chunks = []
+        # Only the colours are packed for now: the values of the INT_10_10_10_2_NORM and HALF types
+        # are not verified against an Ogre build yet ('n', 'p' and 'u' are ignored,
+        # PACK_INT_10_10_10_2 is done by OgreMeshUpgrader)
+        self.packing = ''.join(flag for flag in config.get('VERTEX_PACKING') or '' if flag == 'c')
+        self.edge_lists = config.get('GENERATE_EDGE_LISTS') is True
+
+    def write_mesh(self, mesh_data):
+        if mesh_data.skeleton_name is not None or mesh_data.poses:
+            # Software skinning and pose animation only work on float positions and normals
+            self.packing = self.packing.replace('p', '').replace('n', '')
+
+        self.write_ushort(M_HEADER)
+        self.write_string(self.version)
+
+        self.start_chunk(M_MESH)
+        self.write_bool(mesh_data.skeleton_name is not None)
+
+        if mesh_data.shared_vertex_data is not None:
+            self.write_geometry(mesh_data.shared_vertex_data)
+
+        for submesh in mesh_data.submeshes:
+            self.write_submesh(mesh_data, submesh)
+
+        if mesh_data.skeleton_name is not None:
+            self.start_chunk(M_MESH_SKELETON_LINK)
+            self.write_string(mesh_data.skeleton_name)
+            self.end_chunk()
+
+        if mesh_data.shared_vertex_data is not None:
+            self.write_bone_assignments(M_MESH_BONE_ASSIGNMENT, mesh_data.shared_vertex_data)
+
+        if mesh_data.manual_lods or mesh_data.generated_lods:
+            self.write_lod_info(mesh_data)
+
+        self.write_bounds(mesh_data)
+        self.write_submesh_name_table(mesh_data)
+
+        if self.edge_lists:
+            self.write_edge_lists(mesh_data)
+
+        if mesh_data.poses:
+            self.write_poses(mesh_data)
+
+        if mesh_data.animations:
+            self.write_animations(mesh_data)
+
+        self.end_chunk()
+
+    def write_geometry(self, vertex_data):
+        vertex_count = vertex_data.vertex_count
+        elements = vertex_elements(vertex_data, self.packing)
+
+        self.start_chunk(M_GEOMETRY)
+        self.write_uint(vertex_count)
+
+        # Vertex declaration
+        sources = sorted(set(element[0] for element in elements))
+        self.start_chunk(M_GEOMETRY_VERTEX_DECLARATION)
+        for source in sources:
+            offset = 0
+            for element_source, element_type, semantic, index, data in elements:
+                if element_source != source:
+                    continue
+                self.start_chunk(M_GEOMETRY_VERTEX_ELEMENT)
+                self.write_ushort(source, element_type, semantic, offset, index)
+                self.end_chunk()
+                offset += data.itemsize * data.shape[1]
+        self.end_chunk()
+
+        # Vertex buffers
+        for source in sources:
+            buffer, vertex_size = interleave([element[4] for element in elements if element[0] == source], vertex_count)
+            self.start_chunk(M_GEOMETRY_VERTEX_BUFFER)
+            self.write_ushort(source, vertex_size)
+            self.start_chunk(M_GEOMETRY_VERTEX_BUFFER_DATA)
+            self.f.write(buffer.tobytes())
+            self.end_chunk()
+            self.end_chunk()
+
+        self.end_chunk()
+
+    def write_submesh(self, mesh_data, submesh):
+        vertex_data = submesh.vertex_data or mesh_data.shared_vertex_data
+
+        self.start_chunk(M_SUBMESH)
+        self.write_string(submesh.material or '')
+        self.write_bool(submesh.use_shared_vertices)
+        self.write_uint(submesh.indices.size)
+        self.write_indices(submesh.indices, vertex_data.vertex_count > 65535)
+
+        if not submesh.use_shared_vertices:
+            self.write_geometry(submesh.vertex_data)
+
+        self.start_chunk(M_SUBMESH_OPERATION)
+        self.write_ushort(OPERATION_TYPES[submesh.operation_type])
+        self.end_chunk()
+
+        if not submesh.use_shared_vertices:
+            self.write_bone_assignments(M_SUBMESH_BONE_ASSIGNMENT, submesh.vertex_data)
+
+        self.end_chunk()
+
+    def write_indices(self, indices, use_32bit_indexes):
+        self.write_bool(use_32bit_indexes)
+        if indices.size > 0:
+            self.f.write(indices.astype('<u4' if use_32bit_indexes else '<u2').tobytes())
+
+    def write_bone_assignments(self, chunk_id, vertex_data):
+        if vertex_data.bone_assignments is None:
+            return
+
+        # Every assignment is a chunk of its own: header, unsigned int vertex, unsigned short bone, float weight
+        vertex_indices, bone_indices, weights = vertex_data.bone_assignments
+        records = np.empty(len(vertex_indices), dtype=np.dtype([
+            ('id', '<u2'), ('length', '<u4'), ('vertex', '<u4'), ('bone', '<u2'), ('weight', '<f4')
+        ]))
+        records['id'] = chunk_id
+        records['length'] = records.itemsize
+        records['vertex'] = vertex_indices
+        records['bone'] = bone_indices
+        records['weight'] = weights
+        self.f.write(records.tobytes())
+
+    def write_lod_info(self, mesh_data):
+        self.start_chunk(M_MESH_LOD_LEVEL)
+        self.write_string('distance_box')
+        # The full detail mesh counts as a level
+        self.write_ushort(len(mesh_data.manual_lods) + len(mesh_data.generated_lods) + 1)
+        for distance, mesh_name in mesh_data.manual_lods:
+            self.start_chunk(M_MESH_LOD_MANUAL)
+            self.write_float(distance)
+            self.write_string(mesh_name)
+            self.end_chunk()
+        for level, distance in enumerate(mesh_data.generated_lods):
+            self.start_chunk(M_MESH_LOD_GENERATED)
+            self.write_float(distance)
+            for submesh in mesh_data.submeshes:
+                vertex_data = submesh.vertex_data or mesh_data.shared_vertex_data
+                indices = submesh.lod_indices[level]
+                # Index count and start, and the index buffer is not the one of another level (-1)
+                self.write_uint(indices.size, 0, 0xFFFFFFFF)
+                self.write_bool(vertex_data.vertex_count > 65535)
+                self.write_uint(indices.size)
+                if indices.size > 0:
+                    self.f.write(indices.astype('<u4' if vertex_data.vertex_count > 65535 else '<u2').tobytes())
+            self.end_chunk()
+        self.end_chunk()
+
+    def write_bounds(self, mesh_data):
+        minimum, maximum, radius = mesh_data.bounds()
+        self.start_chunk(M_MESH_BOUNDS)
+        self.write_float(*minimum.tolist())
+        self.write_float(*maximum.tolist())
+        self.write_float(radius)
+        self.end_chunk()
+
+    def write_submesh_name_table(self, mesh_data):
+        self.start_chunk(M_SUBMESH_NAME_TABLE)
+        for index, submesh in enumerate(mesh_data.submeshes):
+            self.start_chunk(M_SUBMESH_NAME_TABLE_ELEMENT)
+            self.write_ushort(index)
+            self.write_string(submesh.name)
+            self.end_chunk()
+        self.end_chunk()
+
+    def write_edge_lists(self, mesh_data):
+        self.start_chunk(M_EDGE_LISTS)
+        manual_count = len(mesh_data.manual_lods)
+        for lod_index in range(manual_count + len(mesh_data.generated_lods) + 1):
+            self.start_chunk(M_EDGE_LIST_LOD)
+            self.write_ushort(lod_index)
+            # Manual LOD levels have the edge lists in their own mesh
+            manual = 0 < lod_index <= manual_count
+            self.write_bool(manual)
+            if not manual:
+                # Generated LOD levels follow the manual ones (see write_lod_info())
+                edge_data = EdgeData(mesh_data, max(lod_index - manual_count, 0))
+                self.write_bool(edge_data.closed)
+                self.write_uint(len(edge_data.triangles), len(edge_data.groups))
+                self.f.write(edge_data.triangles.tobytes())
+                for vertex_set, triangle_start, triangle_count, edges in edge_data.groups:
+                    self.start_chunk(M_EDGE_GROUP)
+                    self.write_uint(vertex_set, triangle_start, triangle_count, len(edges))
+                    self.f.write(edges.tobytes())
+                    self.end_chunk()
+            self.end_chunk()
+        self.end_chunk()
+
+    def write_poses(self, mesh_data):
+        self.start_chunk(M_POSES)
+        for pose in mesh_data.poses:
+            self.start_chunk(M_POSE)
+            self.write_string(pose.name)
+            # 0 targets the shared geometry, otherwise the submesh index + 1
+            self.write_ushort(0 if pose.target is None else pose.target + 1)
+            self.write_bool(pose.normals is not None)
+
+            fields = [('id', '<u2'), ('length', '<u4'), ('vertex', '<u4'), ('offset', '<f4', 3)]
+            if pose.normals is not None:
+                fields.append(('normal', '<f4', 3))
+            records = np.empty(len(pose.indices), dtype=np.dtype(fields))
+            records['id'] = M_POSE_VERTEX
+            records['length'] = records.itemsize
+            records['vertex'] = pose.indices
+            records['offset'] = pose.offsets
+            if pose.normals is not None:
+                records['normal'] = pose.normals
+            self.f.write(records.tobytes())
+
+            self.end_chunk()
+        self.end_chunk()
+
+    def write_animations(self, mesh_data):
+        self.start_chunk(M_ANIMATIONS)
+        for animation in mesh_data.animations:
+            self.start_chunk(M_ANIMATION)
+            self.write_string(animation.name)
+            self.write_float(animation.length)
+
+            for target, keyframes in animation.tracks(mesh_data.poses):
+                self.start_chunk(M_ANIMATION_TRACK)
+                self.write_ushort(VAT_POSE)
+                # 0 targets the shared geometry, otherwise the submesh index + 1
+                self.write_ushort(0 if target is None else target + 1)
+                for time, pose_refs in keyframes:
+                    self.start_chunk(M_ANIMATION_POSE_KEYFRAME)
+                    self.write_float(time)
+                    for pose_index, influence in pose_refs:
+                        self.start_chunk(M_ANIMATION_POSE_REF)
+                        self.write_ushort(pose_index)
+                        self.write_float(influence)
+                        self.end_chunk()
+                    self.end_chunk()
+                self.end_chunk()
+
+            self.end_chunk()
+        self.end_chunk()
+
+    def start_chunk(self, chunk_id):
+        self.chunks.append(self.f.tell())
+        # The length is written by end_chunk()
+        self.f.write(struct.pack('<HI', chunk_id, 0))
+
+    def end_chunk(self):
+        start = self.chunks.pop()
+        end = self.f.tell()
+        # The chunk length includes the chunk header
+        self.f.seek(start + 2)
+        self.f.write(struct.pack('<I', end - start))
+        self.f.seek(end)
+
+    def write_bool(self, *values):
+        self.f.write(struct.pack('<%d?' % len(values), *values))
+
+    def write_ushort(self, *values):
+        self.f.write(struct.pack('<%dH' % len(values), *values))
+
+    def write_uint(self, *values):
+        self.f.write(struct.pack('<%dI' % len(values), *values))
+
+    def write_float(self, *values):
+        self.f.write(struct.pack('<%df' % len(values), *values))
+
+    def write_string(self, text):
+        self.f.write(text.encode('utf-8') + b'\n')
+
+def write_mesh(mesh_data, target_file):
+    """
+    Writes the binary .mesh file for the given MeshData
+    """
+    with open(target_file, 'wb') as f:
+        MeshSerializer(f).write_mesh(mesh_data)
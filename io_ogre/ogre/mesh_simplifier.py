@@ -0,0 +1,269 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger('mesh_simplifier')
+
+# Level of detail generation done by the exporter itself (LOD_GENERATION = '3').
+# Every LOD level is a new index buffer over the vertex buffers of the full detail mesh
+
+# Weight of the planes that keep open borders in place, relative to the planes of the triangles
+BORDER_WEIGHT = 10.0
+
+def plane_quadrics(normals, distances, weights):
+    """
+    Returns the (N, 10) error quadrics of the planes n.p + d = 0 (unit normals), scaled by the weights.
+    Components: aa, ab, ac, ad, bb, bc, bd, cc, cd, dd
+    """
+    a, b, c = normals[:,0], normals[:,1], normals[:,2]
+    d = distances
+    return np.stack([a*a, a*b, a*c, a*d, b*b, b*c, b*d, c*c, c*d, d*d], axis=1) * weights[:,None]
+
+def quadric_error(quadrics, points):
+    """
+    Returns the (N,) errors of the quadrics at the points (sum of the squared distances to their planes)
+    """
+    x, y, z = points[:,0], points[:,1], points[:,2]
+    q = quadrics
+    return np.abs(x*x*q[:,0] + 2*x*y*q[:,1] + 2*x*z*q[:,2] + 2*x*q[:,3] + y*y*q[:,4] + 2*y*z*q[:,5] + 2*y*q[:,6]
+        + z*z*q[:,7] + 2*z*q[:,8] + q[:,9])
+
+def unit_vectors(vectors):
+    lengths = np.linalg.norm(vectors, axis=1)
+    return vectors / np.maximum(lengths, 1e-30)[:,None], lengths
+
+class MeshSimplifier:
+    """
+    Quadric error metric simplification (Garland and Heckbert) by collapsing vertices onto neighbouring vertices,
+    so the simplified triangles only use vertices that are already in the vertex buffers.
+    Vertices on UV or normal seams, on borders between submeshes and on non-manifold edges never move,
+    vertices on open borders only move along the border.
+
+    positions: (V, 3) positions of the vertices of all the vertex buffers
+    triangles: (F, 3) indices into positions
+    submeshes: (F,) submesh of every triangle
+    """
+    def __init__(self, positions, triangles, submeshes):
+        # Vertices at the same position are the same vertex of the surface
+        keys = np.ascontiguousarray(positions, dtype=np.float32)
+        keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * 3))).reshape(-1)
+        first, self.position_ids = np.unique(keys, return_index=True, return_inverse=True)[1:]
+        self.position_ids = self.position_ids.reshape(-1)
+        self.points = np.asarray(positions, dtype=np.float64)[first]
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        self.submeshes = np.asarray(submeshes, dtype=np.int64)
+
+        # Quadrics of the planes of the triangles around every vertex
+        self.quadrics = np.zeros((len(self.points), 10), dtype=np.float64)
+        corners = self.points[self.position_ids[self.triangles]]
+        normals, lengths = unit_vectors(np.cross(corners[:,1] - corners[:,0], corners[:,2] - corners[:,0]))
+        quadrics = plane_quadrics(normals, -(normals * corners[:,0]).sum(axis=1), lengths * 0.5)
+        for corner in range(3):
+            np.add.at(self.quadrics, self.position_ids[self.triangles[:,corner]], quadrics)
+
+        # Planes through the open border edges, perpendicular to their triangle, keep the border from moving inwards
+        topology = self.topology()
+        border = topology['edge_counts'] == 1
+        starts = topology['from'][border]
+        ends = topology['to'][border]
+        edge_normals = np.repeat(normals, 3, axis=0)[border]
+        edges, edge_lengths = unit_vectors(self.points[ends] - self.points[starts])
+        border_normals = unit_vectors(np.cross(edges, edge_normals))[0]
+        quadrics = plane_quadrics(border_normals, -(border_normals * self.points[starts]).sum(axis=1), edge_lengths * edge_lengths * BORDER_WEIGHT)
+        np.add.at(self.quadrics, starts, quadrics)
+        np.add.at(self.quadrics, ends, quadrics)
+
+    def topology(self):
+        """
+        Returns the half edges of the current triangles and which vertices may move
+        """
+        ids = self.position_ids[self.triangles]
+        starts = ids.reshape(-1)
+        ends = ids[:, [1, 2, 0]].reshape(-1)
+        vertex_starts = self.triangles.reshape(-1)
+        vertex_ends = self.triangles[:, [1, 2, 0]].reshape(-1)
+        half_edge_submeshes = np.repeat(self.submeshes, 3)
+        num_points = len(self.points)
+
+        # Half edges of the same edge, in either direction
+        keys = np.minimum(starts, ends) * num_points + np.maximum(starts, ends)
+        _, edges, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        edges = edges.reshape(-1)
+        forward = np.zeros(len(counts), dtype=np.int64)
+        np.add.at(forward, edges, starts < ends)
+        first_submesh = np.full(len(counts), np.iinfo(np.int64).max)
+        last_submesh = np.full(len(counts), -1)
+        np.minimum.at(first_submesh, edges, half_edge_submeshes)
+        np.maximum.at(last_submesh, edges, half_edge_submeshes)
+
+        # Edges that are not shared by exactly two triangles of the same submesh facing the same way
+        non_manifold = (counts > 2) | ((counts == 2) & (forward != 1)) | (first_submesh != last_submesh)
+        locked = np.zeros(num_points, dtype=bool)
+        locked[starts[non_manifold[edges]]] = True
+        locked[ends[non_manifold[edges]]] = True
+
+        # Seams: vertices with more than one Ogre vertex at the same position
+        used = np.unique(self.triangles)
+        locked |= np.bincount(self.position_ids[used], minlength=num_points) > 1
+
+        # Open borders: a vertex can only slide along a single border
+        border_edges = counts[edges] == 1
+        border_count = np.bincount(starts[border_edges], minlength=num_points) + np.bincount(ends[border_edges], minlength=num_points)
+        locked |= border_count > 2
+
+        return {
+            'from' : starts, 'to' : ends, 'vertex_from' : vertex_starts, 'vertex_to' : vertex_ends,
+            'edge_counts' : counts[edges], 'locked' : locked, 'border' : border_count > 0,
+        }
+
+    def simplify(self, target_count):
+        """
+        Collapses vertices until there are at most target_count triangles, or nothing more can be collapsed.
+        Can be called again with a lower target_count for the next level of detail
+        """
+        while len(self.triangles) > target_count:
+            if not self.collapse(len(self.triangles) - target_count):
+                break
+        return len(self.triangles)
+
+    def collapse(self, triangles_to_remove):
+        """
+        One pass of collapses that don't touch each other's triangles, cheapest first.
+        Returns the number of collapses done
+        """
+        topology = self.topology()
+        locked, border = topology['locked'], topology['border']
+
+        # Vertex u moves to v along the edge u-v, in both directions of every half edge
+        u = np.concatenate([topology['from'], topology['to']])
+        v = np.concatenate([topology['to'], topology['from']])
+        vertex_u = np.concatenate([topology['vertex_from'], topology['vertex_to']])
+        vertex_v = np.concatenate([topology['vertex_to'], topology['vertex_from']])
+        on_border = np.tile(topology['edge_counts'] == 1, 2)
+        valid = ~locked[u] & (~border[u] | on_border)
+        u, v, vertex_u, vertex_v = u[valid], v[valid], vertex_u[valid], vertex_v[valid]
+        if len(u) == 0:
+            return 0
+
+        _, unique = np.unique(u * len(self.points) + v, return_index=True)
+        u, v, vertex_u, vertex_v = u[unique], v[unique], vertex_u[unique], vertex_v[unique]
+        costs = quadric_error(self.quadrics[u], self.points[v])
+
+        # Only consider the collapses about as cheap as the ones needed to reach the target
+        order = np.argsort(costs, kind='stable')
+        limit = costs[order[min(len(order) - 1, triangles_to_remove)]]
+        order = order[costs[order] <= limit]
+        order = order[~self.flips(u[order], v[order])]
+
+        # Triangles around every vertex, to keep collapses in this pass apart
+        ids = self.position_ids[self.triangles]
+        corner_order = np.argsort(ids.reshape(-1), kind='stable')
+        corner_starts = np.searchsorted(ids.reshape(-1)[corner_order], np.arange(len(self.points) + 1))
+        corner_triangles = (corner_order // 3).tolist()
+        corner_starts = corner_starts.tolist()
+        triangle_ids = ids.tolist()
+
+        taken = [False] * len(self.points)
+        selected = []
+        removed = 0
+        border = border.tolist()
+        for index, point_u, point_v in zip(order.tolist(), u[order].tolist(), v[order].tolist()):
+            if taken[point_u] or taken[point_v]:
+                continue
+            selected.append(index)
+            for triangle in corner_triangles[corner_starts[point_u]:corner_starts[point_u + 1]]:
+                for point in triangle_ids[triangle]:
+                    taken[point] = True
+            removed += 1 if border[point_u] else 2
+            if removed >= triangles_to_remove:
+                break
+
+        if not selected:
+            return 0
+
+        selected = np.array(selected, dtype=np.int64)
+        remap = np.arange(len(self.position_ids))
+        remap[vertex_u[selected]] = vertex_v[selected]
+        self.quadrics[v[selected]] += self.quadrics[u[selected]]
+
+        self.triangles = remap[self.triangles]
+        ids = self.position_ids[self.triangles]
+        keep = (ids[:,0] != ids[:,1]) & (ids[:,1] != ids[:,2]) & (ids[:,2] != ids[:,0])
+        self.triangles = self.triangles[keep]
+        self.submeshes = self.submeshes[keep]
+        return len(selected)
+
+    def flips(self, u, v):
+        """
+        Returns for every collapse of u onto v whether it would turn a triangle around u over (or make it degenerate)
+        """
+        ids = self.position_ids[self.triangles]
+        flat = ids.reshape(-1)
+        corner_order = np.argsort(flat, kind='stable')
+        corner_starts = np.searchsorted(flat[corner_order], np.arange(len(self.points) + 1))
+
+        # Every collapse with every corner at u
+        counts = corner_starts[u + 1] - corner_starts[u]
+        collapse = np.repeat(np.arange(len(u)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        corners = corner_order[np.repeat(corner_starts[u], counts) + offsets]
+        triangles = ids[corners // 3]
+
+        # Triangles that have v as well disappear
+        moved = triangles == u[collapse][:,None]
+        keep = ~(triangles == v[collapse][:,None]).any(axis=1)
+        collapse, triangles, moved = collapse[keep], triangles[keep], moved[keep]
+
+        before = self.points[triangles]
+        after = before.copy()
+        after[moved] = self.points[np.repeat(v[collapse], 3).reshape(-1, 3)[moved]]
+        normals_before = np.cross(before[:,1] - before[:,0], before[:,2] - before[:,0])
+        normals_after = np.cross(after[:,1] - after[:,0], after[:,2] - after[:,0])
+        flipped = ((normals_before * normals_after).sum(axis=1) <= 0) & (np.abs(normals_before).sum(axis=1) > 0)
+
+        result = np.zeros(len(u), dtype=bool)
+        result[collapse[flipped]] = True
+        return result
+
+def generate_lod_levels(mesh_data, levels, distance, reduction):
+    """
+    Adds generated LOD levels to the MeshData: every level has reduction (0..1) fewer triangles than the one before,
+    and starts distance further away. Stops early when the mesh can't be simplified any further.
+    The LOD levels are index buffers over the vertex buffers of the submeshes (SubMesh.lod_indices)
+    """
+    # All the vertex buffers in one array
+    offsets = {}
+    positions = []
+    count = 0
+    for index, submesh in enumerate(mesh_data.submeshes):
+        key = None if submesh.use_shared_vertices else index
+        if key not in offsets:
+            vertex_data = submesh.vertex_data or mesh_data.shared_vertex_data
+            offsets[key] = count
+            positions.append(vertex_data.positions)
+            count += vertex_data.vertex_count
+
+    submesh_offsets = [offsets[None if submesh.use_shared_vertices else index] for index, submesh in enumerate(mesh_data.submeshes)]
+    triangles = np.concatenate([np.asarray(submesh.indices, dtype=np.int64).reshape(-1, 3) + offset
+        for submesh, offset in zip(mesh_data.submeshes, submesh_offsets)] + [np.zeros((0, 3), dtype=np.int64)])
+    submeshes = np.concatenate([np.full(len(submesh.indices), index, dtype=np.int64)
+        for index, submesh in enumerate(mesh_data.submeshes)] + [np.zeros(0, dtype=np.int64)])
+    if len(triangles) == 0:
+        return
+
+    simplifier = MeshSimplifier(np.concatenate(positions), triangles, submeshes)
+    full_count = len(triangles)
+    current_count = full_count
+    target = float(full_count)
+    for level in range(1, levels + 1):
+        target *= 1.0 - reduction
+        lod_count = simplifier.simplify(int(target))
+        # A level that hardly has fewer triangles than the previous one isn't worth it
+        if lod_count > current_count * 0.95 or lod_count < 4:
+            logger.info('- LOD level: %s, triangle count: %s cannot be simplified any further. Ignoring LOD.' % (level, lod_count))
+            break
+        current_count = lod_count
+
+        for index, submesh in enumerate(mesh_data.submeshes):
+            submesh.lod_indices.append(simplifier.triangles[simplifier.submeshes == index] - submesh_offsets[index])
+        mesh_data.generated_lods.append(distance * level)
+        logger.info('- LOD level: %s at distance %s, %s triangles (%.1f%%)' % (level, distance * level, lod_count, 100.0 * lod_count / full_count))
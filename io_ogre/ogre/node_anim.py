@@ -2,7 +2,7 @@ import bpy, mathutils, logging, time
 from .. import config
 from ..report import Report
 from ..xml import RDocument
-from .. import util
+from .. import util, number_format
 from os.path import join
 
 logger = logging.getLogger('node_anim')
@@ -92,7 +92,7 @@ def write_animation(ob, action, frame_start, frame_end, doc, xmlnode):
     a.setAttribute("loop", "false")
     a.setAttribute("interpolationMode", "linear")
     a.setAttribute("rotationInterpolationMode", "linear")
-    a.setAttribute("length", '%6f' % ((frame_end) / _fps))
+    a.setAttribute("length", number_format.format_float((frame_end) / _fps))
     aa.appendChild(a)
 
     frame_current = bpy.context.scene.frame_current
@@ -107,12 +107,11 @@ def write_animation(ob, action, frame_start, frame_end, doc, xmlnode):
     #if config.get('NODE_KEYFRAMES') is True:
     #    frames = get_keyframes(action)
 
+    # The frames are sampled first and their numbers formatted at once:
+    # time, position x y z, rotation qw qx qy qz, scale x y z
+    values = []
     for frame in frames:
 
-        kf = doc.createElement('keyframe')
-        kf.setAttribute("time", '%6f' % (frame / _fps))
-        a.appendChild(kf)
-
         bpy.context.scene.frame_set(frame)
 
         translation = mathutils.Vector((0, 0, 0))
@@ -132,27 +131,38 @@ def write_animation(ob, action, frame_start, frame_end, doc, xmlnode):
             scale.y = current_scale.y / initial_scale.y
             scale.z = current_scale.z / initial_scale.z
 
+        values.append( (frame / _fps,
+            translation.x, translation.y, translation.z,
+            rotation_quat.w, rotation_quat.x, rotation_quat.y, rotation_quat.z,
+            scale.x, scale.y, scale.z) )
+
+    bpy.context.scene.frame_set(frame_current)
+
+    for text in number_format.format_floats(values).tolist():
+
+        kf = doc.createElement('keyframe')
+        kf.setAttribute("time", text[0])
+        a.appendChild(kf)
+
         t = doc.createElement('position')
-        t.setAttribute("x", '%6f' % translation.x)
-        t.setAttribute("y", '%6f' % translation.y)
-        t.setAttribute("z", '%6f' % translation.z)
+        t.setAttribute("x", text[1])
+        t.setAttribute("y", text[2])
+        t.setAttribute("z", text[3])
         kf.appendChild(t)
 
         q = doc.createElement('rotation')
-        q.setAttribute("qw", '%6f' % rotation_quat.w)
-        q.setAttribute("qx", '%6f' % rotation_quat.x)
-        q.setAttribute("qy", '%6f' % rotation_quat.y)
-        q.setAttribute("qz", '%6f' % rotation_quat.z)
+        q.setAttribute("qw", text[4])
+        q.setAttribute("qx", text[5])
+        q.setAttribute("qy", text[6])
+        q.setAttribute("qz", text[7])
         kf.appendChild(q)
 
         s = doc.createElement('scale')
-        s.setAttribute("x", '%6f' % scale.x)
-        s.setAttribute("y", '%6f' % scale.y)
-        s.setAttribute("z", '%6f' % scale.z)
+        s.setAttribute("x", text[8])
+        s.setAttribute("y", text[9])
+        s.setAttribute("z", text[10])
         kf.appendChild(s)
 
-    bpy.context.scene.frame_set(frame_current)
-
 def calc_scale(matrix_local):
     # Scale is different in Ogre from blender - rotation is removed
     ri = matrix_local.to_quaternion().inverted().to_matrix()
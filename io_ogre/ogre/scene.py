@@ -11,7 +11,7 @@ if "bpy" in locals():
 import bpy, mathutils, os, getpass, math, logging, datetime
 from os.path import join
 from . import material, materialv2json, node_anim, mesh, skeleton
-from .. import bl_info, config, util
+from .. import bl_info, config, util, number_format
 from ..report import Report
 from ..xml import *
 from .material import *
@@ -180,37 +180,60 @@ def dot_scene(path, scene_name=None):
             logger.error("Unknown converter type '{}', will not generate materials".format(converter_type))
             Report.errors.append("Unknown converter type '{}', will not generate materials".format(converter_type))
 
-    doc = ogre_document(materials, path)
-
-    mesh_collision_prims = {}
-    mesh_collision_files = {}
-
-    # Export the objects in the scene
-    for root in roots:
-        logger.info("* Exporting root node: %s " % root.name)
-        dot_scene_node_export(root, path = path, doc = doc,
-            exported_meshes = exported_meshes,
-            meshes = meshes,
-            mesh_collision_prims = mesh_collision_prims,
-            mesh_collision_files = mesh_collision_files,
-            exported_armatures = exported_armatures,
-            prefix = prefix,
-            objects = objects,
-            xmlparent = doc._scene_nodes
-        )
-
-    # Create the .scene file
+    # The .scene is written while the objects are exported, without keeping the whole document in memory.
+    # It goes into a temporary file that replaces the target once the export is complete
+    scene_output = None
+    partial_scene_file = target_scene_file + '.part'
     if config.get('SCENE') is True:
-        data = doc.toprettyxml()
         try:
-            with open(target_scene_file, 'wb') as fd:
-                fd.write(bytes(data,'utf-8'))
-            logger.info("- Exported Ogre Scene: %s " % target_scene_file)
+            scene_output = open(partial_scene_file, 'w', encoding='utf-8', newline='\n')
         except Exception as e:
             logger.error("Unable to create scene file: %s" % target_scene_file)
             logger.error(e)
             Report.errors.append("Unable to create scene file: %s" % target_scene_file)
 
+    try:
+        doc = ogre_document(materials, path, scene_output)
+
+        mesh_collision_prims = {}
+        mesh_collision_files = {}
+
+        # Export the objects in the scene
+        for root in roots:
+            logger.info("* Exporting root node: %s " % root.name)
+            # The nodes of a root are written as soon as they are complete
+            nodes = doc.createElement('nodes')
+            dot_scene_node_export(root, path = path, doc = doc,
+                exported_meshes = exported_meshes,
+                meshes = meshes,
+                mesh_collision_prims = mesh_collision_prims,
+                mesh_collision_files = mesh_collision_files,
+                exported_armatures = exported_armatures,
+                prefix = prefix,
+                objects = objects,
+                xmlparent = nodes
+            )
+            for node in nodes.childNodes:
+                doc.append(node)
+
+        # Finish the .scene file
+        doc.end_tag('nodes')
+        for element in doc._scene_elements:
+            doc.append(element)
+        doc.end_tag('scene')
+        doc.close()
+    except:
+        # Don't leave a truncated .scene behind
+        if scene_output is not None:
+            scene_output.close()
+            os.remove(partial_scene_file)
+        raise
+
+    if scene_output is not None:
+        scene_output.close()
+        os.replace(partial_scene_file, target_scene_file)
+        logger.info("- Exported Ogre Scene: %s " % target_scene_file)
+
     # Remove temporary objects/meshes
     for ob in temps:
         logger.debug("Removing temporary mesh: %s" % ob.data.name)
@@ -359,64 +382,70 @@ def _ogre_node_helper( doc, ob, prefix='', pos=None, rot=None, scl=None ):
     else:
         v = swap( mat.to_translation() )
 
-    p = doc.createElement('position')
-    p.setAttribute('x', '%6f' % v.x)
-    p.setAttribute('y', '%6f' % v.y)
-    p.setAttribute('z', '%6f' % v.z)
-    o.appendChild(p)
-
     if rot:
-        v = swap(rot)
+        r = swap(rot)
     else:
-        v = swap( mat.to_quaternion() )
-    q = doc.createElement('rotation')   #('quaternion')
-    q.setAttribute('qx', '%6f' % v.x)
-    q.setAttribute('qy', '%6f' % v.y)
-    q.setAttribute('qz', '%6f' % v.z)
-    q.setAttribute('qw', '%6f' % v.w)
-    o.appendChild(q)
+        r = swap( mat.to_quaternion() )
 
     if scl:     # this should not be used
-        v = swap(scl)
-        x=abs(v.x); y=abs(v.y); z=abs(v.z)
+        sv = swap(scl)
     else:       # scale is different in Ogre from blender - rotation is removed
         ri = mat.to_quaternion().inverted().to_matrix()
         scale = ri.to_4x4() @ mat
-        v = swap( scale.to_scale() )
-        x=abs(v.x); y=abs(v.y); z=abs(v.z)
+        sv = swap( scale.to_scale() )
+
+    x, y, z, qx, qy, qz, qw, sx, sy, sz = number_format.format_floats(
+        (v.x, v.y, v.z, r.x, r.y, r.z, r.w, abs(sv.x), abs(sv.y), abs(sv.z))).tolist()
+
+    p = doc.createElement('position')
+    p.setAttribute('x', x)
+    p.setAttribute('y', y)
+    p.setAttribute('z', z)
+    o.appendChild(p)
+
+    q = doc.createElement('rotation')   #('quaternion')
+    q.setAttribute('qx', qx)
+    q.setAttribute('qy', qy)
+    q.setAttribute('qz', qz)
+    q.setAttribute('qw', qw)
+    o.appendChild(q)
+
     s = doc.createElement('scale')
-    s.setAttribute('x', '%6f' % x)
-    s.setAttribute('y', '%6f' % y)
-    s.setAttribute('z', '%6f' % z)
+    s.setAttribute('x', sx)
+    s.setAttribute('y', sy)
+    s.setAttribute('z', sz)
     o.appendChild(s)
 
     return o
 
-def ogre_document(materials, path):
+def ogre_document(materials, path, output=None):
+    """
+    Starts the .scene document on the text file output (None to write nothing), up to the open <nodes> element.
+    The <externals> and <environment> elements that come after the nodes are in doc._scene_elements
+    """
     now = time.time()
-    doc = RDocument()
-    scn = doc.createElement('scene')
-    doc.appendChild( scn )
+    doc = RDocumentWriter(output)
     time_format = "%a, %d %b %Y %H:%M:%S +0000"
     doc.addComment('exporter: blender2ogre ' + ".".join(str(i) for i in bl_info["version"]))
     doc.addComment('export_time: ' + time.strftime(time_format, time.gmtime(now)))
     doc.addComment('blender_version: %s (%s; %s)' % (bpy.app.version_string, bpy.app.version_cycle, bpy.app.build_platform.decode('UTF-8')))
 
-    scn.setAttribute('formatVersion', '1.1')
     bscn = bpy.context.scene
 
     if '_previous_export_time_' in bscn.keys():
         doc.addComment('previous_export_time: ' + time.strftime(time_format, time.gmtime(bscn['_previous_export_time_'])))
 
     bscn[ '_previous_export_time_' ] = now
-    scn.setAttribute('author', getpass.getuser())
 
-    nodes = doc.createElement('nodes')
-    doc._scene_nodes = nodes
+    doc.start_tag('scene', {
+        'formatVersion' : '1.1',
+        'author' : getpass.getuser()
+    })
+    doc.start_tag('nodes', {})
+
     external = doc.createElement('externals')
     environment = doc.createElement('environment')
-    for n in (nodes, external, environment):
-        scn.appendChild( n )
+    doc._scene_elements = (external, environment)
 
     # External files
     for mat in materials:
@@ -635,7 +664,6 @@ def dot_scene_skybox_export( path ):
                 with w.iword('texture_unit').embed():
                     w.iword('texture').word(skybox_name + ".png").word("cubic").nl()
                     w.iline('tex_address_mode clamp')
-    material_text = w.text
 
     try:
         mat_file_name = join(path, skybox_name + ".material")
@@ -643,7 +671,7 @@ def dot_scene_skybox_export( path ):
             logger.info("SkyBox: Exporting material to: %s" % mat_file_name)
             b2o_ver = ".".join(str(i) for i in bl_info["version"])
             fd.write(bytes('// generated by blender2ogre %s on %s\n' % (b2o_ver, datetime.now().replace(microsecond=0)), 'utf-8'))
-            fd.write(bytes(material_text, 'utf-8'))
+            w.write_to(fd)
     except Exception as e:
         logger.error("Unable to create SkyBox material file: %s" % mat_file_name)
         logger.error(e)
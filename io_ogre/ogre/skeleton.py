@@ -1,8 +1,8 @@
-import bpy, mathutils, logging, time, sys
+import bpy, mathutils, logging, os, time, sys, io
 from .. import config
 from ..report import Report
-from ..xml import RDocument
-from .. import util
+from ..xml import RDocumentWriter
+from .. import util, number_format
 from os.path import join
 
 logger = logging.getLogger('skeleton')
@@ -39,7 +39,8 @@ def dot_skeleton(obj, path, **kwargs):
             logger.debug("Skip exporting Armature for object: %s" % obj.data.name)
             return None
 
-        xmlfile = join(path, '%s.skeleton.xml' % name)
+        # Written (and converted) in the staging directory and then moved into path
+        xmlfile = join(util.staging_dir(path), '%s.skeleton.xml' % name)
 
         logger.info('* Generating: %s.skeleton.xml' % name)
 
@@ -47,13 +48,24 @@ def dot_skeleton(obj, path, **kwargs):
 
         skel = Skeleton( obj )
 
-        with open(xmlfile, 'wb') as fd:
-            logger.debug("Writing Armature to file: %s" % xmlfile)
-            fd.write( bytes(skel.to_xml(),'utf-8') )
+        # Streamed into a temporary file that replaces the .skeleton.xml once it is complete,
+        # so an error halfway never leaves a truncated file to be converted or unstaged
+        partial_xmlfile = xmlfile + '.part'
+        try:
+            with open(partial_xmlfile, 'w', encoding='utf-8', newline='\n') as fd:
+                logger.debug("Writing Armature to file: %s" % xmlfile)
+                skel.write_xml( fd )
+        except:
+            if os.path.isfile(partial_xmlfile):
+                os.remove(partial_xmlfile)
+            raise
+        os.replace(partial_xmlfile, xmlfile)
 
         if kwargs.get('invoke_xml_converter', True):
             util.xml_convert( xmlfile )
 
+        util.unstage( path, '%s.skeleton' % name, '%s.skeleton.xml' % name, 'OgreXMLConverter.log', 'OgreMeshTool.log' )
+
         logger.info('- Done at %s seconds' % util.timer_diff_str(start))
 
         exported_armatures.append( name )
@@ -259,51 +271,53 @@ class Bone_Track:
         kf = Keyframe(time, bone.pose_location, bone.pose_rotation, bone.pose_scale)
         self.keyframes.append( kf )
 
-    def write_track( self, doc, tracks_element ):
+    def write_track( self, doc ):
         isPosAnimated = self.is_pos_animated()
         isRotAnimated = self.is_rot_animated()
         isScaleAnimated = self.is_scale_animated()
         if not isPosAnimated and not isRotAnimated and not isScaleAnimated:
             return
-        track = doc.createElement('track')
-        track.setAttribute('bone', self.bone.name)
-        keyframes_element = doc.createElement('keyframes')
-        track.appendChild( keyframes_element )
+        # The numbers of all keyframes are formatted at once:
+        # time, translate x y z, rotate angle, axis x y z, scale x y z
+        values = []
         for kf in self.keyframes:
-            keyframe = doc.createElement('keyframe')
-            keyframe.setAttribute('time', '%6f' % kf.time)
+            angle = kf.rot.angle
+            axis = kf.rot.axis
+            # if angle is near zero or axis is not unit magnitude,
+            if kf.isRotIdentity():
+                angle = 0.0  # avoid outputs like "-0.00000"
+                axis = mathutils.Vector((0,0,0))
+            values.append( (kf.time, kf.pos.x, kf.pos.y, kf.pos.z, angle, axis[0], axis[1], axis[2], kf.scale[0], kf.scale[1], kf.scale[2]) )
+
+        doc.start_tag('track', {'bone' : self.bone.name})
+        doc.start_tag('keyframes', {})
+        for text in number_format.format_floats(values).tolist():
+            doc.start_tag('keyframe', {'time' : text[0]})
             if isPosAnimated:
-                trans = doc.createElement('translate')
-                keyframe.appendChild( trans )
-                trans.setAttribute('x', '%6f' % kf.pos.x)
-                trans.setAttribute('y', '%6f' % kf.pos.y)
-                trans.setAttribute('z', '%6f' % kf.pos.z)
+                doc.leaf_tag('translate', {
+                    'x' : text[1],
+                    'y' : text[2],
+                    'z' : text[3]
+                })
 
             if isRotAnimated:
-                rotElement =  doc.createElement( 'rotate' )
-                keyframe.appendChild( rotElement )
-                angle = kf.rot.angle
-                axis = kf.rot.axis
-                # if angle is near zero or axis is not unit magnitude,
-                if kf.isRotIdentity():
-                    angle = 0.0  # avoid outputs like "-0.00000"
-                    axis = mathutils.Vector((0,0,0))
-                rotElement.setAttribute('angle', '%6f' %angle )
-                axisElement = doc.createElement('axis')
-                rotElement.appendChild( axisElement )
-                axisElement.setAttribute('x', '%6f' %axis[0])
-                axisElement.setAttribute('y', '%6f' %axis[1])
-                axisElement.setAttribute('z', '%6f' %axis[2])
+                doc.start_tag('rotate', {'angle' : text[4]})
+                doc.leaf_tag('axis', {
+                    'x' : text[5],
+                    'y' : text[6],
+                    'z' : text[7]
+                })
+                doc.end_tag('rotate')
 
             if isScaleAnimated:
-                scale = doc.createElement('scale')
-                keyframe.appendChild( scale )
-                x,y,z = kf.scale
-                scale.setAttribute('x', '%6f' %x)
-                scale.setAttribute('y', '%6f' %y)
-                scale.setAttribute('z', '%6f' %z)
-            keyframes_element.appendChild( keyframe )
-        tracks_element.appendChild( track )
+                doc.leaf_tag('scale', {
+                    'x' : text[8],
+                    'y' : text[9],
+                    'z' : text[10]
+                })
+            doc.end_tag('keyframe')
+        doc.end_tag('keyframes')
+        doc.end_tag('track')
 
 # Skeleton
 def findArmature( ob ):
@@ -374,7 +388,7 @@ class Skeleton(object):
                 #    Report.errors.append('Root bone has non-zero transform (rotation offset)')
                 self.roots.append( b )
 
-    def write_animation( self, arm, actionName, frameBegin, frameEnd, doc, parentElement ):
+    def write_animation( self, arm, actionName, frameBegin, frameEnd, doc ):
         _fps = float( bpy.context.scene.render.fps )
         #boneNames = sorted( [bone.name for bone in arm.pose.bones] )
         bone_tracks = []
@@ -423,10 +437,6 @@ class Skeleton(object):
                 break
         if not animationFound:
             return
-        anim = doc.createElement('animation')
-        parentElement.appendChild( anim )
-        tracks = doc.createElement('tracks')
-        anim.appendChild( tracks )
 
         # Report and log
         suffix_text = ''
@@ -436,51 +446,71 @@ class Skeleton(object):
         Report.armature_animations.append( '%s : %s [start frame=%s end frame=%s]%s' %(arm.name, actionName, frameBegin, frameEnd, suffix_text) )
 
         # Write stuff to skeleton.xml file
-        anim.setAttribute('name', actionName)   # USE the action name
-        anim.setAttribute('length', '%6f' %( (frameEnd - frameBegin)/ _fps ) )
+        doc.start_tag('animation', {
+            'name' : actionName,   # USE the action name
+            'length' : number_format.format_float( (frameEnd - frameBegin)/ _fps )
+        })
+        doc.start_tag('tracks', {})
 
         for track in bone_tracks:
             # will only write a track if there is some kind of animation there
-            track.write_track( doc, tracks )
+            track.write_track( doc )
+
+        doc.end_tag('tracks')
+        doc.end_tag('animation')
 
     def to_xml( self ):
-        doc = RDocument()
-        root = doc.createElement('skeleton'); doc.appendChild( root )
-        bones = doc.createElement('bones'); root.appendChild( bones )
-        bh = doc.createElement('bonehierarchy'); root.appendChild( bh )
+        f = io.StringIO()
+        self.write_xml( f )
+        return f.getvalue()
+
+    def write_xml( self, f ):
+        """
+        Writes the .skeleton.xml into the text file f, the elements are written while the animations are sampled
+        """
+        doc = RDocumentWriter( f )
+        doc.start_tag('skeleton', {})
+        doc.start_tag('bones', {})
         boneId = 0
         for bone in self.bones:
             if not bone.shouldOutput:
                 continue
-            b = doc.createElement('bone')
-            b.setAttribute('name', bone.name)
-            b.setAttribute('id', str(boneId) )
+            doc.start_tag('bone', {
+                'name' : bone.name,
+                'id' : str(boneId)
+            })
             boneId = boneId + 1
-            bones.appendChild( b )
             mat = bone.ogre_rest_matrix.copy()
-            if bone.parent:
-                bp = doc.createElement('boneparent')
-                bp.setAttribute('bone', bone.name)
-                bp.setAttribute('parent', bone.parent.name)
-                bh.appendChild( bp )
 
-            pos = doc.createElement( 'position' ); b.appendChild( pos )
             x,y,z = mat.to_translation()
-            pos.setAttribute('x', '%6f' %x )
-            pos.setAttribute('y', '%6f' %y )
-            pos.setAttribute('z', '%6f' %z )
-            rot =  doc.createElement( 'rotation' ) # "rotation", not "rotate"
-            b.appendChild( rot )
+            doc.leaf_tag('position', {
+                'x' : number_format.format_float(x),
+                'y' : number_format.format_float(y),
+                'z' : number_format.format_float(z)
+            })
 
             q = mat.to_quaternion()
-            rot.setAttribute('angle', '%6f' %q.angle )
-            axis = doc.createElement('axis'); rot.appendChild( axis )
+            doc.start_tag('rotation', {'angle' : number_format.format_float(q.angle)}) # "rotation", not "rotate"
             x,y,z = q.axis
-            axis.setAttribute('x', '%6f' %x )
-            axis.setAttribute('y', '%6f' %y )
-            axis.setAttribute('z', '%6f' %z )
+            doc.leaf_tag('axis', {
+                'x' : number_format.format_float(x),
+                'y' : number_format.format_float(y),
+                'z' : number_format.format_float(z)
+            })
+            doc.end_tag('rotation')
 
             # Ogre bones do not have initial scaling
+            doc.end_tag('bone')
+        doc.end_tag('bones')
+
+        doc.start_tag('bonehierarchy', {})
+        for bone in self.bones:
+            if bone.shouldOutput and bone.parent:
+                doc.leaf_tag('boneparent', {
+                    'bone' : bone.name,
+                    'parent' : bone.parent.name
+                })
+        doc.end_tag('bonehierarchy')
 
         arm = self.arm
         # remember some things so we can put them back later
@@ -489,11 +519,10 @@ class Skeleton(object):
         for b in self.bones:
             b.save_pose_transform()
 
-        anims = doc.createElement('animations')
-        root.appendChild( anims )
+        doc.start_tag('animations', {})
         if not arm.animation_data or (arm.animation_data and not arm.animation_data.nla_tracks):
             # write a single animation from the blender timeline
-            self.write_animation( arm, 'my_animation', bpy.context.scene.frame_start, bpy.context.scene.frame_end, doc, anims )
+            self.write_animation( arm, 'my_animation', bpy.context.scene.frame_start, bpy.context.scene.frame_end, doc )
 
         elif arm.animation_data:
             savedUseNla = arm.animation_data.use_nla
@@ -536,7 +565,7 @@ class Skeleton(object):
                             # suppress this bone's output
                             b.shouldOutput = False
                             suppressedBones.append( b.name )
-                self.write_animation( arm, actionName, actionData[1], actionData[2], doc, anims )
+                self.write_animation( arm, actionName, actionData[1], actionData[2], doc )
                 # restore suppressed bones
                 for boneName in suppressedBones:
                     bone = self.get_bone( boneName )
@@ -551,5 +580,7 @@ class Skeleton(object):
         for b in self.bones:
             b.restore_pose_transform()
 
-        return doc.toprettyxml()
+        doc.end_tag('animations')
+        doc.end_tag('skeleton')
+        doc.close()
 
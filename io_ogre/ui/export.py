@@ -93,14 +93,14 @@ class _OgreCommonExport_(object):
 
         # Options associated with each section
         section_options = {
-            "General" : ["EX_SWAP_AXIS", "EX_V2_MESH_TOOL_VERSION", "EX_EXPORT_XML_DELETE"],
+            "General" : ["EX_SWAP_AXIS", "EX_MESH_SERIALIZER", "EX_V2_MESH_TOOL_VERSION", "EX_EXPORT_XML_DELETE", "EX_XML_FLOAT_PRECISION"],
             "Scene" : ["EX_SCENE", "EX_SELECTED_ONLY", "EX_EXPORT_HIDDEN", "EX_FORCE_CAMERA", "EX_FORCE_LIGHTS", "EX_NODE_ANIMATION", "EX_EXPORT_SKYBOX", "EX_SKYBOX_RESOLUTION"],
             "Materials" : ["EX_MATERIALS", "EX_SEPARATE_MATERIALS", "EX_COPY_SHADER_PROGRAMS", "EX_USE_FFP_PARAMETERS"],
             "Textures" : ["EX_DDS_MIPS", "EX_FORCE_IMAGE_FORMAT"],
             "Armature" : ["EX_ARMATURE_ANIMATION", "EX_SHARED_ARMATURE", "EX_ONLY_KEYFRAMES", "EX_ONLY_DEFORMABLE_BONES", "EX_ONLY_KEYFRAMED_BONES", "EX_OGRE_INHERIT_SCALE", "EX_TRIM_BONE_WEIGHTS"],
-            "Mesh" : ["EX_MESH", "EX_MESH_OVERWRITE", "EX_ARRAY", "EX_V1_EXTREMITY_POINTS", "EX_Vx_GENERATE_EDGE_LISTS", "EX_GENERATE_TANGENTS", "EX_Vx_PACK_INT_10_10_10_2", "EX_Vx_OPTIMISE_ANIMATIONS", "EX_Vx_OPTIMISE_VERTEX_CACHE", "EX_V2_OPTIMISE_VERTEX_BUFFERS", "EX_V2_OPTIMISE_VERTEX_BUFFERS_OPTIONS"],
+            "Mesh" : ["EX_MESH", "EX_MESH_OVERWRITE", "EX_ARRAY", "EX_V1_EXTREMITY_POINTS", "EX_Vx_GENERATE_EDGE_LISTS", "EX_GENERATE_TANGENTS", "EX_VERTEX_WELD_TOLERANCE", "EX_SHARED_GEOMETRY", "EX_SPLIT_16BIT_SUBMESHES", "EX_Vx_PACK_INT_10_10_10_2", "EX_VERTEX_PACKING", "EX_Vx_OPTIMISE_ANIMATIONS", "EX_Vx_OPTIMISE_VERTEX_CACHE", "EX_OPTIMISE_OVERDRAW", "EX_OVERDRAW_THRESHOLD", "EX_V2_OPTIMISE_VERTEX_BUFFERS", "EX_V2_OPTIMISE_VERTEX_BUFFERS_OPTIONS"],
             "LOD" : ["EX_LOD_GENERATION", "EX_LOD_LEVELS", "EX_LOD_DISTANCE", "EX_LOD_PERCENT"],
-            "Shape Animation" : ["EX_SHAPE_ANIMATIONS", "EX_SHAPE_NORMALS"],
+            "Shape Animation" : ["EX_SHAPE_ANIMATIONS", "EX_SHAPE_NORMALS", "EX_SHAPE_OFFSET_EPSILON"],
             "Logging" : ["EX_Vx_ENABLE_LOGGING", "EX_Vx_DEBUG_LOGGING"]
         }
 
@@ -116,7 +116,9 @@ class _OgreCommonExport_(object):
                     if self.converter == "OgreMeshTool":
                         box.prop(self, prop)
                 elif prop.startswith('EX_Vx_'):
-                    if self.converter != "unknown":
+                    # The vertex cache optimization is done by the exporter itself (the option keeps its old name for existing scripts)
+                    if (self.converter != "unknown" or prop == "EX_Vx_OPTIMISE_VERTEX_CACHE" or
+                        (self.EX_MESH_SERIALIZER == 'native' and prop == "EX_Vx_GENERATE_EDGE_LISTS")):
                         box.prop(self, prop)
                 elif prop.startswith('EX_'):
                     box.prop(self, prop)
@@ -125,7 +127,7 @@ class _OgreCommonExport_(object):
         Report.reset()
 
         # Add warning about missing XML converter
-        if self.converter == "unknown":
+        if self.converter == "unknown" and self.EX_MESH_SERIALIZER != 'native':
             Report.errors.append(
               "Cannot find suitable OgreXMLConverter or OgreMeshTool executable.\n" +
               "Exported XML mesh was NOT automatically converted to .mesh file.\n" + 
@@ -227,6 +229,14 @@ class _OgreCommonExport_(object):
 
         # Start exporting the elements in the scene
         scene.dot_scene(target_path, target_file_name_no_ext)
+
+        # The native serializer only writes meshes, skeletons still need the converter
+        if self.converter == "unknown" and self.EX_MESH_SERIALIZER == 'native' and Report.armatures:
+            Report.errors.append(
+              "Cannot find suitable OgreXMLConverter or OgreMeshTool executable.\n" +
+              "Exported XML skeleton was NOT automatically converted to .skeleton file.\n" +
+              "You MUST run the converter manually to create binary .skeleton file.")
+
         Report.show()
 
         # Flush and close all logging file handlers
@@ -258,6 +268,11 @@ class _OgreCommonExport_(object):
         name='Swap Axis',
         description='Axis swapping mode',
         default=config.get('SWAP_AXIS')) = {}
+    EX_MESH_SERIALIZER : EnumProperty(
+        items=config.MESH_SERIALIZERS,
+        name='Mesh Serializer',
+        description='How to write the binary .mesh files',
+        default=config.get('MESH_SERIALIZER')) = {}
     EX_V2_MESH_TOOL_VERSION : EnumProperty(
         items=config.MESH_TOOL_VERSIONS,
         name='Mesh Export Version',
@@ -268,6 +283,12 @@ class _OgreCommonExport_(object):
         description="""Remove the generated XML files after binary conversion.
 (The removal will only happen if OgreXMLConverter/OgreMeshTool finishes successfully)""",
         default=config.get('EXPORT_XML_DELETE')) = {}
+    EX_XML_FLOAT_PRECISION : IntProperty(
+        name="XML Float Precision",
+        description="""Number of decimals of the floats in the .mesh.xml, .skeleton.xml and .scene files.
+0 writes the shortest number that reads back as the same 32 bit float (smaller files without losing precision)""",
+        min=0, max=9,
+        default=config.get('XML_FLOAT_PRECISION')) = {}
 
     # Scene
     EX_SCENE : BoolProperty(
@@ -400,29 +421,67 @@ For some meshes with transparent materials (partial transparency) this can be us
         default=config.get('EXTREMITY_POINTS')) = {}
     EX_Vx_GENERATE_EDGE_LISTS : BoolProperty(
         name="Generate Edge Lists",
-        description="Generate Edge Lists (for Stencil Shadows)",
+        description="""Generate Edge Lists (for Stencil Shadows).
+The 'native' serializer writes them itself, otherwise OgreXMLConverter / OgreMeshUpgrader / OgreMeshTool generate them""",
         default=config.get('GENERATE_EDGE_LISTS')) = {}
     EX_GENERATE_TANGENTS : EnumProperty(
         items=config.TANGENT_MODES,
         name="Tangents",
         description="Export tangents generated by Blender",
         default=config.get('GENERATE_TANGENTS')) = {}
+    EX_VERTEX_WELD_TOLERANCE : FloatProperty(
+        name="Vertex Weld Tolerance",
+        description="""Corners of the same vertex are exported as a single Ogre vertex when their normals, UVs, colors and tangents are within this tolerance.
+0 merges only exactly equal corners""",
+        min=0.0, max=0.1, precision=6,
+        default=config.get('VERTEX_WELD_TOLERANCE')) = {}
+    EX_SHARED_GEOMETRY : EnumProperty(
+        items=config.SHARED_GEOMETRY_MODES,
+        name='Shared Geometry',
+        description='Whether the submeshes of a mesh share one vertex buffer or each have their own',
+        default=config.get('SHARED_GEOMETRY')) = {}
+    EX_SPLIT_16BIT_SUBMESHES : BoolProperty(
+        name="Split for 16 bit Indices",
+        description="""Split submeshes with more than 65535 vertices into several submeshes with the same material, so all of them can use 16 bit indices.
+The extra submeshes are named <submesh>.1, <submesh>.2, ... Implies dedicated geometry for meshes with more than 65535 vertices""",
+        default=config.get('SPLIT_16BIT_SUBMESHES')) = {}
     EX_Vx_PACK_INT_10_10_10_2 : BoolProperty(
         name="Pack into 'INT_10_10_10_2' format",
         description="""Ogre now supports normalized INT_10_10_10_2 as the normal format.
 This packs 3 signed values with 10bit precision and a fourth 2bit value into 4 bytes; the size of a single float.
 If you are using normal-maps, you will notice how this format is perfect to store a tangent with parity, while only requiring 25% of storage compared to 4 floats""",
         default=config.get('PACK_INT_10_10_10_2')) = {}
+    EX_VERTEX_PACKING : StringProperty(
+        name="Native Vertex Packing",
+        description="""Vertex attributes to pack when writing binary meshes with the 'native' serializer (Ogre 13.4+ needed to load them).
+Available flags are:
+c - stores colours as UBYTE4_NORM.
+n (normals and tangents to INT_10_10_10_2_NORM), p (POSITION to 16-bit floats) and u (UVs to 16-bit floats) are disabled for now and ignored""",
+        maxlen=4,
+        default=config.get('VERTEX_PACKING')) = {}
     EX_Vx_OPTIMISE_ANIMATIONS : BoolProperty(
         name="Optimise Animations",
         description="DON'T optimise out redundant tracks & keyframes",
         default=config.get('OPTIMISE_ANIMATIONS')) = {}
     EX_Vx_OPTIMISE_VERTEX_CACHE : BoolProperty(
         name="Optimise Vertex Cache",
-        description="""This reorders the index buffer of the mesh such that triangles are rendered in order of proximity.
-If enabled, the MeshUpgrader will print the change of the "average cache miss ratio (ACMR)" metric.
-It measures the number of cache misses per triangle and thus ranges from 3.0 (all 3 vertices missed) to about 0.5 for an optimized mesh""",
+        description="""This reorders the index buffer of the mesh such that triangles are rendered in order of proximity,
+and then the vertex buffer such that vertices are stored in the order they are first used.
+This is done by the exporter itself, so it does not need OgreMeshUpgrader. With logging enabled, the change of the "average cache miss ratio (ACMR)" metric is printed to the log.
+It measures the number of cache misses per triangle and thus ranges from 3.0 (all 3 vertices missed) to about 0.5 for an optimized mesh.
+Takes about 1 second per 200000 triangles""",
         default=config.get('OPTIMISE_VERTEX_CACHE')) = {}
+    EX_OPTIMISE_OVERDRAW : BoolProperty(
+        name="Optimise Overdraw",
+        description="""After optimising the vertex cache, cut the triangles of every opaque submesh into clusters and draw the clusters facing outwards first,
+so the depth test rejects more of the hidden fragments. Helps fill-rate bound meshes like foliage and facades.
+Submeshes with a blended material are left alone. With logging enabled, the change of the estimated overdraw is printed in the report""",
+        default=config.get('OPTIMISE_OVERDRAW')) = {}
+    EX_OVERDRAW_THRESHOLD : FloatProperty(
+        name="Overdraw ACMR Threshold",
+        description="How much the average cache miss ratio (ACMR) may get worse for less overdraw, 1.05 allows 5% more vertex cache misses",
+        min=1.0, max=3.0, precision=2,
+        default=config.get('OVERDRAW_THRESHOLD')) = {}
     EX_V2_OPTIMISE_VERTEX_BUFFERS : BoolProperty(
         name="Optimise Vertex Buffers For Shaders",
         description="Optimise vertex buffers for shaders.\nSee Vertex Buffers Options for more settings",
@@ -470,6 +529,12 @@ S - strips the buffers for shadow mapping (consumes less space and memory)""",
         name="Shape Normals",
         description="Export normals in shape animations (updates the .mesh file)",
         default=config.get('SHAPE_NORMALS')) = {}
+    EX_SHAPE_OFFSET_EPSILON : FloatProperty(
+        name="Shape Offset Epsilon",
+        description="""Vertices that a shape key moves by at most this distance (and whose normal changes by at most this much) are left out of the pose.
+0 leaves out only the vertices the shape key does not change at all""",
+        min=0.0, max=1.0, precision=6,
+        default=config.get('SHAPE_OFFSET_EPSILON')) = {}
 
     # Logging
     EX_Vx_ENABLE_LOGGING : BoolProperty(
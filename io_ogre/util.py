@@ -1,5 +1,6 @@
 from os.path import split, splitext
-import bpy, logging, logging, mathutils, os, re, subprocess, sys, time
+import bpy, io, logging, logging, mathutils, os, re, shutil, subprocess, sys, time
+import numpy as np
 from . import config
 from . report import Report
 
@@ -91,6 +92,8 @@ def mesh_upgrade_tool(infile):
 
     output_path, filename = os.path.split(infile)
 
+    pack_normals = config.get('PACK_INT_10_10_10_2') is True
+
     if not os.path.exists(infile):
         logger.warn("Cannot find file mesh file: %s, unable run OgreMeshUpgrader" % filename)
 
@@ -100,10 +103,7 @@ def mesh_upgrade_tool(infile):
         if config.get('GENERATE_EDGE_LISTS') is True:
             Report.warnings.append("OgreMeshUpgrader failed, Edge Lists will not be generated for this mesh: %s" % filename)
 
-        if config.get('OPTIMISE_VERTEX_CACHE') is True:
-            Report.warnings.append("OgreMeshUpgrader failed, Vertex Cache will not be optimized for this mesh: %s" % filename)
-
-        if config.get('PACK_INT_10_10_10_2') is True:
+        if pack_normals:
             Report.warnings.append("OgreMeshUpgrader failed, Normals won't be packed for this mesh: %s" % filename)
 
         return
@@ -149,18 +149,9 @@ def mesh_upgrade_tool(infile):
         if output.find("-el") == -1:
             cmd.append('-e')
 
-    # Vertex Cache Optimization
-    # https://www.ogre3d.org/2024/02/26/ogre-14-2-released#vertex-cache-optimization-in-meshupgrader
-    if config.get('OPTIMISE_VERTEX_CACHE') is True:
-        if output.find("-optvtxcache") == -1:
-            logger.warn("Vertex Cache Optimization requested, but this version of OgreMeshUpgrader does not support it (OGRE >= 14.2)")
-            Report.warnings.append("Vertex Cache Optimization requested, but this version of OgreMeshUpgrader does not support it (OGRE >= 14.2)")
-        else:
-            cmd.append('-optvtxcache')
-
     # Normal Packing
     # https://www.ogre3d.org/2022/06/07/ogre-13-4-released#vetint1010102norm-support-added
-    if config.get('PACK_INT_10_10_10_2') is True:
+    if pack_normals:
         if output.find("-pack") == -1:
             logger.warn("Normal Packing requested, but this version of OgreMeshUpgrader does not support it (OGRE >= 13.4)")
             Report.warnings.append("Normal Packing requested, but this version of OgreMeshUpgrader does not support it (OGRE >= 13.4)")
@@ -186,10 +177,7 @@ def mesh_upgrade_tool(infile):
     if config.get('GENERATE_EDGE_LISTS') is True and ('-e' not in cmd or '-el' in cmd):
         logger.info("* Generating Edge Lists for mesh: %s" % filename)
 
-    if config.get('OPTIMISE_VERTEX_CACHE') is True and '-optvtxcache' in cmd:
-        logger.info("* Optimizing Vertex Cache for mesh: %s" % filename)
-
-    if config.get('PACK_INT_10_10_10_2') is True and '-pack' in cmd:
+    if pack_normals and '-pack' in cmd:
         logger.info("* Packing Normals for mesh: %s" % filename)
 
     # First try to execute with the -log option
@@ -211,10 +199,7 @@ def mesh_upgrade_tool(infile):
         if config.get('GENERATE_EDGE_LISTS') is True:
             Report.warnings.append("OgreMeshUpgrader failed, Edge Lists will not be generated for this mesh: %s" % filename)
 
-        if config.get('OPTIMISE_VERTEX_CACHE') is True:
-            Report.warnings.append("OgreMeshUpgrader failed, Vertex Cache will not be optimized for this mesh: %s" % filename)
-
-        if config.get('PACK_INT_10_10_10_2') is True:
+        if pack_normals:
             Report.warnings.append("OgreMeshUpgrader failed, Normals won't be packed for this mesh: %s" % filename)
 
         if error != None:
@@ -227,10 +212,7 @@ def mesh_upgrade_tool(infile):
         if config.get('GENERATE_EDGE_LISTS') is True and ('-e' not in cmd or '-el' in cmd):
             logger.info("- Generated Edge Lists for mesh: %s" % filename)
 
-        if config.get('OPTIMISE_VERTEX_CACHE') is True and '-optvtxcache' in cmd:
-            logger.info("- Optimized Vertex Cache for mesh: %s" % filename)
-
-        if config.get('PACK_INT_10_10_10_2') is True and '-pack' in cmd:
+        if pack_normals and '-pack' in cmd:
             logger.info("- Packed Normals for mesh: %s" % filename)
 
 def detect_converter_type():
@@ -451,6 +433,58 @@ def xml_convert(infile, has_uvs=False):
             logger.info("Removing generated xml file after conversion: %s" % infile)
             os.remove(infile)
 
+def staging_dir(path):
+    """
+    Returns the directory to write the intermediate files (.mesh.xml, .skeleton.xml, converter logs) for the output directory path.
+    With STAGING_DIR set (e.g. a tmpfs like /dev/shm) they are written and converted there and only the results
+    are moved into path by unstage(), else they are written to path itself.
+    When STAGING_DIR is missing or not writable the files also go to path
+    """
+    staging = config.get('STAGING_DIR')
+    if not staging:
+        return path
+    if not os.path.isdir(staging) or not os.access(staging, os.W_OK | os.X_OK):
+        logger.debug("Staging directory %s is missing or not writable, writing to %s" % (staging, path))
+        return path
+    # A directory per Blender instance, so exports running at the same time don't mix up their files
+    staging = os.path.join(staging, 'blender2ogre-%d' % os.getpid())
+    try:
+        os.makedirs(staging, exist_ok=True)
+    except OSError as e:
+        logger.warning("Unable to create staging directory %s, writing to %s (%s)" % (staging, path, e))
+        return path
+    return staging
+
+def unstage(path, *filenames):
+    """
+    Moves the files that exist in the staging directory (see staging_dir()) into the output directory path,
+    each one replaces the file in path atomically
+    """
+    staging = staging_dir(path)
+    if os.path.abspath(staging) == os.path.abspath(path):
+        return
+
+    for filename in filenames:
+        staged_file = os.path.join(staging, filename)
+        if not os.path.isfile(staged_file):
+            continue
+        target_file = os.path.join(path, filename)
+        logger.debug("Moving %s to %s" % (staged_file, target_file))
+        try:
+            os.replace(staged_file, target_file)
+        except OSError:
+            # On another file system: copy next to the target first, so it never is partially written
+            temp_file = '%s.%d.tmp' % (target_file, os.getpid())
+            shutil.copyfile(staged_file, temp_file)
+            os.replace(temp_file, target_file)
+            os.remove(staged_file)
+
+    # Only removed when nothing else is staged there
+    try:
+        os.rmdir(staging)
+    except OSError:
+        pass
+
 def image_magick( image, origin_filepath, target_filepath, separate_channel=None):
     exe = config.get('IMAGE_MAGICK_CONVERT')
     cmd = [ exe, origin_filepath ]
@@ -492,6 +526,32 @@ def swap(vec):
         logging.warn( 'unknown swap axis mode %s', config.get('SWAP_AXIS') )
         assert 0
 
+# Signed permutations (column order, column signs) equivalent to swap() for 3D vectors
+_SWAP_AXIS_PERMUTATIONS = {
+    'xzy'  : ((0, 2, 1), ( 1, 1,  1)),
+    'xz-y' : ((0, 2, 1), ( 1, 1, -1)),
+    '-xzy' : ((0, 2, 1), (-1, 1,  1)),
+}
+
+def swap_array(array):
+    """
+    Vectorized version of swap() for a numpy array of 3D vectors, shape (N, 3).
+    The axis swap matrix is a signed permutation, so it is applied to the whole
+    array as a column shuffle plus sign flip (keeps the values identical to swap())
+    """
+    if config.get('SWAP_AXIS') == 'xyz':
+        return array
+    elif config.get('SWAP_AXIS') not in _SWAP_AXIS_PERMUTATIONS:
+        logging.warn( 'unknown swap axis mode %s', config.get('SWAP_AXIS') )
+        assert 0
+
+    order, signs = _SWAP_AXIS_PERMUTATIONS[ config.get('SWAP_AXIS') ]
+    swapped = array[:, order]
+    for column, sign in enumerate(signs):
+        if sign < 0:
+            np.negative(swapped[:, column], out=swapped[:, column])
+    return swapped
+
 def uid(ob):
     if ob.uid == 0:
         high = 0
@@ -805,15 +865,28 @@ class IndentedWriter(object):
           schnaps
         }
       }
-    """
 
-    sym_stack = []
-    text = ""
-    embed_syms = None
+    The text is kept as list of pieces, write_to() writes it to a file without joining it into one string first
+    """
 
     def __init__(self, indent = 0):
-        for i in range(indent):
-            sym_stack.append(None)
+        self.pieces = []
+        # End symbols of the open embed() blocks, the indentation is one level per entry
+        self.sym_stack = [None] * indent
+        self.embed_syms = None
+
+    @property
+    def text(self):
+        return "".join(self.pieces)
+
+    def write_to(self, fd, chunk_size=4096):
+        """
+        Writes the text to the file fd, chunk_size pieces at a time. Binary files get it UTF-8 encoded
+        """
+        binary = not isinstance(fd, io.TextIOBase)
+        for start in range(0, len(self.pieces), chunk_size):
+            chunk = "".join(self.pieces[start:start + chunk_size])
+            fd.write(chunk.encode('utf-8') if binary else chunk)
 
     def __enter__(self, **kwargs):
         begin_sym, end_sym, nl, space = self.embed_syms
@@ -860,7 +933,7 @@ class IndentedWriter(object):
         return self
 
     def write(self, text):
-        self.text += text
+        self.pieces.append(text)
         return self
 
     def word(self, text):
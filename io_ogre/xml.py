@@ -1,46 +1,172 @@
 from xml.sax.saxutils import XMLGenerator, quoteattr
+import numpy as np
+from . import number_format
 
-class SimpleSaxWriter():
-    def __init__(self, output, root_tag, root_attrs):
+class BufferedWriter():
+    """
+    Collects text and writes it to output (a text file, or None to throw it away) in chunks of about buffer_size characters,
+    flush() writes the rest
+    """
+    def __init__(self, output, buffer_size=1<<20):
         self.output = output
+        self.buffer = []
+        self.buffered = 0
+        self.buffer_size = buffer_size
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.output is not None:
+            self.output.write("".join(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+class SimpleSaxWriter(BufferedWriter):
+    """
+    Writes XML with sorted attributes and 4 spaces indentation.
+    The text is written to output in chunks (see BufferedWriter), close() writes the rest.
+    The write_faces(), write_vertices() and write_bone_assignments() methods
+    format whole arrays with a template of the elements, the output is the same as with leaf_tag()
+    """
+    def __init__(self, output, root_tag, root_attrs, buffer_size=1<<20):
+        super().__init__(output, buffer_size)
         self.root_tag = root_tag
         self.indent=0
-        output.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
+        self.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n")
         self.start_tag(root_tag, root_attrs)
 
-    def _out_tag(self, name, attrs, isLeaf):
+    def _tag_text(self, name, attrs, isLeaf, indent):
         # sorted attributes -- don't want attributes output in random order, which is what the XMLGenerator class does
-        self.output.write(" " * self.indent)
-        self.output.write("<%s" % name)
-        sortedNames = sorted( attrs.keys() )  # sorted list of attribute names
-        for name in sortedNames:
-            value = attrs[ name ]
+        text = [" " * indent, "<", name]
+        for attr_name in sorted(attrs.keys()):
+            value = attrs[ attr_name ]
             # if not of type string,
             if not isinstance(value, str):
                 # turn it into a string
                 value = str(value)
-            self.output.write(" %s=%s" % (name, quoteattr(value)))
-        if isLeaf:
-            self.output.write("/")
-        else:
+            text.append(" %s=%s" % (attr_name, quoteattr(value)))
+        text.append("/>\n" if isLeaf else ">\n")
+        return "".join(text)
+
+    def _out_tag(self, name, attrs, isLeaf):
+        self.write(self._tag_text(name, attrs, isLeaf, self.indent))
+        if not isLeaf:
             self.indent += 4
-        self.output.write(">\n")
 
     def start_tag(self, name, attrs):
         self._out_tag(name, attrs, False)
 
     def end_tag(self, name):
         self.indent -= 4
-        self.output.write(" " * self.indent)
-        self.output.write("</%s>\n" % name)
+        self.write("%s</%s>\n" % (" " * self.indent, name))
 
     def leaf_tag(self, name, attrs):
         self._out_tag(name, attrs, True)
 
+    def template(self, elements):
+        """
+        Returns the text of a record of elements at the current indent as %-format template.
+        elements: list of (name, attrs, depth) of leaf tags, or (name, None, depth) for the start and end tag of an element
+            with children (written twice), depth is the level below the current indent.
+            The attribute values are format specifiers like number_format.float_spec() or '%d', they are not quoted so only numbers can fill them in
+        """
+        open_tags = set()
+        text = []
+        for name, attrs, depth in elements:
+            indent = self.indent + depth * 4
+            if attrs is not None:
+                text.append(self._tag_text(name, attrs, True, indent))
+            elif name in open_tags:
+                text.append("%s</%s>\n" % (" " * indent, name))
+            else:
+                open_tags.add(name)
+                text.append(self._tag_text(name, {}, False, indent))
+        return "".join(text)
+
+    def write_records(self, template, columns):
+        """
+        Writes a record per row with the template (see template())
+        columns: list of arrays with a row per record, in the order of the format specifiers of the template
+        """
+        count = len(columns[0])
+        if count > 0:
+            self.write((template * count) % tuple(number_format.record_values(columns)))
+
+    def write_faces(self, indices, chunk_size=65536):
+        """
+        Writes a <face> for every row of the (F, 3) index array
+        """
+        template = self.template([('face', {'v1' : '%d', 'v2' : '%d', 'v3' : '%d'}, 0)])
+        for start in range(0, len(indices), chunk_size):
+            self.write_records(template, [np.asarray(indices[start:start + chunk_size], dtype=np.int64)])
+
+    def write_vertices(self, positions, normals, tangents=None, colors=None, uvs=(), chunk_size=65536):
+        """
+        Writes a <vertex> with <position>, <normal>, <tangent>, <colour_diffuse> and <texcoord> for every row of the arrays.
+        tangents: (V, 4) or None
+        colors: (V, 4) or None
+        uvs: list of (V, 2) texture coordinates in Blender convention, V gets flipped
+        The arrays are converted chunk_size vertices at a time, so large (or memory mapped) buffers are not copied at once
+        """
+        f = number_format.float_spec()
+        vector = {'x' : f, 'y' : f, 'z' : f}
+        elements = [('vertex', None, 0), ('position', vector, 1), ('normal', vector, 1)]
+        if tangents is not None:
+            elements.append( ('tangent', dict(vector, w=f), 1) )
+        if colors is not None:
+            elements.append( ('colour_diffuse', {'value' : ' '.join([f] * 4)}, 1) )
+        for uv in uvs:
+            elements.append( ('texcoord', {'u' : f, 'v' : f}, 1) )
+        elements.append( ('vertex', None, 0) )
+        template = self.template(elements)
+
+        for start in range(0, len(positions), chunk_size):
+            end = start + chunk_size
+            columns = [positions[start:end], normals[start:end]]
+            if tangents is not None:
+                # The attributes are sorted, w comes first
+                columns.append(tangents[start:end][:, [3, 0, 1, 2]])
+            if colors is not None:
+                columns.append(colors[start:end])
+            for uv in uvs:
+                uv = np.array(uv[start:end], dtype=np.float64)
+                uv[:, 1] = 1.0 - uv[:, 1]
+                columns.append(uv)
+            self.write_records(template, columns)
+
+    def write_bone_assignments(self, vertices, bones, weights, chunk_size=65536):
+        """
+        Writes a <vertexboneassignment> for every (vertex index, bone index, weight)
+        """
+        template = self.template([('vertexboneassignment', {'vertexindex' : '%d', 'boneindex' : '%d', 'weight' : number_format.float_spec()}, 0)])
+        for start in range(0, len(vertices), chunk_size):
+            end = start + chunk_size
+            # The attributes are sorted: boneindex, vertexindex, weight
+            self.write_records(template, [bones[start:end], vertices[start:end], weights[start:end]])
+
     def close(self):
         self.end_tag( self.root_tag )
+        self.flush()
+
+def _element_text(tag, attributes, isLeaf):
+    # Start tag as written by RElement.toprettyxml() and RDocumentWriter
+    s = '<%s ' % tag
+    for name in sorted( attributes.keys() ):
+        value = attributes[name]
+        if not isinstance(value, str):
+            value = str(value)
+        s += '%s=%s ' % (name, quoteattr(value))
+    return s + ('/>' if isLeaf else '>')
 
 class RElement(object):
+    """
+    Element of an XML tree that is written with RDocument.toprettyxml() or RDocumentWriter.append().
+    Only for small subtrees, whole documents are streamed with RDocumentWriter
+    """
     def appendChild( self, child ):
         self.childNodes.append( child )
 
@@ -53,17 +179,10 @@ class RElement(object):
         self.attributes = {}
 
     def toprettyxml(self, lines, indent ):
-        s = '<%s ' % self.tagName
-        sortedNames = sorted( self.attributes.keys() )
-        for name in sortedNames:
-            value = self.attributes[name]
-            if not isinstance(value, str):
-                value = str(value)
-            s += '%s=%s ' % (name, quoteattr(value))
         if not self.childNodes:
-            s += '/>'; lines.append( ('  '*indent)+s )
+            lines.append( ('  '*indent) + _element_text(self.tagName, self.attributes, True) )
         else:
-            s += '>'; lines.append( ('  '*indent)+s )
+            lines.append( ('  '*indent) + _element_text(self.tagName, self.attributes, False) )
             indent += 1
             for child in self.childNodes:
                 child.toprettyxml( lines, indent )
@@ -93,3 +212,65 @@ class RDocument(object):
         self.documentElement.toprettyxml(lines, indent)
         return '\n'.join(lines)
 
+class RDocumentWriter(BufferedWriter):
+    """
+    Writes the same XML as RDocument.toprettyxml(), but while the elements are generated: nothing but the open
+    elements is kept in memory and the text goes to output in chunks (see BufferedWriter).
+    A start tag is only written when the first child or the end tag of the element comes, so elements
+    without children become empty tags like with RDocument. Comments have to be added before the root element.
+    Subtrees built with createElement() (RElement) are written with append()
+    """
+    def __init__(self, output, buffer_size=1<<20):
+        super().__init__(output, buffer_size)
+        self.indent = 0
+        # (tag, attributes) of the start tag that is not written yet
+        self.pending = None
+        self.write('<?xml version="1.0" encoding="UTF-8"?>')
+
+    def _line(self, text):
+        self.write('\n' + text)
+
+    def _write_pending(self):
+        if self.pending is not None:
+            tag, attributes = self.pending
+            self.pending = None
+            self._line(('  '*(self.indent - 1)) + _element_text(tag, attributes, False))
+
+    def addComment(self, text):
+        self._line("<!-- {} -->".format(text))
+
+    def createElement(self, tag):
+        e = RElement(tag)
+        e.document = self
+        return e
+
+    def start_tag(self, tag, attributes):
+        self._write_pending()
+        self.pending = (tag, attributes)
+        self.indent += 1
+
+    def end_tag(self, tag):
+        self.indent -= 1
+        if self.pending is not None:
+            tag, attributes = self.pending
+            self.pending = None
+            self._line(('  '*self.indent) + _element_text(tag, attributes, True))
+        else:
+            self._line(('  '*self.indent) + '</%s>' % tag)
+
+    def leaf_tag(self, tag, attributes):
+        self._write_pending()
+        self._line(('  '*self.indent) + _element_text(tag, attributes, True))
+
+    def append(self, element):
+        """
+        Writes an RElement and its children as child of the current element
+        """
+        self._write_pending()
+        lines = []
+        element.toprettyxml(lines, self.indent)
+        for line in lines:
+            self._line(line)
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,924 @@
+# Unit tests of the exporter's mesh processing and writers, they don't need a scene
+# Run them inside Blender: blender -b --python-exit-code 1 --python test/unit_tests.py
+import bpy, io, os, struct, sys, tempfile, types, unittest
+import numpy as np
+
+bpy.ops.preferences.addon_enable(module='io_ogre')
+
+from io_ogre import config, number_format, util, xml
+from io_ogre.ogre import mesh, mesh_data, mesh_optimizer, mesh_serializer, mesh_simplifier
+
+# Settings the tests depend on, whatever the saved configuration is
+TEST_CONFIG = {
+    'XML_FLOAT_PRECISION' : 6,
+    'VERTEX_PACKING' : '',
+    'PACK_INT_10_10_10_2' : False,
+    'GENERATE_EDGE_LISTS' : False,
+}
+
+def grid_triangles(columns, rows):
+    """
+    Returns the (F, 3) triangle list of a grid of columns x rows quads
+    """
+    vertices = np.arange((columns + 1) * (rows + 1)).reshape(rows + 1, columns + 1)
+    a, b = vertices[:-1, :-1].reshape(-1), vertices[:-1, 1:].reshape(-1)
+    c, d = vertices[1:, :-1].reshape(-1), vertices[1:, 1:].reshape(-1)
+    return np.concatenate((np.stack((a, b, d), axis=1), np.stack((a, d, c), axis=1)))
+
+def grid_positions(columns, rows):
+    x, y = np.meshgrid(np.arange(columns + 1), np.arange(rows + 1))
+    return np.stack((x.reshape(-1), y.reshape(-1), np.zeros(x.size)), axis=1).astype(np.float32)
+
+def sorted_triangles(indices):
+    return sorted(map(tuple, np.asarray(indices).tolist()))
+
+class ConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.saved_config = { key : config.CONFIG.get(key) for key in TEST_CONFIG }
+        config.CONFIG.update(TEST_CONFIG)
+
+    def tearDown(self):
+        config.CONFIG.update(self.saved_config)
+
+class TestWeldVertices(unittest.TestCase):
+    def test_shared_corners_are_welded(self):
+        # Two triangles sharing the edge 1-2, every loop has the same normal
+        triangles = np.arange(6).reshape(2, 3)
+        loop_vertices = np.array([0, 1, 2, 2, 1, 3])
+        normals = np.tile(np.float32([0, 0, 1]), (6, 1))
+
+        vertex_corners, indices = mesh.weld_vertices(triangles, loop_vertices, [normals])
+
+        self.assertEqual(vertex_corners.tolist(), [0, 1, 2, 5])
+        self.assertEqual(indices.tolist(), [[0, 1, 2], [2, 1, 3]])
+
+    def test_different_attributes_are_not_welded(self):
+        # A hard edge: the corners of the second triangle have another normal
+        triangles = np.arange(6).reshape(2, 3)
+        loop_vertices = np.array([0, 1, 2, 2, 1, 3])
+        normals = np.float32([[0, 0, 1]] * 3 + [[0, 1, 0]] * 3)
+        uvs = np.zeros((6, 2), dtype=np.float32)
+
+        vertex_corners, indices = mesh.weld_vertices(triangles, loop_vertices, [normals, uvs])
+
+        self.assertEqual(vertex_corners.tolist(), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(indices.tolist(), [[0, 1, 2], [3, 4, 5]])
+
+    def test_different_vertices_are_not_welded(self):
+        # Same attributes, but every loop is a vertex of its own
+        triangles = np.arange(6).reshape(2, 3)
+        normals = np.tile(np.float32([0, 0, 1]), (6, 1))
+
+        vertex_corners, indices = mesh.weld_vertices(triangles, np.arange(6), [normals])
+
+        self.assertEqual(len(vertex_corners), 6)
+
+    def test_exact_equality(self):
+        triangles = np.arange(6).reshape(2, 3)
+        loop_vertices = np.array([0, 1, 2, 0, 1, 2])
+        # -0.0 and 0.0 are the same value, the next float after 0.5 is not
+        uvs = np.float32([[0.0, 0.5], [0.25, 0.5], [0.5, 0.5], [-0.0, 0.5], [0.25, np.nextafter(np.float32(0.5), np.float32(1))], [0.5, 0.5]])
+
+        vertex_corners, indices = mesh.weld_vertices(triangles, loop_vertices, [uvs])
+
+        self.assertEqual(vertex_corners.tolist(), [0, 1, 2, 4])
+        self.assertEqual(indices.tolist(), [[0, 1, 2], [0, 3, 2]])
+
+    def test_tolerance(self):
+        triangles = np.arange(6).reshape(2, 3)
+        loop_vertices = np.array([0, 1, 2, 0, 1, 2])
+        uvs = np.float32([[0.1, 0.1], [0.2, 0.2], [0.3, 0.3], [0.1000001, 0.1], [0.2, 0.2003], [0.3, 0.3]])
+
+        self.assertEqual(len(mesh.weld_vertices(triangles, loop_vertices, [uvs])[0]), 5)
+        self.assertEqual(len(mesh.weld_vertices(triangles, loop_vertices, [uvs], 1e-5)[0]), 4)
+        self.assertEqual(len(mesh.weld_vertices(triangles, loop_vertices, [uvs], 1e-3)[0]), 3)
+
+    def test_same_as_dictionary(self):
+        rng = np.random.default_rng(0)
+        triangles = rng.permutation(3000).reshape(-1, 3)
+        loop_vertices = rng.integers(0, 300, size=3000)
+        # Few distinct attribute values, so many corners weld
+        normals = rng.integers(0, 2, size=(3000, 3)).astype(np.float32)
+        uvs = rng.integers(0, 2, size=(3000, 2)).astype(np.float32) * 0.5
+
+        vertex_corners, indices = mesh.weld_vertices(triangles, loop_vertices, [normals, uvs])
+
+        # Ogre vertices are numbered in order of first use
+        unique = {}
+        expected = []
+        for loop in triangles.reshape(-1).tolist():
+            key = (loop_vertices[loop], tuple(normals[loop]), tuple(uvs[loop]))
+            expected.append(unique.setdefault(key, len(unique)))
+        self.assertEqual(indices.reshape(-1).tolist(), expected)
+        self.assertEqual(len(vertex_corners), len(unique))
+        self.assertTrue(np.array_equal(indices.reshape(-1)[vertex_corners], np.arange(len(unique))))
+
+    def test_unique_corners(self):
+        # Any subset of the corners can be welded, ids are numbered in order of first use
+        loop_vertices = np.array([3, 3, 1, 3, 1])
+        normals = np.float32([[0, 0, 1], [0, 1, 0], [0, 0, 1], [0, 0, 1], [0, 0, 1]])
+
+        first, ids = mesh.unique_corners(np.array([4, 0, 1, 3, 2]), loop_vertices, [normals])
+
+        self.assertEqual(first.tolist(), [0, 1, 2])
+        self.assertEqual(ids.tolist(), [0, 1, 2, 1, 0])
+
+    def test_empty(self):
+        vertex_corners, indices = mesh.weld_vertices(np.zeros((0, 3), dtype=np.int32), np.zeros(0, dtype=np.int32), [])
+
+        self.assertEqual(len(vertex_corners), 0)
+        self.assertEqual(indices.shape, (0, 3))
+
+class TestBoneAssignments(unittest.TestCase):
+    def test_four_largest_weights(self):
+        # Blender vertex 0 has five weights, vertex 1 two, vertex 2 none
+        vertices = [0, 1, 0, 0, 1, 0, 0]
+        bones = [0, 1, 1, 2, 3, 3, 4]
+        weights = [0.1, 0.2, 0.3, 0.05, 0.6, 0.25, 0.2]
+
+        (ogre_vertices, ogre_bones, ogre_weights), badverts = mesh.bone_assignments(vertices, bones, weights, [0, 1, 2], 3)
+
+        self.assertEqual(badverts, 1)
+        self.assertEqual(ogre_vertices.tolist(), [0, 0, 0, 0, 1, 1])
+        # Largest first, the smallest weight of vertex 0 (bone 2) is dropped
+        self.assertEqual(ogre_bones.tolist(), [1, 3, 4, 0, 3, 1])
+        self.assertTrue(np.allclose(ogre_weights, np.float32([0.3, 0.25, 0.2, 0.1, 0.6, 0.2]) / np.float32([0.85] * 4 + [0.8] * 2)))
+        self.assertEqual(ogre_weights.dtype, np.float32)
+
+    def test_weights_sum_to_one(self):
+        rng = np.random.default_rng(7)
+        vertices = rng.integers(0, 50, size=400)
+        weights = rng.random(400).astype(np.float32) + 0.01
+
+        (ogre_vertices, ogre_bones, ogre_weights), badverts = mesh.bone_assignments(vertices, rng.integers(0, 20, size=400), weights, np.arange(50), 50)
+
+        counts = np.bincount(ogre_vertices, minlength=50)
+        self.assertTrue(np.all(counts == np.minimum(np.bincount(vertices, minlength=50), 4)))
+        self.assertEqual(badverts, np.count_nonzero(np.bincount(vertices, minlength=50) > 4))
+        self.assertTrue(np.allclose(np.bincount(ogre_vertices, weights=ogre_weights), 1.0, atol=1e-6))
+
+    def test_copied_to_ogre_vertices(self):
+        # Ogre vertices 0 and 2 are both made from Blender vertex 1
+        (ogre_vertices, ogre_bones, ogre_weights), badverts = mesh.bone_assignments([0, 1, 1], [5, 6, 7], [1.0, 0.5, 1.5], [1, 0, 1], 2)
+
+        self.assertEqual(badverts, 0)
+        self.assertEqual(ogre_vertices.tolist(), [0, 0, 1, 2, 2])
+        self.assertEqual(ogre_bones.tolist(), [7, 6, 5, 7, 6])
+        self.assertTrue(np.allclose(ogre_weights, [0.75, 0.25, 1.0, 0.75, 0.25]))
+
+    def test_empty(self):
+        (ogre_vertices, ogre_bones, ogre_weights), badverts = mesh.bone_assignments([], [], [], [0, 1], 2)
+
+        self.assertEqual((len(ogre_vertices), len(ogre_bones), len(ogre_weights), badverts), (0, 0, 0, 0))
+
+def two_quads():
+    """
+    Two quads sharing the vertices 2 and 3, one submesh each. Vertex i is weighted to bone i
+    """
+    positions = np.float32([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0], [2, 1, 0], [2, 0, 0]])
+    vertex_data = mesh_data.VertexData(positions, np.tile(np.float32([0, 0, 1]), (6, 1)), uvs=[positions[:, :2] * 0.5])
+    vertex_data.bone_assignments = (np.arange(6), np.arange(6), np.ones(6, dtype=np.float32))
+
+    quads = mesh_data.MeshData('quads')
+    quads.shared_vertex_data = vertex_data
+    quads.submeshes.append(mesh_data.SubMesh('a', 'material_a', np.array([[0, 1, 2], [0, 2, 3]])))
+    quads.submeshes.append(mesh_data.SubMesh('b', 'material_b', np.array([[3, 2, 4], [3, 4, 5]])))
+    return quads
+
+class TestVertexGroupMembership(unittest.TestCase):
+    def test_membership(self):
+        obj = types.SimpleNamespace(vertex_groups=[types.SimpleNamespace(index=index, name=name)
+            for index, name in enumerate(['ogre.vertex.group.a', 'other', 'ogre.vertex.group.b'])])
+        # Vertex 1 is also in another group and vertex 3 in an invalid one, vertex 4 in none
+        vertices = np.array([0, 1, 1, 2, 3, 3])
+        groups = np.array([0, 0, 1, 2, 5, 0])
+
+        names, membership = mesh.vertex_group_membership((vertices, groups, np.ones(6, dtype=np.float32)), 5, obj, 'ogre.vertex.group.')
+
+        self.assertEqual(names, ['ogre.vertex.group.a', 'ogre.vertex.group.b'])
+        self.assertEqual(membership.tolist(), [[True, False], [False, False], [False, True], [False, False], [False, False]])
+
+    def test_no_groups(self):
+        obj = types.SimpleNamespace(vertex_groups=[types.SimpleNamespace(index=0, name='other')])
+        names, membership = mesh.vertex_group_membership((np.array([0]), np.array([0]), np.ones(1, dtype=np.float32)), 3, obj, 'ogre.vertex.group.')
+        self.assertEqual((names, membership.shape), ([], (3, 0)))
+
+class TestDedicatedGeometry(unittest.TestCase):
+    def test_vertex_subsets(self):
+        quads = two_quads()
+        shared = quads.shared_vertex_data
+        original_indices = [submesh.indices.copy() for submesh in quads.submeshes]
+
+        quads.make_geometry_dedicated()
+
+        self.assertIsNone(quads.shared_vertex_data)
+        for submesh, indices, used in zip(quads.submeshes, original_indices, ([0, 1, 2, 3], [2, 3, 4, 5])):
+            self.assertFalse(submesh.use_shared_vertices)
+            self.assertEqual(submesh.vertex_data.vertex_count, 4)
+            self.assertTrue(np.array_equal(submesh.vertex_data.positions, shared.positions[used]))
+            self.assertTrue(np.array_equal(submesh.vertex_data.uvs[0], shared.uvs[0][used]))
+            # The triangles still have the same corners
+            self.assertTrue(np.array_equal(submesh.vertex_data.positions[submesh.indices], shared.positions[indices]))
+            vertices, bones, weights = submesh.vertex_data.bone_assignments
+            self.assertEqual(vertices.tolist(), [0, 1, 2, 3])
+            self.assertEqual(bones.tolist(), used)
+
+    def test_pose_remapping(self):
+        quads = two_quads()
+        offsets = np.float32([[0, 0, 1], [0, 0, 2], [0, 0, 3]])
+        quads.poses.append(mesh_data.Pose('both', None, np.array([1, 3, 4]), offsets))
+        quads.poses.append(mesh_data.Pose('only_a', None, np.array([0]), offsets[:1]))
+        animation = mesh_data.PoseAnimation('animation', 1.0)
+        animation.keyframes.append((0.0, [(0, 1.0), (1, 0.5)]))
+        quads.animations.append(animation)
+
+        quads.make_geometry_dedicated()
+
+        self.assertEqual([(pose.name, pose.target) for pose in quads.poses], [('both', 0), ('only_a', 0), ('both', 1)])
+        # Vertex 3 is the local vertex 3 of submesh a and the local vertex 1 of submesh b
+        self.assertEqual(quads.poses[0].indices.tolist(), [1, 3])
+        self.assertTrue(np.array_equal(quads.poses[0].offsets, offsets[:2]))
+        self.assertEqual(quads.poses[2].indices.tolist(), [1, 2])
+        self.assertTrue(np.array_equal(quads.poses[2].offsets, offsets[1:]))
+
+        self.assertEqual(animation.keyframes, [(0.0, [(0, 1.0), (2, 1.0), (1, 0.5)])])
+        self.assertEqual(animation.tracks(quads.poses), [(0, [(0.0, [(0, 1.0), (1, 0.5)])]), (1, [(0.0, [(2, 1.0)])])])
+
+    def test_lod_indices(self):
+        quads = two_quads()
+        # The LOD level of submesh a uses vertex 4, which the full detail level of a doesn't
+        quads.submeshes[0].lod_indices.append(np.array([[0, 4, 3]]))
+        quads.submeshes[1].lod_indices.append(np.array([[3, 2, 5]]))
+        shared = quads.shared_vertex_data
+
+        quads.make_geometry_dedicated()
+
+        for submesh, lod in zip(quads.submeshes, ([[0, 4, 3]], [[3, 2, 5]])):
+            self.assertTrue(np.array_equal(submesh.vertex_data.positions[submesh.lod_indices[0]], shared.positions[lod]))
+        self.assertEqual(quads.submeshes[0].vertex_data.vertex_count, 5)
+        self.assertEqual(quads.submeshes[1].vertex_data.vertex_count, 4)
+
+    def test_auto_selection(self):
+        # The two quads share 2 of their 6 vertices, dedicated geometry would have 8
+        quads = two_quads()
+        self.assertEqual(quads.submesh_vertex_counts(), [4, 4])
+        self.assertFalse(quads.prefers_dedicated_geometry())
+
+        quads.submeshes[1].indices = np.array([[5, 4, 5]])
+        self.assertEqual(quads.submesh_vertex_counts(), [4, 2])
+        self.assertTrue(quads.prefers_dedicated_geometry())
+
+        del quads.submeshes[1]
+        self.assertFalse(quads.prefers_dedicated_geometry())
+
+    def test_auto_selection_16_bit_indices(self):
+        # 70000 vertices need 32 bit indices, two submeshes of 40000 vertices each fit in 16 bit indices
+        large = mesh_data.MeshData('large')
+        large.shared_vertex_data = mesh_data.VertexData(np.zeros((70000, 3), dtype=np.float32), np.zeros((70000, 3), dtype=np.float32))
+        large.submeshes.append(mesh_data.SubMesh('a', None, np.arange(40000 - 1).reshape(-1, 3)))
+        large.submeshes.append(mesh_data.SubMesh('b', None, np.arange(30000, 70000 - 1).reshape(-1, 3)))
+        self.assertTrue(large.prefers_dedicated_geometry())
+
+        # Too many vertices in common
+        large.submeshes[1].indices = np.arange(10000, 50000 - 1).reshape(-1, 3)
+        large.submeshes.append(mesh_data.SubMesh('c', None, np.arange(20000, 60000 - 1).reshape(-1, 3)))
+        self.assertFalse(large.prefers_dedicated_geometry())
+
+class TestMergeLods(unittest.TestCase):
+    def lod_mesh(self, quads):
+        """
+        A LOD level of two_quads(): each quad is a single triangle with vertices of its own
+        """
+        positions = np.float32([[0, 0, 0], [1, 1, 0], [0, 1, 0], [0, 1, 0], [2, 1, 0], [2, 0, 0]])
+        vertex_data = mesh_data.VertexData(positions, np.tile(np.float32([0, 0, 1]), (6, 1)), uvs=[positions[:, :2] * 0.5])
+        vertex_data.bone_assignments = (np.arange(6), np.arange(6), np.ones(6, dtype=np.float32))
+
+        lod = mesh_data.MeshData('quads_LOD_1')
+        lod.shared_vertex_data = vertex_data
+        lod.skeleton_name = quads.skeleton_name
+        lod.submeshes.append(mesh_data.SubMesh('a', 'material_a', np.array([[0, 1, 2]])))
+        lod.submeshes.append(mesh_data.SubMesh('b', 'material_b', np.array([[3, 4, 5]])))
+        return lod
+
+    def test_append(self):
+        quads = two_quads()
+        lod = self.lod_mesh(quads)
+        # The second level only has submesh a
+        second_lod = self.lod_mesh(quads)
+        del second_lod.submeshes[1]
+
+        self.assertTrue(quads.merge_lods([(10.0, lod), (20.0, second_lod)]))
+
+        self.assertEqual(quads.generated_lods, [10.0, 20.0])
+        self.assertEqual(quads.shared_vertex_data.vertex_count, 18)
+        a, b = quads.submeshes
+        self.assertEqual([indices.tolist() for indices in a.lod_indices], [[[6, 7, 8]], [[12, 13, 14]]])
+        self.assertEqual([indices.tolist() for indices in b.lod_indices], [[[9, 10, 11]], []])
+        self.assertTrue(np.array_equal(quads.shared_vertex_data.positions[6:12], lod.shared_vertex_data.positions))
+        vertices, bones, weights = quads.shared_vertex_data.bone_assignments
+        self.assertEqual(vertices.tolist(), list(range(18)))
+        self.assertEqual(bones.tolist(), list(range(6)) * 3)
+
+    def test_refuse(self):
+        def refused(change):
+            quads = two_quads()
+            lod = self.lod_mesh(quads)
+            change(quads, lod)
+            vertex_data = quads.shared_vertex_data
+            self.assertFalse(quads.merge_lods([(10.0, lod)]))
+            # Nothing changed
+            self.assertIs(quads.shared_vertex_data, vertex_data)
+            self.assertEqual(quads.generated_lods, [])
+            self.assertTrue(all(submesh.lod_indices == [] for submesh in quads.submeshes))
+
+        def other_layout(quads, lod):
+            lod.shared_vertex_data.uvs = []
+        def other_skeleton(quads, lod):
+            lod.skeleton_name = 'other.skeleton'
+        def lod_poses(quads, lod):
+            lod.poses.append(mesh_data.Pose('pose', None, np.array([0]), np.float32([[0, 0, 1]])))
+        def unknown_submesh(quads, lod):
+            lod.submeshes[1].name = 'c'
+        def dedicated_geometry(quads, lod):
+            quads.make_geometry_dedicated()
+        def needs_32_bit_indices(quads, lod):
+            vertex_data = lod.shared_vertex_data
+            lod.shared_vertex_data = mesh_data.VertexData(np.zeros((65535, 3), dtype=np.float32), np.zeros((65535, 3), dtype=np.float32),
+                uvs=[np.zeros((65535, 2), dtype=np.float32)])
+            lod.shared_vertex_data.bone_assignments = vertex_data.bone_assignments
+
+        for change in (other_layout, other_skeleton, lod_poses, unknown_submesh, dedicated_geometry, needs_32_bit_indices):
+            with self.subTest(change.__name__):
+                refused(change)
+
+class TestMeshOptimizer(unittest.TestCase):
+    def test_optimize_vertex_cache(self):
+        rng = np.random.default_rng(4)
+        indices = grid_triangles(60, 60)
+        indices = indices[rng.permutation(len(indices))]
+
+        optimized = mesh_optimizer.optimize_vertex_cache(indices)
+
+        self.assertEqual(sorted_triangles(optimized), sorted_triangles(indices))
+        before = mesh_optimizer.average_cache_miss_ratio(indices)
+        after = mesh_optimizer.average_cache_miss_ratio(optimized)
+        self.assertGreater(before, 2.9)
+        self.assertLess(after, 0.8)
+
+    def test_average_cache_miss_ratio(self):
+        # Every vertex misses once while it stays in the cache
+        self.assertEqual(mesh_optimizer.average_cache_miss_ratio(np.array([[0, 1, 2], [2, 1, 3]])), 2.0)
+        # With a cache of 3 vertices, vertex 0 has been pushed out by the time it is used again
+        self.assertEqual(mesh_optimizer.average_cache_miss_ratio(np.array([[0, 1, 2], [3, 4, 0]]), 3), 3.0)
+        self.assertEqual(mesh_optimizer.average_cache_miss_ratio(np.zeros((0, 3), dtype=np.int64)), 0.0)
+
+    def test_optimize_vertex_fetch(self):
+        positions = grid_positions(3, 3)
+        indices = grid_triangles(3, 3)[::-1].copy()
+        grid = mesh_data.MeshData('grid')
+        grid.shared_vertex_data = mesh_data.VertexData(positions, np.zeros_like(positions))
+        grid.submeshes.append(mesh_data.SubMesh('grid', None, indices))
+        grid.poses.append(mesh_data.Pose('corner', None, np.array([0]), np.float32([[0, 0, 1]])))
+
+        mesh_optimizer.optimize_vertex_fetch(grid)
+
+        # Vertices in order of first use, the triangles still have the same corners
+        new_indices = grid.submeshes[0].indices.reshape(-1)
+        self.assertEqual(list(dict.fromkeys(new_indices.tolist())), list(range(len(positions))))
+        self.assertTrue(np.array_equal(grid.shared_vertex_data.positions[grid.submeshes[0].indices], positions[indices]))
+        self.assertTrue(np.array_equal(grid.shared_vertex_data.positions[grid.poses[0].indices], positions[[0]]))
+
+    def test_estimate_overdraw(self):
+        # Two triangles on top of each other, facing the view along +Z
+        positions = np.float32([[0, 0, 0], [0, 1, 0], [1, 0, 0], [0, 0, 1], [0, 1, 1], [1, 0, 1]])
+        near_first = np.array([[0, 1, 2], [3, 4, 5]])
+
+        self.assertEqual(mesh_optimizer.estimate_overdraw(positions, near_first), 1.0)
+        self.assertEqual(mesh_optimizer.estimate_overdraw(positions, near_first[::-1]), 2.0)
+
+    def test_optimize_overdraw(self):
+        rng = np.random.default_rng(8)
+        positions = grid_positions(40, 40)
+        # Bend the grid into a half pipe, so some triangles hide others
+        angle = positions[:, 0] / 40 * np.pi
+        positions = np.stack((np.cos(angle), positions[:, 1] / 40, np.sin(angle)), axis=1).astype(np.float32)
+        indices = mesh_optimizer.optimize_vertex_cache(grid_triangles(40, 40)[rng.permutation(2 * 40 * 40)])
+
+        optimized = mesh_optimizer.optimize_overdraw(positions, indices, 1.05)
+
+        self.assertEqual(sorted_triangles(optimized), sorted_triangles(indices))
+        self.assertLessEqual(mesh_optimizer.estimate_overdraw(positions, optimized), mesh_optimizer.estimate_overdraw(positions, indices))
+
+class TestSplitSubmeshes(unittest.TestCase):
+    def test_split_triangles(self):
+        indices = grid_triangles(300, 300)
+        runs = mesh_data.split_triangles(indices, 65535)
+
+        self.assertGreater(len(runs), 1)
+        for run in runs:
+            self.assertLessEqual(len(np.unique(run)), 65535)
+        self.assertTrue(np.array_equal(np.concatenate(runs), indices))
+
+    def split_grid(self):
+        rng = np.random.default_rng(5)
+        indices = grid_triangles(300, 300)
+        indices = indices[rng.permutation(len(indices))]
+        positions = grid_positions(300, 300)
+
+        grid = mesh_data.MeshData('grid')
+        grid.shared_vertex_data = mesh_data.VertexData(positions, np.zeros_like(positions))
+        grid.submeshes.append(mesh_data.SubMesh('grid', 'material', indices))
+        grid.poses.append(mesh_data.Pose('lift', None, np.arange(len(positions)), np.tile(np.float32([0, 0, 1]), (len(positions), 1))))
+        grid.make_geometry_dedicated()
+        grid.split_submeshes(65535)
+        return grid, positions, indices
+
+    def test_split_submeshes(self):
+        grid, positions, indices = self.split_grid()
+
+        self.assertGreater(len(grid.submeshes), 1)
+        self.assertEqual([submesh.name for submesh in grid.submeshes[:2]], ['grid', 'grid.1'])
+        for submesh in grid.submeshes:
+            self.assertEqual(submesh.material, 'material')
+            self.assertLessEqual(submesh.vertex_data.vertex_count, 65535)
+            self.assertLess(submesh.indices.max(), submesh.vertex_data.vertex_count)
+        # The same triangles, with few vertices duplicated between the pieces
+        triangles = np.concatenate([submesh.vertex_data.positions[submesh.indices] for submesh in grid.submeshes])
+        self.assertEqual(sorted(map(bytes, triangles)), sorted(map(bytes, positions[indices])))
+        self.assertLess(sum(submesh.vertex_data.vertex_count for submesh in grid.submeshes), len(positions) * 1.1)
+
+    def test_poses_follow_the_pieces(self):
+        grid, positions, indices = self.split_grid()
+
+        # The pose moved every vertex, so it moves every vertex of every piece
+        self.assertEqual([pose.target for pose in grid.poses], list(range(len(grid.submeshes))))
+        for pose, submesh in zip(grid.poses, grid.submeshes):
+            self.assertEqual(pose.indices.tolist(), list(range(submesh.vertex_data.vertex_count)))
+
+    def test_lod_levels_are_not_dropped(self):
+        positions = grid_positions(300, 300)
+        grid = mesh_data.MeshData('grid')
+        grid.submeshes.append(mesh_data.SubMesh('grid', 'material', grid_triangles(300, 300),
+            mesh_data.VertexData(positions, np.zeros_like(positions))))
+        grid.submeshes[0].lod_indices.append(grid_triangles(300, 300)[::2])
+
+        with self.assertRaises(AssertionError):
+            grid.split_submeshes(65535)
+
+class TestEdgeData(unittest.TestCase):
+    def triangle_mesh(self, positions, triangles):
+        positions = np.float32(positions)
+        vertex_data = mesh_data.VertexData(positions, np.tile(np.float32([0, 0, 1]), (len(positions), 1)))
+        triangle_mesh = mesh_data.MeshData('triangles')
+        triangle_mesh.shared_vertex_data = vertex_data
+        triangle_mesh.submeshes.append(mesh_data.SubMesh('a', None, np.array(triangles)))
+        return triangle_mesh
+
+    def edges(self, edge_data):
+        return np.concatenate([edges for vertex_set, start, count, edges in edge_data.groups])
+
+    def test_closed_mesh(self):
+        tetrahedron = [[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]]
+        triangles = [[0, 2, 1], [0, 1, 3], [1, 2, 3], [0, 3, 2]]
+        edge_data = mesh_data.EdgeData(self.triangle_mesh(tetrahedron, triangles))
+
+        self.assertTrue(edge_data.closed)
+        self.assertEqual(len(edge_data.triangles), 4)
+        edges = self.edges(edge_data)
+        self.assertEqual(len(edges), 6)
+        self.assertFalse(edges['degenerate'].any())
+        self.assertFalse((edges['triangles'] == mesh_data.EdgeData.NO_TRIANGLE).any())
+
+    def test_split_vertices_are_shared(self):
+        # Flat shaded tetrahedron, every face has its own vertices and its own submesh with dedicated geometry
+        tetrahedron = np.float32([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]])
+        flat = mesh_data.MeshData('flat')
+        for index, triangle in enumerate([[0, 2, 1], [0, 1, 3], [1, 2, 3], [0, 3, 2]]):
+            vertex_data = mesh_data.VertexData(tetrahedron[triangle], np.tile(np.float32([0, 0, 1]), (3, 1)))
+            flat.submeshes.append(mesh_data.SubMesh(str(index), None, np.array([[0, 1, 2]]), vertex_data))
+        edge_data = mesh_data.EdgeData(flat)
+
+        self.assertTrue(edge_data.closed)
+        self.assertEqual(len(edge_data.groups), 4)
+        self.assertEqual(len(self.edges(edge_data)), 6)
+        self.assertEqual(sorted(np.unique(edge_data.triangles['shared_vertices']).tolist()), [0, 1, 2, 3])
+
+    def test_open_mesh(self):
+        quad = [[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]]
+        edge_data = mesh_data.EdgeData(self.triangle_mesh(quad, [[0, 1, 2], [0, 2, 3]]))
+
+        self.assertFalse(edge_data.closed)
+        edges = self.edges(edge_data)
+        self.assertEqual(len(edges), 5)
+        # Only the diagonal has two triangles
+        self.assertEqual(edges['degenerate'].sum(), 4)
+        self.assertEqual(edges['triangles'][~edges['degenerate']].tolist(), [[0, 1]])
+        self.assertTrue((edges['triangles'][edges['degenerate'], 1] == mesh_data.EdgeData.NO_TRIANGLE).all())
+
+    def test_degenerate_triangles(self):
+        # The last triangle has two corners at the same position
+        positions = [[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0], [1, 1, 0]]
+        edge_data = mesh_data.EdgeData(self.triangle_mesh(positions, [[0, 1, 2], [0, 2, 3], [1, 2, 4]]))
+
+        self.assertEqual(len(edge_data.triangles), 2)
+        self.assertEqual(len(self.edges(edge_data)), 5)
+
+    def test_non_manifold_edge(self):
+        # Three triangles on the edge between vertex 0 and 1
+        positions = [[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1]]
+        edge_data = mesh_data.EdgeData(self.triangle_mesh(positions, [[0, 1, 2], [1, 0, 3], [1, 0, 4]]))
+
+        self.assertFalse(edge_data.closed)
+        edges = self.edges(edge_data)
+        self.assertEqual(len(edges), 8)
+        # The first two triangles share the edge, the third one gets an edge of its own
+        self.assertEqual(edges['triangles'][~edges['degenerate']].tolist(), [[0, 1]])
+        self.assertEqual(sorted(edges['vertices'][edges['triangles'][:, 0] == 2].tolist()), [[0, 4], [1, 0], [4, 1]])
+
+class TestMeshSimplifier(unittest.TestCase):
+    def grid_mesh(self, seam=False):
+        """
+        Flat 16 x 16 grid facing +Z. Left and right of x = 8 are different submeshes,
+        or with seam one submesh where the vertices at x = 8 are split up like on a UV seam
+        """
+        positions = grid_positions(16, 16)
+        triangles = grid_triangles(16, 16)
+        right = positions[triangles].mean(axis=1)[:, 0] > 8
+        grid = mesh_data.MeshData('grid')
+        if seam:
+            on_seam = np.flatnonzero(positions[:, 0] == 8)
+            remap = np.arange(len(positions))
+            remap[on_seam] = len(positions) + np.arange(len(on_seam))
+            triangles[right] = remap[triangles[right]]
+            positions = np.concatenate((positions, positions[on_seam]))
+            grid.submeshes.append(mesh_data.SubMesh('grid', None, triangles))
+        else:
+            grid.submeshes.append(mesh_data.SubMesh('left', None, triangles[~right]))
+            grid.submeshes.append(mesh_data.SubMesh('right', None, triangles[right]))
+        grid.shared_vertex_data = mesh_data.VertexData(positions, np.tile(np.float32([0, 0, 1]), (len(positions), 1)))
+        return grid
+
+    def lod_triangles(self, grid, level):
+        return np.concatenate([submesh.lod_indices[level] for submesh in grid.submeshes])
+
+    def test_triangle_counts_go_down(self):
+        grid = self.grid_mesh()
+        mesh_simplifier.generate_lod_levels(grid, 3, 100, 0.5)
+
+        self.assertEqual(grid.generated_lods, [100, 200, 300])
+        counts = [sum(len(submesh.indices) for submesh in grid.submeshes)]
+        counts += [len(self.lod_triangles(grid, level)) for level in range(3)]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        self.assertEqual(len(set(counts)), 4)
+
+    def test_no_flips(self):
+        grid = self.grid_mesh()
+        mesh_simplifier.generate_lod_levels(grid, 3, 100, 0.5)
+        positions = grid.shared_vertex_data.positions
+
+        for level in range(3):
+            corners = positions[self.lod_triangles(grid, level)].astype(np.float64)
+            normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+            self.assertTrue((normals[:, 2] > 0).all())
+
+    def test_material_borders_are_locked(self):
+        grid = self.grid_mesh()
+        mesh_simplifier.generate_lod_levels(grid, 2, 100, 0.5)
+        border = np.flatnonzero(grid.shared_vertex_data.positions[:, 0] == 8)
+
+        self.assertEqual(len(grid.generated_lods), 2)
+        for submesh in grid.submeshes:
+            for lod in submesh.lod_indices:
+                self.assertTrue(np.isin(border, lod).all())
+                self.assertEqual(set(np.unique(lod)) - set(np.unique(submesh.indices)), set())
+
+    def test_seams_are_locked(self):
+        grid = self.grid_mesh(seam=True)
+        mesh_simplifier.generate_lod_levels(grid, 2, 100, 0.5)
+        positions = grid.shared_vertex_data.positions
+        left = np.flatnonzero(positions[:289, 0] == 8)
+        right = np.arange(289, len(positions))
+
+        self.assertEqual(len(grid.generated_lods), 2)
+        for lod in grid.submeshes[0].lod_indices:
+            self.assertTrue(np.isin(left, lod).all() and np.isin(right, lod).all())
+            # Triangles stay on their side of the seam
+            centroids = positions[lod].mean(axis=1)[:, 0]
+            self.assertFalse((lod[centroids < 8] >= 289).any())
+            self.assertFalse(np.isin(lod[centroids > 8], left).any())
+
+class TestSimpleSaxWriter(ConfigTestCase):
+    def test_write_vertices_same_as_leaf_tag(self):
+        rng = np.random.default_rng(1)
+        count = 100
+        positions = rng.normal(size=(count, 3)).astype(np.float32)
+        normals = rng.normal(size=(count, 3)).astype(np.float32)
+        tangents = rng.normal(size=(count, 4)).astype(np.float32)
+        colors = rng.random((count, 4)).astype(np.float32)
+        uvs = [rng.random((count, 2)).astype(np.float32) for i in range(2)]
+
+        output = io.StringIO()
+        doc = xml.SimpleSaxWriter(output, 'vertexbuffer', {})
+        doc.write_vertices(positions, normals, tangents, colors, uvs, chunk_size=7)
+        doc.close()
+
+        expected = io.StringIO()
+        doc = xml.SimpleSaxWriter(expected, 'vertexbuffer', {})
+        for i in range(count):
+            doc.start_tag('vertex', {})
+            doc.leaf_tag('position', { axis : '%6f' % value for axis, value in zip('xyz', positions[i]) })
+            doc.leaf_tag('normal', { axis : '%6f' % value for axis, value in zip('xyz', normals[i]) })
+            doc.leaf_tag('tangent', { axis : '%6f' % value for axis, value in zip('xyzw', tangents[i]) })
+            doc.leaf_tag('colour_diffuse', {'value' : '%6f %6f %6f %6f' % tuple(colors[i])})
+            for uv in uvs:
+                doc.leaf_tag('texcoord', {'u' : '%6f' % uv[i][0], 'v' : '%6f' % (1.0 - uv[i][1])})
+            doc.end_tag('vertex')
+        doc.close()
+
+        self.assertEqual(output.getvalue(), expected.getvalue())
+
+    def test_write_faces_and_bone_assignments_same_as_leaf_tag(self):
+        rng = np.random.default_rng(2)
+        faces = rng.integers(0, 100000, size=(50, 3))
+        vertices = rng.integers(0, 1000, size=50)
+        bones = rng.integers(0, 50, size=50)
+        weights = rng.random(50).astype(np.float32)
+
+        output = io.StringIO()
+        doc = xml.SimpleSaxWriter(output, 'submesh', {})
+        doc.write_faces(faces, chunk_size=16)
+        doc.write_bone_assignments(vertices, bones, weights, chunk_size=16)
+        doc.close()
+
+        expected = io.StringIO()
+        doc = xml.SimpleSaxWriter(expected, 'submesh', {})
+        for v1, v2, v3 in faces.tolist():
+            doc.leaf_tag('face', {'v1' : str(v1), 'v2' : str(v2), 'v3' : str(v3)})
+        for vertex, bone, weight in zip(vertices.tolist(), bones.tolist(), weights.tolist()):
+            doc.leaf_tag('vertexboneassignment', {'vertexindex' : str(vertex), 'boneindex' : str(bone), 'weight' : '%6f' % weight})
+        doc.close()
+
+        self.assertEqual(output.getvalue(), expected.getvalue())
+
+class TestRDocumentWriter(unittest.TestCase):
+    def random_tree(self, rng, depth=0):
+        tag = rng.choice(['node', 'entity', 'a', 'position'])
+        names = rng.choice(['name', 'x', 'y', 'quote'], size=rng.integers(0, 4), replace=False)
+        attributes = { name : rng.choice(['1', 'a"b', '<&>', 3.5]) for name in names }
+        children = [self.random_tree(rng, depth + 1) for i in range(rng.integers(0, 4))] if depth < 4 else []
+        return tag, attributes, children
+
+    def build(self, doc, tree):
+        tag, attributes, children = tree
+        element = doc.createElement(tag)
+        for name, value in attributes.items():
+            element.setAttribute(name, value)
+        for child in children:
+            element.appendChild(self.build(doc, child))
+        return element
+
+    def stream(self, doc, tree, rng, depth=0):
+        tag, attributes, children = tree
+        if depth >= 2 and rng.random() < 0.5:
+            doc.append(self.build(doc, tree))
+        elif not children and rng.random() < 0.5:
+            doc.leaf_tag(tag, attributes)
+        else:
+            doc.start_tag(tag, attributes)
+            for child in children:
+                self.stream(doc, child, rng, depth + 1)
+            doc.end_tag(tag)
+
+    def test_same_as_toprettyxml(self):
+        rng = np.random.default_rng(3)
+        for trial in range(50):
+            tree = self.random_tree(rng)
+
+            document = xml.RDocument()
+            document.addComment('exporter')
+            document.appendChild(self.build(document, tree))
+
+            output = io.StringIO()
+            doc = xml.RDocumentWriter(output, buffer_size=int(rng.choice([1, 50, 1<<20])))
+            doc.addComment('exporter')
+            self.stream(doc, tree, rng)
+            doc.close()
+
+            self.assertEqual(output.getvalue(), document.toprettyxml())
+
+class TestIndentedWriter(unittest.TestCase):
+    def test_write_to(self):
+        w = util.IndentedWriter()
+        with w.iword('material').word('Mat\u00e9rial').embed():
+            for i in range(10):
+                with w.iword('pass').word(i).embed():
+                    w.iline('ambient 1 1 1 1')
+
+        text = io.StringIO()
+        w.write_to(text, chunk_size=3)
+        binary = io.BytesIO()
+        w.write_to(binary, chunk_size=3)
+
+        self.assertEqual(text.getvalue(), w.text)
+        self.assertEqual(binary.getvalue(), w.text.encode('utf-8'))
+        self.assertTrue(w.text.endswith('    }\n}\n'))
+
+    def test_state_per_instance(self):
+        w = util.IndentedWriter()
+        with w.iword('material').embed():
+            other = util.IndentedWriter()
+            other.iline('technique')
+            self.assertEqual(other.text, 'technique\n')
+
+class TestNumberFormat(unittest.TestCase):
+    def test_fixed_precision(self):
+        values = np.float32([0.0, -0.5, 1.0 / 3.0, 12345.678, -1e-7])
+        self.assertEqual(number_format.format_floats(values, 6).tolist(), ['%6f' % value for value in values])
+        self.assertEqual(number_format.format_floats(values, 2).tolist(), ['%.2f' % value for value in values])
+        self.assertEqual(number_format.float_spec(3), '%.3f')
+
+    def test_shortest_round_trips_float32(self):
+        rng = np.random.default_rng(9)
+        values = np.concatenate((
+            (rng.normal(size=1000) * 10.0 ** rng.integers(-30, 30, size=1000)).astype(np.float32),
+            rng.integers(-1000, 1000, size=100).astype(np.float32) / 8,
+            np.float32([0.0, -0.0, 1.0, 0.1, 1e-38, 3.4e38, np.finfo(np.float32).tiny]),
+        ))
+
+        text = number_format.format_floats(values, number_format.SHORTEST)
+
+        read_back = np.array([np.float32(float(number)) for number in text.tolist()])
+        self.assertTrue(np.array_equal(read_back.view(np.uint32), values.view(np.uint32)))
+        self.assertEqual([number_format.format_float(value, number_format.SHORTEST) for value in values[:50]], text[:50].tolist())
+        # Rounded data gets short
+        self.assertEqual(number_format.format_floats(np.float32([0.1, 2.5, 100.0]), number_format.SHORTEST).tolist(), ['0.1', '2.5', '100.0'])
+
+class RecordingMeshSerializer(mesh_serializer.MeshSerializer):
+    """
+    Remembers (chunk id, start, end, depth) of every chunk written
+    """
+    def __init__(self, f):
+        super().__init__(f)
+        self.written_chunks = []
+
+    def start_chunk(self, chunk_id):
+        self.written_chunks.append([chunk_id, self.f.tell(), None, len(self.chunks)])
+        super().start_chunk(chunk_id)
+
+    def end_chunk(self):
+        depth = len(self.chunks) - 1
+        chunk = [chunk for chunk in self.written_chunks if chunk[3] == depth and chunk[2] is None][-1]
+        super().end_chunk()
+        chunk[2] = self.f.tell()
+
+    def chunks_with_id(self, chunk_id):
+        return [(start, end) for written_id, start, end, depth in self.written_chunks if written_id == chunk_id]
+
+class TestMeshSerializer(ConfigTestCase):
+    def write(self, grid):
+        f = io.BytesIO()
+        serializer = RecordingMeshSerializer(f)
+        serializer.write_mesh(grid)
+        return f.getvalue(), serializer
+
+    def grid_mesh(self):
+        rng = np.random.default_rng(6)
+        positions = grid_positions(4, 4)
+        vertex_data = mesh_data.VertexData(positions, np.tile(np.float32([0, 0, 1]), (len(positions), 1)),
+            uvs=[rng.random((len(positions), 2)).astype(np.float32)])
+        vertex_data.bone_assignments = (np.arange(len(positions)), np.zeros(len(positions), dtype=np.int64), np.ones(len(positions), dtype=np.float32))
+
+        grid = mesh_data.MeshData('grid')
+        grid.shared_vertex_data = vertex_data
+        grid.skeleton_name = 'grid.skeleton'
+        triangles = grid_triangles(4, 4)
+        grid.submeshes.append(mesh_data.SubMesh('a', 'material_a', triangles[:10]))
+        grid.submeshes.append(mesh_data.SubMesh('b', 'material_b', triangles[10:]))
+        return grid
+
+    def test_chunks(self):
+        data, serializer = self.write(self.grid_mesh())
+
+        # Header, then the mesh chunk up to the end of the file
+        self.assertEqual(struct.unpack_from('<H', data)[0], mesh_serializer.M_HEADER)
+        header = data[2:data.index(b'\n') + 1]
+        self.assertEqual(header, b'[MeshSerializer_v1.100]\n')
+        self.assertEqual(serializer.written_chunks[0][:2], [mesh_serializer.M_MESH, 2 + len(header)])
+        self.assertEqual(serializer.written_chunks[0][2], len(data))
+
+        # Every chunk starts with its id and its length (including the 6 byte header), and lies within its parent
+        parents = []
+        for chunk_id, start, end, depth in serializer.written_chunks:
+            self.assertEqual(struct.unpack_from('<HI', data, start), (chunk_id, end - start))
+            del parents[depth:]
+            if parents:
+                self.assertTrue(parents[-1][0] + 6 <= start and end <= parents[-1][1])
+            parents.append((start, end))
+
+        ids = [chunk[0] for chunk in serializer.written_chunks]
+        for chunk_id in (mesh_serializer.M_GEOMETRY, mesh_serializer.M_GEOMETRY_VERTEX_BUFFER_DATA, mesh_serializer.M_MESH_SKELETON_LINK,
+                         mesh_serializer.M_MESH_BOUNDS, mesh_serializer.M_SUBMESH_NAME_TABLE):
+            self.assertIn(chunk_id, ids)
+        self.assertEqual(ids.count(mesh_serializer.M_SUBMESH), 2)
+
+    def test_read_back(self):
+        grid = self.grid_mesh()
+        data, serializer = self.write(grid)
+        vertex_data = grid.shared_vertex_data
+
+        # Vertex elements: source, type, semantic, offset, index
+        elements = [struct.unpack_from('<5H', data, start + 6) for start, end in serializer.chunks_with_id(mesh_serializer.M_GEOMETRY_VERTEX_ELEMENT)]
+        buffers = {}
+        for start, end in serializer.chunks_with_id(mesh_serializer.M_GEOMETRY_VERTEX_BUFFER):
+            source, vertex_size = struct.unpack_from('<2H', data, start + 6)
+            buffer = np.frombuffer(data[start + 16:end], dtype=np.uint8)
+            buffers[source] = buffer.reshape(vertex_data.vertex_count, vertex_size)
+
+        def element(semantic, element_type, dtype, columns):
+            source, found_type, found_semantic, offset, index = [element for element in elements if element[2] == semantic][0]
+            self.assertEqual(found_type, element_type)
+            size = np.dtype(dtype).itemsize * columns
+            return np.ascontiguousarray(buffers[source][:, offset:offset + size]).view(dtype)
+
+        self.assertTrue(np.array_equal(element(mesh_serializer.VES_POSITION, mesh_serializer.VET_FLOAT3, '<f4', 3), vertex_data.positions))
+        self.assertTrue(np.array_equal(element(mesh_serializer.VES_NORMAL, mesh_serializer.VET_FLOAT3, '<f4', 3), vertex_data.normals))
+        texcoords = element(mesh_serializer.VES_TEXTURE_COORDINATES, mesh_serializer.VET_FLOAT2, '<f4', 2)
+        self.assertTrue(np.array_equal(texcoords[:, 0], vertex_data.uvs[0][:, 0]))
+        self.assertTrue(np.allclose(texcoords[:, 1], 1.0 - vertex_data.uvs[0][:, 1]))
+
+        # Submesh: material, uses shared vertices, index count, 32 bit indices, the indices
+        for submesh, (start, end) in zip(grid.submeshes, serializer.chunks_with_id(mesh_serializer.M_SUBMESH)):
+            offset = data.index(b'\n', start + 6) + 1
+            self.assertEqual(data[start + 6:offset - 1].decode(), submesh.material)
+            shared, count, use_32bit_indexes = struct.unpack_from('<?I?', data, offset)
+            self.assertEqual((shared, count, use_32bit_indexes), (True, submesh.indices.size, False))
+            indices = np.frombuffer(data, dtype='<u2', count=count, offset=offset + 6)
+            self.assertTrue(np.array_equal(indices, submesh.indices.reshape(-1)))
+
+        # Bone assignments: a 12 byte chunk per assignment, right after the skeleton link
+        start, end = serializer.chunks_with_id(mesh_serializer.M_MESH_SKELETON_LINK)[0]
+        self.assertEqual(data[start + 6:end], b'grid.skeleton\n')
+        records = np.frombuffer(data, dtype=[('id', '<u2'), ('length', '<u4'), ('vertex', '<u4'), ('bone', '<u2'), ('weight', '<f4')],
+            count=vertex_data.vertex_count, offset=end)
+        self.assertTrue(np.all(records['id'] == mesh_serializer.M_MESH_BONE_ASSIGNMENT) and np.all(records['length'] == 16))
+        self.assertTrue(np.array_equal(records['vertex'], np.arange(vertex_data.vertex_count)))
+
+    def test_packed_type_values(self):
+        # VertexElementType of OgreHardwareVertexBuffer.h (Ogre 13.4 and newer)
+        self.assertEqual(mesh_serializer.VET_COLOUR_ABGR, 11)
+        self.assertEqual(mesh_serializer.VET_UBYTE4_NORM, 30)
+        self.assertEqual(mesh_serializer.VET_INT_10_10_10_2_NORM, 39)
+        self.assertEqual(mesh_serializer.VET_HALF2, 41)
+        self.assertEqual(mesh_serializer.VET_HALF4, 43)
+
+    def test_only_colours_are_packed(self):
+        config.CONFIG['VERTEX_PACKING'] = 'npuc'
+        config.CONFIG['PACK_INT_10_10_10_2'] = True
+        grid = self.grid_mesh()
+        grid.skeleton_name = None
+        vertex_data = grid.shared_vertex_data
+        vertex_data.bone_assignments = None
+        vertex_data.colors = np.full((vertex_data.vertex_count, 4), 0.5, dtype=np.float32)
+        data, serializer = self.write(grid)
+
+        element_types = { semantic : element_type for source, element_type, semantic, offset, index in
+            (struct.unpack_from('<5H', data, start + 6) for start, end in serializer.chunks_with_id(mesh_serializer.M_GEOMETRY_VERTEX_ELEMENT)) }
+        self.assertEqual(element_types, {
+            mesh_serializer.VES_POSITION : mesh_serializer.VET_FLOAT3,
+            mesh_serializer.VES_NORMAL : mesh_serializer.VET_FLOAT3,
+            mesh_serializer.VES_DIFFUSE : mesh_serializer.VET_UBYTE4_NORM,
+            mesh_serializer.VES_TEXTURE_COORDINATES : mesh_serializer.VET_FLOAT2,
+        })
+
+class TestStagingDir(unittest.TestCase):
+    def setUp(self):
+        self.saved_staging_dir = config.CONFIG.get('STAGING_DIR')
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.export_dir = os.path.join(self.temp_dir.name, 'export')
+        os.mkdir(self.export_dir)
+
+    def tearDown(self):
+        config.CONFIG['STAGING_DIR'] = self.saved_staging_dir
+        self.temp_dir.cleanup()
+
+    def test_staging(self):
+        config.CONFIG['STAGING_DIR'] = self.temp_dir.name
+        staging = util.staging_dir(self.export_dir)
+        self.assertEqual(os.path.dirname(staging), self.temp_dir.name)
+
+        with open(os.path.join(staging, 'a.mesh'), 'w') as f:
+            f.write('mesh')
+        util.unstage(self.export_dir, 'a.mesh', 'a.mesh.xml')
+
+        with open(os.path.join(self.export_dir, 'a.mesh')) as f:
+            self.assertEqual(f.read(), 'mesh')
+        self.assertFalse(os.path.exists(staging))
+
+    def test_fallback_to_export_dir(self):
+        for staging_dir in ('', os.path.join(self.temp_dir.name, 'missing')):
+            config.CONFIG['STAGING_DIR'] = staging_dir
+            self.assertEqual(util.staging_dir(self.export_dir), self.export_dir)
+
+result = unittest.main(argv=[sys.argv[0]], exit=False).result
+if not result.wasSuccessful():
+    sys.exit(1)